@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -9,6 +11,8 @@ from src.api.project_routes import router as project_router
 from src.api.payment_routes import router as payment_router
 from src.routers.assets import router as assets_router
 from src.api.ipo_routes import router as ipo_router
+from src.utils.dataforseo_client import dataforseo_client
+from src.utils.metering import meter
 
 import sentry_sdk
 import os
@@ -27,7 +31,15 @@ sentry_sdk.init(
     profiles_sample_rate=1.0,
 )
 
-app = FastAPI(title="Keiracom v3.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Holds the pooled DataForSEO session open for the lifetime of the app
+    async with dataforseo_client:
+        yield
+    await meter.flush()
+
+
+app = FastAPI(title="Keiracom v3.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -0,0 +1,77 @@
+"""
+Import-time budget check for the entry points that start often (API workers,
+Prefect task processes).
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+without GOOGLE_API_KEY, and the script fails if it goes over its budget or
+pulls in a module that should only load on first use (the Gemini SDK,
+pyarrow).
+
+    python scripts/ops/import_budget.py
+"""
+import os
+import subprocess
+import sys
+
+# Module -> budget in milliseconds of cumulative import time. Most of it is
+# settings (pydantic), SQLAlchemy and, for flows and tasks, Prefect itself;
+# the Gemini SDK alone used to add about a second to each of these.
+BUDGETS = {
+    "src.utils.gemini_client": 1000,
+    "src.utils.ai": 1000,
+    "src.tasks.analysis_tasks": 3000,
+    "src.flows.engine_06_serp_heist": 3000,
+    "src.api.main": 1500,
+}
+
+# Loaded on first use only
+LAZY_MODULES = ("google.generativeai", "pyarrow")
+
+
+def measure(module: str) -> tuple[float, set[str]]:
+    env = {key: value for key, value in os.environ.items() if key != "GOOGLE_API_KEY"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    total_us, loaded = 0, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line.split("|"))
+        if not cumulative.isdigit():
+            continue  # Header row
+        loaded.add(name)
+        if name == module:
+            total_us = int(cumulative)
+    return total_us / 1000, loaded
+
+
+def main() -> int:
+    failures = 0
+    print(f"{'MODULE':<40} | {'MS':>7} | {'BUDGET':>7} | STATUS")
+    print("-" * 72)
+    for module, budget in BUDGETS.items():
+        try:
+            elapsed, loaded = measure(module)
+        except RuntimeError as e:
+            print(f"{module:<40} | {'-':>7} | {budget:>7} | ERROR\n{e}")
+            failures += 1
+            continue
+        eager = [name for name in LAZY_MODULES if name in loaded]
+        status = "OK"
+        if elapsed > budget:
+            status = "OVER BUDGET"
+        if eager:
+            status = f"LOADS {', '.join(eager)}"
+        if status != "OK":
+            failures += 1
+        print(f"{module:<40} | {elapsed:>7.0f} | {budget:>7} | {status}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,12 +2,19 @@
 API routes for triggering the 6 core Keiracom SEO Engines.
 
 This module provides a single, dynamic endpoint to trigger any of the
-Prefect workflows associated with the main SEO engines.
+Prefect workflows associated with the main SEO engines, and a server-sent
+events endpoint that streams an engine's generated asset as Gemini writes it.
 """
 
 from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.responses import StreamingResponse
 import asyncio
+import json
+from typing import Callable
+from sqlmodel import select
 from src.utils.auth import get_current_user
+from src.utils.metering import metering_scope
+from src.utils.models import Project
 
 # from src.engines.engine_02 import FreshnessAttackEngine
 # from src.engines.engine_05 import CannibalizationEngine
@@ -138,6 +145,108 @@ async def trigger_engine(engine_name: str, user: dict = Depends(get_current_user
         "detail": f"Successfully queued flow: {flow_to_run.name}",
     }
 
+# --- Streaming Assets ---
+# Engines whose generated asset can be streamed, mapped to a builder that turns
+# the request `target` into (prompt, generation_config, cacheable). The flow modules are
+# imported on first use so Prefect stays out of API startup; the prompts are
+# the flows' own, so a streamed asset is cached for the next flow run too.
+
+def _freshness_request(target: str) -> tuple[str, dict | None, Callable[[str], bool] | None]:
+    """`target` is the user's domain; streams the update for its top decaying page."""
+    from src.flows.engine_02_freshness_attack import build_freshness_prompt, get_decaying_pages
+
+    candidates = get_decaying_pages(target)
+    if not candidates:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No decaying pages found for '{target}'.")
+    return build_freshness_prompt(candidates[0]), None, None
+
+def _pillar_request(target: str) -> tuple[str, dict | None, Callable[[str], bool] | None]:
+    """`target` is the missing topic cluster; streams its pillar brief as JSON."""
+    from src.flows.engine_04_authority_architect import PillarBrief, build_pillar_prompt
+    from src.utils.gemini_client import JSON_MODE, json_prompt, schema_check
+
+    # Only a brief that validates is cached, since generate_json in the flow reads the same entry
+    return json_prompt(build_pillar_prompt(target), PillarBrief), JSON_MODE, schema_check(PillarBrief)
+
+STREAM_MAP = {
+    "freshness_attack": _freshness_request,
+    "authority_architect": _pillar_request,
+}
+
+async def _user_project_id(session: AsyncSession, user: dict, project_id: int | None) -> int:
+    """
+    The authenticated user's active project to bill: `project_id` if they own
+    it, otherwise their first one. Another user's project is a 404, so spend
+    can never be booked against someone else's budget.
+    """
+    stmt = select(Project.id).where(Project.user_id == user.get("sub"), Project.active == True)
+    if project_id is not None:
+        stmt = stmt.where(Project.id == project_id)
+    owned = (await session.exec(stmt.order_by(Project.id).limit(1))).first()
+    if owned is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found.")
+    return owned
+
+def _sse(event: str, data) -> str:
+    """One server-sent event; data is JSON-encoded so newlines in chunks survive."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.get("/stream/{engine_name}", summary="Stream an Engine's Generated Asset")
+async def stream_engine_asset(
+    engine_name: str,
+    target: str,
+    project_id: int | None = None,
+    session: AsyncSession = Depends(get_db),
+    user: dict = Depends(get_current_user),
+):
+    """
+    Streams the asset an engine generates as server-sent events: a `chunk`
+    event per piece of text, then `done`, or `error` if generation failed.
+
+    Generation is billed to `project_id`, which must be one of the user's
+    active projects (defaults to their first).
+
+    Supported engines:
+    - `freshness_attack` (`target` = domain): the freshness update (Markdown)
+    - `authority_architect` (`target` = topic cluster): the pillar brief (JSON)
+    """
+    build_request = STREAM_MAP.get(engine_name)
+    if not build_request:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Engine '{engine_name}' cannot stream. Available engines: {list(STREAM_MAP.keys())}",
+        )
+    project_id = await _user_project_id(session, user, project_id)
+    prompt, generation_config, cacheable = build_request(target)
+    print(f"Streaming '{engine_name}' asset for user: '{user.get('sub')}'")
+
+    from src.utils.gemini_client import UNAVAILABLE_PREFIX, get_gemini_agent
+
+    async def events():
+        # The response has already started by now, so failures (e.g. no
+        # GOOGLE_API_KEY) can only be reported as an `error` event
+        sent = False
+        try:
+            agent = get_gemini_agent()
+            with metering_scope(project_id=project_id, engine=engine_name):
+                async for text in agent.generate_content_stream(prompt, generation_config, cacheable):
+                    if not sent and text.startswith(UNAVAILABLE_PREFIX):
+                        yield _sse("error", text)
+                        return
+                    sent = True
+                    yield _sse("chunk", text)
+        except Exception as e:
+            print(f"ERROR: Streaming '{engine_name}' asset failed: {e}")
+            yield _sse("error", "Analysis unavailable due to API error.")
+            return
+        yield _sse("done", {"engine": engine_name, "target": target})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # Don't let proxies buffer the stream
+    )
+
 # --- Integration Hint ---
 # To activate these engine routes, this router must be included in the main
 # FastAPI application. In `main.py`, add the following lines:
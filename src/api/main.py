@@ -1,7 +1,20 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from src.api.routes import router
+from src.utils.dataforseo_client import dataforseo_client
+from src.utils.metering import meter
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Holds the pooled DataForSEO session open for the lifetime of the app
+    async with dataforseo_client:
+        yield
+    await meter.flush()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(router, prefix="/api/v1")
 
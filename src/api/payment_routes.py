@@ -18,18 +18,21 @@ PLANS = {
         "name": "Startup",
         "price_aud": 297,
         "assets_limit": 25,
+        "daily_api_budget": 5.0,  # USD of DataForSEO + Gemini usage per project per day
         "features": ["Daily Portfolio Optimization", "Freshness Attack"]
     },
     "growth": {
         "name": "Growth",
         "price_aud": 697,
         "assets_limit": 100,
+        "daily_api_budget": 15.0,
         "features": ["Competitor Spy", "Strike Distance Engine"]
     },
     "enterprise": {
         "name": "Enterprise",
         "price_aud": 1297,
         "assets_limit": 500,
+        "daily_api_budget": 60.0,
         "features": ["Weekly Backlink Gap", "Cannibalization Engine"]
     }
 }
@@ -82,6 +85,8 @@ async def paddle_webhook(request: Request, db: AsyncSession = Depends(get_db)):
                     print(f"🛑 Deactivating Project {project_id}")
                 
                 project.subscription_id = data.get("id")
+                if custom_data.get("plan") in PLANS:
+                    project.plan = custom_data["plan"]
                 db.add(project)
                 await db.commit()
 
@@ -1,12 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import desc
+from datetime import date, datetime, timedelta
 from typing import List
 
-from src.api.schemas import DashboardResponse, RankingResponse
+from src.api.schemas import DashboardResponse, ProjectUsageResponse, RankHistoryResponse, RankingResponse
 from src.utils.database import get_db
-from src.models.core import User, Keyword, RankingLog
+from src.models.core import User, Keyword, KeywordLatestRank, KeywordTrend
+from src.tasks.history_tasks import load_rank_series, series_period
+from src.utils.metering import load_usage
 
 router = APIRouter()
 
@@ -18,30 +20,38 @@ async def get_dashboard_state(user_id: int, db: AsyncSession = Depends(get_db)):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Fetch Keywords for the User
-    keywords_result = await db.execute(select(Keyword).filter(Keyword.user_id == user_id))
-    keywords = keywords_result.scalars().all()
+    # Fetch every keyword with its latest rank and trend in one query (served from
+    # the keyword_latest_rank projection the harvest writer maintains and the
+    # keyword_trends table the compaction flow refreshes)
+    rows_result = await db.execute(
+        select(Keyword, KeywordLatestRank, KeywordTrend)
+        .outerjoin(KeywordLatestRank, KeywordLatestRank.keyword_id == Keyword.id)
+        .outerjoin(KeywordTrend, KeywordTrend.keyword_id == Keyword.id)
+        .filter(Keyword.user_id == user_id)
+        .order_by(Keyword.id)
+    )
 
     active_keywords_data: List[RankingResponse] = []
-    for keyword in keywords:
-        # Fetch the latest RankingLog for each keyword
-        latest_ranking_log_result = await db.execute(
-            select(RankingLog)
-            .filter(RankingLog.keyword_id == keyword.id)
-            .order_by(desc(RankingLog.created_at))
-            .limit(1)
-        )
-        latest_ranking_log = latest_ranking_log_result.scalars().first()
-
-        if latest_ranking_log:
+    for keyword, latest_rank, trend in rows_result.all():
+        trend_fields = {}
+        if trend:
+            trend_fields = {
+                "delta_7d": trend.delta_7d,
+                "delta_30d": trend.delta_30d,
+                "volatility": trend.volatility,
+                "page_1_event": trend.page_1_event,
+                "page_1_event_date": trend.page_1_event_date,
+            }
+        if latest_rank:
             active_keywords_data.append(
                 RankingResponse(
                     keyword=keyword.text,
                     domain=keyword.domain,
-                    rank=latest_ranking_log.rank,
+                    rank=latest_rank.rank,
                     device=keyword.device,
-                    analysis=latest_ranking_log.analysis,
-                    last_updated=latest_ranking_log.created_at
+                    analysis=latest_rank.analysis,
+                    last_updated=latest_rank.updated_at,
+                    **trend_fields
                 )
             )
         else:
@@ -53,7 +63,8 @@ async def get_dashboard_state(user_id: int, db: AsyncSession = Depends(get_db)):
                     rank=0,  # Or a suitable default
                     device=keyword.device,
                     analysis="No ranking data available yet.",
-                    last_updated=datetime.now() # placeholder
+                    last_updated=datetime.now(), # placeholder
+                    **trend_fields
                 )
             )
 
@@ -61,3 +72,24 @@ async def get_dashboard_state(user_id: int, db: AsyncSession = Depends(get_db)):
         user_email=user.email,
         active_keywords=active_keywords_data
     )
+
+
+@router.get("/keywords/{keyword_id}/history", response_model=RankHistoryResponse)
+async def get_rank_history(keyword_id: int, days: int = 365, db: AsyncSession = Depends(get_db)):
+    """
+    Rank chart data for a keyword, served from the rollup tiers.
+    The resolution (day, week or month) follows the requested range.
+    """
+    start = date.today() - timedelta(days=days)
+    period = series_period(start, date.today())
+    points = await load_rank_series(keyword_id, start, period=period, session=db)
+    return RankHistoryResponse(keyword_id=keyword_id, period=period, points=points)
+
+
+@router.get("/usage/{project_id}", response_model=ProjectUsageResponse)
+async def get_project_usage(project_id: int, day: date | None = None, db: AsyncSession = Depends(get_db)):
+    """
+    Paid API spend of a project for one day (default today) against its plan's
+    daily budget, broken down by engine and endpoint.
+    """
+    return ProjectUsageResponse(**await load_usage(project_id, day, session=db))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Optional
 
 class RankingResponse(BaseModel):
@@ -9,6 +9,11 @@ class RankingResponse(BaseModel):
     device: str
     analysis: Optional[str]
     last_updated: datetime
+    delta_7d: Optional[float] = None
+    delta_30d: Optional[float] = None
+    volatility: Optional[float] = None
+    page_1_event: Optional[str] = None
+    page_1_event_date: Optional[date] = None
 
     class Config:
         from_attributes = True
@@ -19,3 +24,40 @@ class DashboardResponse(BaseModel):
     
     class Config:
         from_attributes = True
+
+
+class RankPointResponse(BaseModel):
+    period_start: date
+    min_rank: int
+    max_rank: int
+    avg_rank: float
+    url_changes: int
+
+    class Config:
+        from_attributes = True
+
+class RankHistoryResponse(BaseModel):
+    keyword_id: int
+    period: str
+    points: List[RankPointResponse]
+
+
+class ApiUsageResponse(BaseModel):
+    engine: str
+    provider: str
+    endpoint: str
+    calls: int
+    errors: int
+    cost_units: float
+    latency_ms: float
+    rows: int
+
+    class Config:
+        from_attributes = True
+
+class ProjectUsageResponse(BaseModel):
+    project_id: int
+    day: date
+    spent: float
+    budget: Optional[float]
+    breakdown: List[ApiUsageResponse]
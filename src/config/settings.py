@@ -8,12 +8,28 @@ class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite+aiosqlite:///./test.db" 
 
     # AI
-    GOOGLE_API_KEY: SecretStr
+    GOOGLE_API_KEY: SecretStr | None = None  # Only needed by processes that call Gemini
 
     # External
     DATAFORSEO_LOGIN: str = "placeholder"
     DATAFORSEO_PASSWORD: str = "placeholder"
+    DATAFORSEO_BASE_URL: str = "https://api.dataforseo.com/v3/"  # Point at src/scripts/mock_dataforseo.py for load tests
     DATAFORSEO_API_TOKEN: str | None = None
+    DATAFORSEO_MAX_CONNECTIONS: int = 50  # Pooled keep-alive connections to the API
+    DATAFORSEO_DNS_TTL_SECONDS: int = 300
+    DATAFORSEO_KEEPALIVE_SECONDS: float = 30.0  # Idle pooled connections are closed after this long
+    DATAFORSEO_CONNECT_TIMEOUT_SECONDS: float = 10.0
+    DATAFORSEO_READ_TIMEOUT_SECONDS: float = 120.0  # Live SERP and Labs calls can take a while
+    DATAFORSEO_CACHE_ENABLED: bool = True  # Disk cache for ranked-keywords responses
+    DATAFORSEO_CACHE_PATH: str = "./data/dataforseo_cache.sqlite"
+    DATAFORSEO_CACHE_TTL_SECONDS: int = 86400  # One fetch per competitor per day
+    DATAFORSEO_CACHE_MAX_MB: int = 512  # Least recently used responses are evicted above this
+    DATAFORSEO_RANKED_KEYWORDS_MAX_ROWS: int = 10000  # Default row budget for iter_ranked_keywords
+    DATAFORSEO_DEBUG_PAYLOADS: bool = False  # Print full ranked-keywords responses (large)
+    DATAFORSEO_RATE_PER_SECOND: float = 30.0  # Token bucket rate shared by every call in the process
+    DATAFORSEO_MAX_IN_FLIGHT: int = 30  # Upper bound of the adaptive concurrency window
+    DATAFORSEO_RETRY_ATTEMPTS: int = 5  # Attempts for idempotent calls on 429/5xx/timeouts
+    DATAFORSEO_RETRY_MAX_WAIT_SECONDS: float = 60.0
     APOLLO_API_KEY: SecretStr | None = None
     LOB_API_KEY: SecretStr | None = None
     VERCEL_TOKEN: SecretStr | None = None
@@ -23,6 +39,57 @@ class Settings(BaseSettings):
     GOOGLE_CLIENT_SECRET: SecretStr | None = None
     GOOGLE_REDIRECT_URI: str = "http://localhost:8000/oauth2callback" # Default redirect URI
 
+    # Daily Harvest
+    HARVEST_CONCURRENCY: int = 50  # Keywords in flight at once
+    HARVEST_SERP_CONCURRENCY: int = 30  # Concurrent DataForSEO calls
+    HARVEST_AI_CONCURRENCY: int = 10  # Concurrent Gemini calls
+    HARVEST_DB_CONCURRENCY: int = 5  # Concurrent database writes
+    HARVEST_PROGRESS_EVERY: int = 500  # Print a progress line every N keywords
+    HARVEST_CHUNK_SIZE: int = 1000  # Keywords fetched per server-side cursor round trip
+    HARVEST_SHARD: str | None = None  # '<index>/<count>' or '<start_id>-<end_id>'; None harvests everything
+    HARVEST_SERP_MODE: str = "live"  # 'live' (one call per keyword) or 'batch' (standard task queue)
+    HARVEST_BATCH_IN_FLIGHT: int = 20  # task_post batches awaiting results at once
+    HARVEST_BATCH_POLL_SECONDS: float = 10.0
+    HARVEST_BATCH_TIMEOUT_SECONDS: float = 1800.0  # Unready tasks fall back to the live endpoint after this
+    HARVEST_DISTRIBUTED: bool = False  # Claim keyword ranges from harvest_leases instead of using HARVEST_SHARD
+    HARVEST_LEASE_SIZE: int = 1000  # Keywords per lease (approximate: a lease never splits a SERP)
+    HARVEST_LEASE_SECONDS: int = 300  # A lease without a heartbeat for this long is reclaimed
+    HARVEST_LEASE_MAX_ATTEMPTS: int = 3  # Passes over a range with unfinished keywords before it is marked done anyway
+    HARVEST_WORKER_ID: str | None = None  # Defaults to <hostname>-<pid>
+    ANALYSIS_MEMO_TTL_DAYS: int = 7  # Re-ask Gemini for an unchanged keyword after this long
+    ANALYSIS_BATCH_SIZE: int = 25  # Keywords analysed per Gemini request in the harvest; 1 sends one prompt per keyword
+    ANALYSIS_BATCH_WAIT_SECONDS: float = 0.5  # Send a partial batch after this long
+    HISTORY_RAW_RETENTION_DAYS: int = 90  # Raw ranking_history rows older than this are dropped after rollup
+    HISTORY_DAILY_RETENTION_DAYS: int = 400  # Daily rollups kept this long; weekly/monthly cover older ranges
+    HISTORY_WEEKLY_RETENTION_DAYS: int = 1100  # Monthly rollups are kept indefinitely
+    HARVEST_CHECKPOINT_RETENTION_DAYS: int = 14  # Per-keyword harvest checkpoints kept this long
+    HISTORY_PARTITION_MONTHS_AHEAD: int = 2  # Postgres: monthly partitions created in advance
+    HISTORY_TREND_WINDOW_DAYS: int = 30  # Trailing days of daily rollups used for keyword_trends
+    HARVEST_WRITE_BATCH_SIZE: int = 500  # Rank rows per bulk INSERT/COPY
+    HARVEST_WRITE_FLUSH_SECONDS: float = 2.0  # Flush a partial batch after this long
+    HARVEST_WRITE_MAX_PENDING: int = 5000  # Buffered rows before producers are made to wait
+    SERP_ARCHIVE_ENABLED: bool = True  # Keep every fetched SERP in the Parquet archive
+    SERP_ARCHIVE_DIR: str = "./data/serp_archive"
+    SERP_ARCHIVE_FLUSH_ROWS: int = 250  # SERPs buffered before a new archive file is written
+    SERP_ARCHIVE_FLUSH_MB: float = 16.0  # ...or once the buffered payloads reach this size
+    SERP_ARCHIVE_FLUSH_SECONDS: float = 30.0  # ...or once the oldest buffered SERP is this old
+    METERING_ENABLED: bool = True  # Record paid API usage and enforce per-project daily budgets
+    METERING_FLUSH_SECONDS: float = 10.0  # Pending usage is written to api_usage at most this often
+    METERING_BUDGET_REFRESH_SECONDS: float = 30.0  # How long a project's persisted spend and plan are cached
+    GEMINI_CACHE_ENABLED: bool = True  # Reuse responses to identical prompts (same model and generation config)
+    GEMINI_CACHE_PATH: str = "./data/gemini_cache.sqlite"
+    GEMINI_CACHE_TTL_SECONDS: int = 604800  # A week, in line with ANALYSIS_MEMO_TTL_DAYS
+    GEMINI_CACHE_MAX_MB: int = 256
+    GEMINI_CACHE_MEMORY_ENTRIES: int = 2000  # In-process LRU tier in front of the SQLite file
+    GEMINI_CACHE_EXCLUDED_ENGINES: str = ""  # Comma-separated metering engine names that always call the model
+    GEMINI_REQUESTS_PER_MINUTE: int = 1000  # Project quota shared by every Gemini call in the process
+    GEMINI_TOKENS_PER_MINUTE: int = 1000000
+    GEMINI_OUTPUT_TOKENS_ESTIMATE: int = 400  # Booked per call until the actual usage is known
+    GEMINI_QUOTA_RETRIES: int = 5  # Retries after a quota (429) error before giving up
+    GEMINI_QUOTA_MAX_WAIT_SECONDS: float = 60.0
+    GEMINI_JSON_RETRIES: int = 2  # Extra attempts when a generate_json response does not match its schema
+    GEMINI_INPUT_COST_PER_1M_TOKENS: float = 0.30  # USD, used to price Gemini calls
+    GEMINI_OUTPUT_COST_PER_1M_TOKENS: float = 2.50
 
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
@@ -1,32 +1,435 @@
+"""
+Daily Harvest Flow
+
+Checks the live rank of every tracked keyword, asks Gemini for a short
+prescription and appends the result to ranking_history.
+
+Keywords are processed by a bounded pool of workers so that the network waits
+on DataForSEO, Gemini and the database overlap instead of running back to back.
+Each external system gets its own concurrency cap (see the HARVEST_* settings),
+so raising the number of keywords in flight never floods a single provider.
+
+In 'batch' mode ranks come from the DataForSEO standard task queue in groups of
+up to 100 keywords instead of one live call per keyword; the live endpoint is
+kept for the default mode and as the fallback for tasks that never complete.
+
+Keywords are grouped by SERP identity (text, location, device) first, so a
+result page shared by several tracked domains is fetched once and resolves
+every one of them. API calls scale with unique SERPs, not tracked rows.
+
+Keywords are streamed from the database in chunks (optionally restricted to a
+shard) so memory stays flat as the keyword table grows. Within a shard or lease
+they come in SERP order and a chunk never splits a SERP's keywords, so grouping
+per chunk still fetches each SERP once.
+
+With distributed=True the flow claims keyword ranges from harvest_leases
+instead (see src/tasks/lease_tasks.py), so several worker containers can
+split one harvest date without checking any keyword twice. Leases are cut
+along SERP order, so each SERP is still fetched once across all workers. A range is marked
+done only after its rows have been flushed and only if every keyword in it got
+a checkpoint; otherwise it is released for another pass. Ranges held by a
+worker that stops heartbeating are reclaimed by the others.
+
+Every run is tied to a harvest date (today, UTC, unless given). Each written
+row checkpoints its (keyword, date) in harvest_checkpoints, and keywords that
+already have a checkpoint are skipped, so a run that dies part-way can simply
+be restarted and resumes where it stopped without paying for work twice.
+
+With ANALYSIS_BATCH_SIZE > 1 the Gemini prescriptions are requested for many
+keywords at once (see AnalysisBatcher), so analysis costs one round trip per
+batch rather than per keyword.
+
+Results are written through a buffered RankHistoryWriter (bulk INSERT/COPY)
+rather than one transaction per row; the final flush happens before the
+summary is printed.
+
+Every fetched SERP is also kept in the Parquet archive (src/utils/serp_archive.py)
+so later analyses can replay full result pages without paying DataForSEO again.
+"""
+import asyncio
+import datetime
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, AsyncIterable, Awaitable, Callable, Dict, Iterable, Iterator, List, Tuple
+
 from prefect import flow
-from src.tasks.db_tasks import get_active_keywords, save_rank_history
-from src.tasks.serp_tasks import fetch_rank_live
-from src.tasks.analysis_tasks import analyze_ranking
-
-@flow
-async def daily_harvest_flow():
-    print("Starting daily harvest...")
-    keywords = await get_active_keywords()
-    
-    for keyword in keywords:
-        rank, url = await fetch_rank_live(
-            keyword=keyword.text,
-            domain=keyword.domain,
-            location=keyword.location,
-            device=keyword.device
-        )
-        
-        analysis = await analyze_ranking(
-            keyword=keyword.text,
-            rank=rank,
-            url=url
+
+from src.config.settings import settings
+from src.tasks.db_tasks import KeywordShard, count_checkpoints, stream_keywords
+from src.tasks.serp_tasks import (
+    NOT_FOUND,
+    SERP_BATCH_SIZE,
+    DomainRanks,
+    SerpKey,
+    fetch_serp_live,
+    fetch_serps_batch,
+    group_by_serp,
+)
+from src.tasks.analysis_tasks import AnalysisBatcher, analyze_ranking
+from src.tasks.lease_tasks import (
+    claim_lease,
+    complete_lease,
+    default_worker_id,
+    heartbeat_lease,
+    lease_shard,
+    plan_harvest_leases,
+)
+from src.models.core import HarvestLease
+from src.utils.dataforseo_client import dataforseo_client
+from src.utils.metering import metered
+from src.utils.rank_writer import RankHistoryWriter
+from src.utils.serp_archive import serp_archive
+
+SerpGroup = Tuple[SerpKey, List[Any]]
+
+
+@dataclass
+class LeaseScope:
+    """Tracks the outstanding work units of one claimed keyword range."""
+    lease: HarvestLease
+    outstanding: int = 0
+    exhausted: bool = False
+
+
+@dataclass
+class HarvestLimits:
+    """Concurrency caps for a single harvest run."""
+    keywords: int
+    serp: int
+    ai: int
+    db: int
+
+    @classmethod
+    def from_settings(
+        cls,
+        keywords: int | None = None,
+        serp: int | None = None,
+        ai: int | None = None,
+        db: int | None = None,
+    ) -> "HarvestLimits":
+        return cls(
+            keywords=keywords or settings.HARVEST_CONCURRENCY,
+            serp=serp or settings.HARVEST_SERP_CONCURRENCY,
+            ai=ai or settings.HARVEST_AI_CONCURRENCY,
+            db=db or settings.HARVEST_DB_CONCURRENCY,
         )
-        
-        await save_rank_history(
-            keyword_id=keyword.id,
-            rank=rank,
-            url=url,
-            analysis=analysis
+
+
+@dataclass
+class HarvestStats:
+    """Running counters for a harvest run, used for progress and the final summary."""
+    progress_every: int = 500
+    keywords: int = 0
+    checked: int = 0
+    failed: int = 0
+    serps: int = 0
+    serp_seconds: float = 0.0
+    ai_seconds: float = 0.0
+    db_seconds: float = 0.0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def per_minute(self) -> float:
+        elapsed = self.elapsed
+        return (self.checked / elapsed) * 60 if elapsed else 0.0
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            self.checked += 1
+        else:
+            self.failed += 1
+        done = self.checked + self.failed
+        if self.progress_every and done % self.progress_every == 0:
+            print(f"Progress: {done} keywords processed ({self.failed} failed, {self.per_minute:.0f}/min)")
+
+    def summary(self) -> str:
+        return (
+            f"Harvest complete: {self.checked} checked, {self.failed} failed "
+            f"in {self.elapsed:.1f}s ({self.per_minute:.0f} keywords/min); "
+            f"{self.keywords} keywords resolved from {self.serps} SERP fetches. "
+            f"Time spent - DataForSEO: {self.serp_seconds:.1f}s, "
+            f"Gemini: {self.ai_seconds:.1f}s, DB: {self.db_seconds:.1f}s"
         )
+
+
+async def run_pool(items: AsyncIterable[Any], worker: Callable[[Any], Awaitable[None]], concurrency: int) -> None:
+    """
+    Feeds items through `concurrency` worker coroutines.
+    The queue is bounded so the producer never runs far ahead of the workers.
+    A failing item is logged and skipped; it never takes its consumer down,
+    otherwise the queue would stop draining and the producer would block forever.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def _consume():
+        while True:
+            item = await queue.get()
+            try:
+                await worker(item)
+            except Exception as e:
+                print(f"ERROR: Harvest worker failed on an item: {e}")
+            finally:
+                queue.task_done()
+
+    consumers = [asyncio.create_task(_consume()) for _ in range(concurrency)]
+    try:
+        async for item in items:
+            await queue.put(item)
+        await queue.join()
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk: List[Any] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@flow(name="Daily Harvest", log_prints=True)
+@metered("daily_harvest")
+async def daily_harvest_flow(
+    mode: str | None = None,
+    concurrency: int | None = None,
+    serp_concurrency: int | None = None,
+    ai_concurrency: int | None = None,
+    db_concurrency: int | None = None,
+    shard: str | None = None,
+    chunk_size: int | None = None,
+    distributed: bool | None = None,
+    harvest_date: datetime.date | None = None,
+) -> HarvestStats:
+    """
+    mode: 'live' checks each SERP on the live endpoint; 'batch' posts SERPs
+    to the DataForSEO standard queue in groups of SERP_BATCH_SIZE.
+    Defaults to HARVEST_SERP_MODE.
+
+    shard: restricts this run to a slice of the keyword table, either
+    '<index>/<count>' or '<start_id>-<end_id>' (see KeywordShard).
+    Defaults to HARVEST_SHARD.
+
+    distributed: instead of a fixed shard, claim keyword ranges from the
+    harvest_leases table so any number of workers can share one harvest date.
+    Defaults to HARVEST_DISTRIBUTED.
+    """
+    mode = mode or settings.HARVEST_SERP_MODE
+    if mode not in ("live", "batch"):
+        raise ValueError(f"Unknown harvest mode '{mode}'. Expected 'live' or 'batch'.")
+    shard = shard or settings.HARVEST_SHARD
+    shard_spec = KeywordShard.parse(shard) if shard else None
+    distributed = settings.HARVEST_DISTRIBUTED if distributed is None else distributed
+    harvest_date = harvest_date or datetime.datetime.utcnow().date()
+    worker_id = default_worker_id()
+
+    limits = HarvestLimits.from_settings(concurrency, serp_concurrency, ai_concurrency, db_concurrency)
+    scope_label = f"worker {worker_id} on leased ranges" if distributed else f"shard {shard_spec or 'all'}"
+    print(
+        f"Starting daily harvest for {harvest_date} in {mode} mode, {scope_label} ({limits.keywords} in flight; "
+        f"DataForSEO={limits.serp}, Gemini={limits.ai}, DB={limits.db})..."
+    )
+    serp_slots = asyncio.Semaphore(limits.serp)
+    ai_slots = asyncio.Semaphore(limits.ai)
+    stats = HarvestStats(progress_every=settings.HARVEST_PROGRESS_EVERY)
+    writer = RankHistoryWriter(writers=limits.db, harvest_date=harvest_date)
+    # Packs concurrent analyses into multi-keyword Gemini requests (limits.ai requests in flight)
+    batcher = AnalysisBatcher(concurrency=limits.ai) if settings.ANALYSIS_BATCH_SIZE > 1 else None
+
+    async def _analyze(keyword, rank: int, url: str) -> str:
+        if batcher:
+            return await batcher.analyze(keyword.text, rank, url)
+        async with ai_slots:
+            return await analyze_ranking(
+                keyword=keyword.text,
+                rank=rank,
+                url=url
+            )
+
+    async def _finish_keyword(keyword, rank: int, url: str) -> None:
+        try:
+            t0 = time.monotonic()
+            analysis = await _analyze(keyword, rank, url)
+            stats.ai_seconds += time.monotonic() - t0
+
+            await writer.add(
+                keyword_id=keyword.id,
+                rank=rank,
+                url=url,
+                analysis=analysis
+            )
+        except Exception as e:
+            print(f"ERROR: Harvest failed for '{keyword.text}' (id={keyword.id}): {e}")
+            stats.record(ok=False)
+            return
+
+        stats.record(ok=True)
         print(f"Checked '{keyword.text}': Rank {rank}")
         print(f"  > Analysis: {analysis}")
+
+    async def _resolve_group(group: SerpGroup, ranks: DomainRanks) -> None:
+        await asyncio.gather(
+            *(_finish_keyword(keyword, *ranks.get(keyword.domain, NOT_FOUND)) for keyword in group[1])
+        )
+
+    async def _harvest_live(group: SerpGroup) -> None:
+        (text, location, device), keywords = group
+        try:
+            async with serp_slots:
+                t0 = time.monotonic()
+                ranks = await fetch_serp_live(keyword=text, location=location, device=device)
+                stats.serp_seconds += time.monotonic() - t0
+                stats.serps += 1
+        except Exception as e:
+            print(f"ERROR: SERP check failed for '{text}' ({len(keywords)} keywords): {e}")
+            for _ in keywords:
+                stats.record(ok=False)
+            return
+        await _resolve_group(group, ranks)
+
+    async def _harvest_batch(batch: List[SerpGroup]) -> None:
+        try:
+            t0 = time.monotonic()
+            serps = await fetch_serps_batch([key for key, _ in batch])
+            stats.serp_seconds += time.monotonic() - t0
+            stats.serps += len(batch)
+        except Exception as e:
+            print(f"ERROR: Batch SERP check failed for {len(batch)} SERPs: {e}")
+            for _, keywords in batch:
+                for _ in keywords:
+                    stats.record(ok=False)
+            return
+        resolved = []
+        for group in batch:
+            if group[0] in serps:
+                resolved.append(_resolve_group(group, serps[group[0]]))
+            else:
+                # Unreadable SERP: fail its keywords (no checkpoint) instead of recording them as not found
+                for _ in group[1]:
+                    stats.record(ok=False)
+        await asyncio.gather(*resolved)
+
+    # --- Leased ranges (distributed mode) ---
+    held: Dict[int, LeaseScope] = {}
+    completions: List[asyncio.Task] = []
+
+    lease_settled = asyncio.Condition()
+
+    async def _complete(scope: LeaseScope) -> None:
+        # Only finish the range once its rows are actually in the database, so
+        # its checkpoints show which keywords still need another pass
+        try:
+            await writer.wait_settled(writer.last_seq)
+            status = await complete_lease(scope.lease.id, worker_id)
+            if status is None:
+                print(f"WARNING: Lease {scope.lease.id} was reclaimed by another worker before completion.")
+            elif status == "pending":
+                print(f"Lease {scope.lease.id} has unfinished keywords; released for another pass.")
+        except Exception as e:
+            print(f"WARNING: Could not complete lease {scope.lease.id}; it will be reclaimed once it expires: {e}")
+        finally:
+            held.pop(scope.lease.id, None)
+            async with lease_settled:
+                lease_settled.notify_all()
+
+    def _maybe_complete(scope: LeaseScope) -> None:
+        if scope.exhausted and scope.outstanding == 0:
+            completions.append(asyncio.create_task(_complete(scope)))
+
+    async def _heartbeat() -> None:
+        while True:
+            await asyncio.sleep(settings.HARVEST_LEASE_SECONDS / 3)
+            for lease_id in list(held):
+                # A failed beat must not end the loop, or every held lease expires and is harvested twice
+                try:
+                    if not await heartbeat_lease(lease_id, worker_id):
+                        print(f"WARNING: Lost lease {lease_id}; another worker may repeat its keywords.")
+                except Exception as e:
+                    print(f"WARNING: Heartbeat for lease {lease_id} failed: {e}")
+
+    async def _keyword_chunks() -> AsyncIterator[Tuple[LeaseScope | None, List[Any]]]:
+        if not distributed:
+            async for chunk in stream_keywords(
+                chunk_size=chunk_size, shard=shard_spec, pending_on=harvest_date, group_serps=True
+            ):
+                yield None, chunk
+            return
+
+        await plan_harvest_leases(harvest_date)
+        while True:
+            lease = await claim_lease(worker_id, harvest_date)
+            if lease is None:
+                if not held:
+                    return
+                # Our own ranges may still be released for another pass; wait for them and look again
+                async with lease_settled:
+                    await lease_settled.wait_for(lambda: not held)
+                continue
+            scope = held[lease.id] = LeaseScope(lease)
+            async for chunk in stream_keywords(
+                chunk_size=chunk_size, shard=lease_shard(lease), pending_on=harvest_date, group_serps=True
+            ):
+                yield scope, chunk
+            scope.exhausted = True
+            _maybe_complete(scope)
+
+    async def _work_units() -> AsyncIterator[Tuple[LeaseScope | None, Any]]:
+        async for scope, chunk in _keyword_chunks():
+            stats.keywords += len(chunk)
+            groups = group_by_serp(chunk).items()
+            units = chunked(groups, SERP_BATCH_SIZE) if mode == "batch" else groups
+            for unit in units:
+                if scope:
+                    scope.outstanding += 1
+                yield scope, unit
+
+    handler = _harvest_batch if mode == "batch" else _harvest_live
+
+    async def _run_unit(unit: Tuple[LeaseScope | None, Any]) -> None:
+        scope, payload = unit
+        try:
+            await handler(payload)
+        finally:
+            if scope:
+                scope.outstanding -= 1
+                _maybe_complete(scope)
+
+    already_done = await count_checkpoints(harvest_date)
+    if already_done:
+        print(f"Resuming harvest for {harvest_date}: {already_done} keywords already checkpointed will be skipped.")
+
+    heartbeat = asyncio.create_task(_heartbeat()) if distributed else None
+    try:
+        async with dataforseo_client, writer:
+            in_flight = settings.HARVEST_BATCH_IN_FLIGHT if mode == "batch" else limits.keywords
+            await run_pool(_work_units(), _run_unit, in_flight)
+            await asyncio.gather(*completions)
+    finally:
+        if heartbeat:
+            heartbeat.cancel()
+            (outcome,) = await asyncio.gather(heartbeat, return_exceptions=True)
+            if not isinstance(outcome, (asyncio.CancelledError, type(None))):
+                print(f"WARNING: Lease heartbeat stopped early: {outcome!r}")
+        if batcher:
+            await batcher.close()
+            print(f"Gemini analysis: {batcher.requests} requests ({batcher.requeued} keywords retried individually).")
+        await serp_archive.flush()
+
+    stats.db_seconds = writer.flush_seconds
+    if writer.rows_failed:
+        retry = "their lease ranges are released for another pass" if distributed else "they will be retried on the next run"
+        print(f"WARNING: {writer.rows_failed} rank rows could not be written; {retry}.")
+    if writer.rows_skipped:
+        print(f"{writer.rows_skipped} rank rows were skipped as already recorded for {harvest_date}.")
+
+    print(stats.summary())
+    return stats
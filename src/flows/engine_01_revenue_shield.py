@@ -20,53 +20,53 @@ from typing import List, Dict, Any
 from src.config.settings import settings
 from src.utils.db import get_session
 from src.utils.models import Keyword, Project
-from src.utils.dataforseo_client import DataForSEOClient # Import the real client
+from src.utils.dataforseo_client import dataforseo_client, iter_ranked_keywords
+from src.utils.metering import metered
 
 # --- Prefect Tasks ---
 
-@task
-def authenticate_dataforseo() -> DataForSEOClient:
-    """
-    Task to authenticate and instantiate the live DataForSEO API client.
-    """
-    print("--- Task: Authenticating Live DataForSEO Client ---")
-    try:
-        client = DataForSEOClient()
-        return client
-    except ValueError as e:
-        print(f"FATAL: DataForSEO client initialization failed: {e}")
-        # In a real scenario, we might want to fail the flow here
-        raise
+RIVAL_DOMAIN = "amazon.com"  # Generic, high-authority competitor for testing purposes
+RIVAL_KEYWORD_BUDGET = 50
 
 @task
-def fetch_opportunities(client: DataForSEOClient, user_da: int) -> List[Dict[str, Any]]:
+async def fetch_opportunities(user_da: int) -> List[Dict[str, Any]]:
     """
     Task to fetch keyword opportunities from multiple sources and filter them
-    through the 'Affordability Gate'. Source B is from the live API.
+    through the 'Affordability Gate'. Source B is from the live API and is
+    streamed page by page, so the gate runs while later pages download.
     """
     print(f"--- Task: Fetching Opportunities (User DA: {user_da}) ---")
-    
+
+    # --- Affordability Gate ---
+    affordability_threshold = user_da + 15
+    print(f"Affordability Gate Threshold set to: Difficulty < {affordability_threshold}")
+
+    eligible_opportunities = []
+
+    def affordability_gate(opp: Dict[str, Any]) -> None:
+        # Unknown difficulty (None) never passes: it is not evidence that a keyword is easy
+        if opp.get('diff') is not None and opp['diff'] < affordability_threshold:
+            eligible_opportunities.append(opp)
+            print(f"  [PASS] '{opp['term']}' (Diff: {opp['diff']})")
+        else:
+            print(f"  [FAIL] '{opp['term']}' (Diff: {opp.get('diff', 'N/A')}) - Exceeds threshold or missing data.")
+
     # --- Source B (Rivals) - LIVE DATA ---
-    print("Fetching LIVE data for competitor 'amazon.com' (Source B)...")
+    print(f"Fetching LIVE data for competitor '{RIVAL_DOMAIN}' (Source B)...")
+    source_b_count = 0
     try:
-        # Using a generic, high-authority competitor for testing purposes as requested
-        rival_keywords_raw = client.get_ranked_keywords(domain="amazon.com", location_name="United States", limit=50)
+        async for record in iter_ranked_keywords(RIVAL_DOMAIN, max_rows=RIVAL_KEYWORD_BUDGET):
+            if record.keyword:
+                source_b_count += 1
+                affordability_gate({
+                    'term': record.keyword,
+                    'vol': record.search_volume,
+                    'cpc': record.cpc,
+                    'diff': record.difficulty,
+                })
     except Exception as e:
         print(f"ERROR: Live data call for Source B failed: {e}")
-        rival_keywords_raw = []
-
-    # Transform live data into the flow's expected internal format
-    source_b_opportunities = []
-    for item in rival_keywords_raw:
-        kd = item.get('keyword_data', {})
-        if kd.get('keyword') and kd.get('keyword_difficulty') is not None:
-             source_b_opportunities.append({
-                'term': kd.get('keyword'),
-                'vol': kd.get('search_volume'),
-                'cpc': kd.get('cpc'),
-                'diff': kd.get('keyword_difficulty'),
-             })
-    print(f"Retrieved and processed {len(source_b_opportunities)} opportunities from Source B.")
+    print(f"Retrieved and processed {source_b_count} opportunities from Source B.")
 
     # --- Source A (GSC - Mocked) & Source C (Arbitrage - Mocked) ---
     print("Adding MOCK data for Source A (GSC) and Source C (Arbitrage)...")
@@ -74,21 +74,9 @@ def fetch_opportunities(client: DataForSEOClient, user_da: int) -> List[Dict[str
         {'term': 'internal gsc keyword opportunity', 'vol': 500, 'cpc': 2.5, 'diff': 15},
         {'term': 'high cpc arbitrage keyword', 'vol': 1000, 'cpc': 55.0, 'diff': 35},
     ]
+    for opp in mock_opportunities:
+        affordability_gate(opp)
 
-    all_opportunities = source_b_opportunities + mock_opportunities
-    
-    # --- Affordability Gate ---
-    affordability_threshold = user_da + 15
-    print(f"Affordability Gate Threshold set to: Difficulty < {affordability_threshold}")
-    
-    eligible_opportunities = []
-    for opp in all_opportunities:
-        if opp.get('diff') is not None and opp['diff'] < affordability_threshold:
-            eligible_opportunities.append(opp)
-            print(f"  [PASS] '{opp['term']}' (Diff: {opp['diff']})")
-        else:
-            print(f"  [FAIL] '{opp['term']}' (Diff: {opp.get('diff', 'N/A')}) - Exceeds threshold or missing data.")
-            
     return eligible_opportunities
 
 @task
@@ -182,6 +170,7 @@ async def execute_swap(sorted_list: list[dict], project_id: int):
 # --- Main Prefect Flow ---
 
 @flow(name="Engine 1: Revenue Shield", log_prints=True)
+@metered("revenue_shield")
 async def revenue_shield_flow(project_id: int, user_da: int):
     """
     Main flow to orchestrate the Revenue Shield engine.
@@ -189,8 +178,8 @@ async def revenue_shield_flow(project_id: int, user_da: int):
     print(f"--- Starting Revenue Shield Flow for project_id={project_id}, user_da={user_da} ---")
     
     try:
-        client = authenticate_dataforseo()
-        opportunities = fetch_opportunities(client, user_da)
+        async with dataforseo_client:
+            opportunities = await fetch_opportunities(user_da)
         
         if opportunities:
             sorted_list = calculate_yes_score(opportunities)
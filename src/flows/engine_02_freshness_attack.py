@@ -11,7 +11,8 @@ Status: ACTIVE (Real AI Connected)
 
 import asyncio
 from prefect import flow, task
-from src.utils.gemini_client import gemini_agent, GeminiAgent
+from src.utils.gemini_client import GeminiAgent, get_gemini_agent
+from src.utils.metering import metered
 
 # --- Mock Data Source (Replacing with Real DataForSEO in Phase V) ---
 # For now, we mock the "Traffic History" to identify a decaying page.
@@ -46,15 +47,13 @@ def identify_decay_candidates(user_domain: str) -> list[dict]:
         print("No decaying pages found. Portfolio is healthy.")
     return candidates
 
-@task
-async def generate_freshness_update(page: dict, agent: GeminiAgent) -> str:
+def build_freshness_prompt(page: dict) -> str:
     """
-    Generates a text update to refresh the stale content.
+    The 'Freshness Injection' prompt for a decaying page. Shared by the flow
+    and the streaming endpoint so both produce (and cache) the same asset.
     We explicitly ask for 'New Trends' and 'Modern Data' to satisfy QDF.
     """
-    print(f"--- Task: Generating Freshness Update for '{page['top_keyword']}' ---")
-    
-    prompt = f"""
+    return f"""
     You are an expert SEO Content Editor.
     The following content is OUTDATED (from {2025 - (page['last_updated_months_ago'] // 12)}).
     
@@ -68,12 +67,17 @@ async def generate_freshness_update(page: dict, agent: GeminiAgent) -> str:
     
     Return ONLY the content in Markdown format.
     """
-    
-    return await agent.generate_content(prompt)
+
+@task
+async def generate_freshness_update(page: dict, agent: GeminiAgent) -> str:
+    """Generates a text update to refresh the stale content."""
+    print(f"--- Task: Generating Freshness Update for '{page['top_keyword']}' ---")
+    return await agent.generate_content(build_freshness_prompt(page))
 
 # --- Main Flow ---
 
 @flow(name="Engine 2: Freshness Attack", log_prints=True)
+@metered("freshness_attack")
 async def freshness_attack_flow(user_domain: str):
     """Orchestrates the Freshness Attack engine."""
     print(f"--- Starting Engine 2: Freshness Attack for {user_domain} ---")
@@ -86,7 +90,7 @@ async def freshness_attack_flow(user_domain: str):
 
     # Process the top decay candidate
     victim = candidates[0]
-    update_content = await generate_freshness_update(victim, gemini_agent)
+    update_content = await generate_freshness_update(victim, get_gemini_agent())
     
     print("\n--- FINAL OUTPUT: FRESHNESS INJECTION ---")
     print(update_content)
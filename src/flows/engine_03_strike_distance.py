@@ -20,7 +20,8 @@ Logic Overview:
 import asyncio
 import re
 from prefect import flow, task
-from src.utils.gemini_client import gemini_agent, GeminiAgent
+from src.utils.gemini_client import GeminiAgent, get_gemini_agent
+from src.utils.metering import metered
 
 # --- Helper for Mock Data ---
 
@@ -102,12 +103,13 @@ async def craft_nudge(gap_info: tuple[str, dict], agent: GeminiAgent) -> str:
 # --- Main Prefect Flow ---
 
 @flow(name="Engine 3: Strike Distance Sniper (V2)", log_prints=True)
+@metered("strike_distance")
 async def strike_distance_flow(user_domain: str, location_code: str = "1023191"):
     """Orchestrates the Strike Distance Sniper engine with detailed diagnosis."""
     print(f"--- Starting Engine 3: Strike Distance Flow (V2) for '{user_domain}' ---")
     
     # Use the real Gemini agent
-    ai_agent = gemini_agent
+    ai_agent = get_gemini_agent()
     
     rankings = fetch_user_rankings(user_domain, location_code)
     strike_zone_victims = filter_strike_zone(rankings)
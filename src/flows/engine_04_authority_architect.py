@@ -2,7 +2,21 @@
 import asyncio
 import json
 from prefect import flow, task
-from src.utils.gemini_client import gemini_agent, GeminiAgent
+from pydantic import BaseModel
+from typing import Dict, List
+from src.utils.gemini_client import GeminiAgent, get_gemini_agent
+from src.utils.metering import metered
+
+# --- Response Schemas ---
+
+class SemanticClusters(BaseModel):
+    clusters: Dict[str, List[str]]  # cluster name -> keywords
+
+class PillarBrief(BaseModel):
+    pillar_title: str
+    support_titles: List[str]
+    target_word_count: int
+    internal_link_strategy: str
 
 # --- Helper Functions for Mock Data ---
 
@@ -49,20 +63,15 @@ async def create_semantic_clusters(all_keywords: list[str], agent: GeminiAgent)
         "Act as an expert NLP Strategist. Take this list of keywords and group them into 5-10 distinct "
         "semantic clusters (e.g., 'Pricing', 'Integrations'). "
         f"Keyword list sample: [{keyword_sample}]. "
-        "Return the result strictly as a valid JSON object: { 'cluster_name': ['kw1', 'kw2', ...], ... }. "
-        "Do not include Markdown formatting or code blocks."
+        "Return the clusters as an object mapping each cluster name to its keywords."
     )
     # Using real Gemini Agent
-    response = await agent.generate_content(prompt)
-    try:
-        # Clean response if it contains markdown code blocks
-        clean_response = response.replace("```json", "").replace("```", "").strip()
-        cluster_map = json.loads(clean_response)
-        print(f"Successfully parsed JSON and created {len(cluster_map)} semantic clusters.")
-        return cluster_map
-    except json.JSONDecodeError:
-        print(f"ERROR: Failed to decode JSON from Gemini's clustering response. Raw: {response}")
+    result = await agent.generate_json(prompt, SemanticClusters)
+    if result is None:
+        print("ERROR: Gemini did not return a valid clustering response.")
         return {}
+    print(f"Successfully parsed JSON and created {len(result.clusters)} semantic clusters.")
+    return result.clusters
 
 @task
 def diagnose_topic_gaps(cluster_map: dict, sitemap: list[str]) -> list[str]:
@@ -85,34 +94,35 @@ def diagnose_topic_gaps(cluster_map: dict, sitemap: list[str]) -> list[str]:
             print(f"  [COVERED] Content exists for cluster: '{cluster_name}'.")
     return critical_gaps
 
+def build_pillar_prompt(missing_cluster: str) -> str:
+    """The Content Pillar Blueprint prompt (answered as a PillarBrief) for a missing topic."""
+    return (
+        f"Based on the missing topic cluster '{missing_cluster}', generate a Content Pillar Blueprint: "
+        '"pillar_title" (The Hub), "support_titles" (a list of 3 spokes), "target_word_count", '
+        'and "internal_link_strategy".'
+    )
+
 @task
 async def generate_pillar_brief(missing_cluster: str, agent: GeminiAgent) -> dict:
     """Generates a JSON content pillar blueprint for a missing topic."""
     print(f"--- Task: Generating Pillar Brief for '{missing_cluster}' ---")
-    prompt = (
-        f"Based on the missing topic cluster '{missing_cluster}', generate a Content Pillar Blueprint. "
-        'Output strictly a valid JSON object with fields: "pillar_title" (The Hub), "support_titles" '
-        ' (a list of 3 spokes), "target_word_count", and "internal_link_strategy". '
-        "Do not include Markdown formatting or code blocks."
-    )
     # Using real Gemini Agent
-    response = await agent.generate_content(prompt)
-    try:
-        clean_response = response.replace("```json", "").replace("```", "").strip()
-        return json.loads(clean_response)
-    except json.JSONDecodeError:
-        print(f"ERROR: Failed to decode JSON for pillar brief. Raw: {response}")
+    brief = await agent.generate_json(build_pillar_prompt(missing_cluster), PillarBrief)
+    if brief is None:
+        print(f"ERROR: Gemini did not return a valid pillar brief for '{missing_cluster}'.")
         return {}
+    return brief.model_dump()
 
 # --- Main Prefect Flow ---
 
 @flow(name="Engine 4: Authority Architect", log_prints=True)
+@metered("authority_architect")
 async def authority_architect_flow():
     """Orchestrates the Authority Architect engine to find and plan for content gaps."""
     print("--- Starting Engine 4: Authority Architect Flow (REAL AI) ---")
     
     # Use the real global agent
-    ai_agent = gemini_agent
+    ai_agent = get_gemini_agent()
     
     keywords = fetch_competitor_keywords()
     cluster_map = await create_semantic_clusters(keywords, ai_agent)
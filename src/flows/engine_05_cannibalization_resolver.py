@@ -21,7 +21,14 @@ import asyncio
 from prefect import flow, task
 from typing import List, Dict, Any
 import re
-from src.utils.gemini_client import gemini_agent, GeminiAgent
+from pydantic import BaseModel
+from src.utils.gemini_client import GeminiAgent, get_gemini_agent
+from src.utils.metering import metered
+
+# --- Response Schemas ---
+
+class RedirectRule(BaseModel):
+    rule: str  # A single .htaccess line
 
 # --- Prefect Tasks ---
 
@@ -86,21 +93,25 @@ async def generate_redirect_code(winner_url: str, loser_url: str, agent: GeminiA
     prompt = (
         f"Generate a standard Apache .htaccess 301 redirect rule to permanently redirect "
         f"the old URL '{loser_url}' to the new URL '{winner_url}'. "
-        "Return ONLY the single line of code. Do not include markdown or explanations."
+        "Put the single line of code in \"rule\", without explanations."
     )
     # Using real Gemini Agent
-    response = await agent.generate_content(prompt)
-    return response.strip().replace("```", "").replace("apache", "").strip()
+    redirect = await agent.generate_json(prompt, RedirectRule)
+    if redirect is None:
+        print(f"ERROR: Gemini did not return a redirect rule for {loser_url}.")
+        return ""
+    return redirect.rule.strip()
 
 # --- Main Prefect Flow ---
 
 @flow(name="Engine 5: Cannibalization Resolver", log_prints=True)
+@metered("cannibalization_resolver")
 async def cannibalization_resolver_flow(project_id: int):
     """Orchestrates the Highlander Protocol to resolve keyword cannibalization."""
     print(f"--- Starting Engine 5: Cannibalization Resolver (REAL AI) for project_id={project_id} ---")
     
     # Use real global agent
-    ai_agent = gemini_agent
+    ai_agent = get_gemini_agent()
 
     conflicts = find_conflicts(project_id)
     if not conflicts:
@@ -19,7 +19,14 @@ The flow operates as follows:
 import asyncio
 from prefect import flow, task
 from typing import List, Dict, Any
-from src.utils.gemini_client import gemini_agent, GeminiAgent
+from pydantic import BaseModel
+from src.utils.gemini_client import GeminiAgent, get_gemini_agent
+from src.utils.metering import metered
+
+# --- Response Schemas ---
+
+class SnippetRewrite(BaseModel):
+    html: str  # The <ul> or <ol> block
 
 # --- Prefect Tasks ---
 
@@ -68,22 +75,26 @@ async def rewrite_and_optimize(opportunity: Dict[str, Any], transformation_type:
     prompt = (
         f'The competitor snippet for "{term}" is: "{current_snippet}". '
         f'Rewrite this to be more concise (under 60 words) and format it as a clean HTML bulleted list, '
-        f'suitable for injection into {target_url}. Return ONLY the <ul> or <ol> HTML block. '
-        "Do not include markdown or explanations."
+        f'suitable for injection into {target_url}. Put ONLY the <ul> or <ol> HTML block in "html", '
+        "without explanations."
     )
     # Using real Gemini Agent
-    response = await agent.generate_content(prompt)
-    return response.strip().replace("```html", "").replace("```", "").strip()
+    rewrite = await agent.generate_json(prompt, SnippetRewrite)
+    if rewrite is None:
+        print(f"ERROR: Gemini did not return a rewritten snippet for '{term}'.")
+        return f"<!-- Rewrite failed for '{term}' -->"
+    return rewrite.html.strip()
 
 # --- Main Prefect Flow ---
 
 @flow(name="Engine 6: SERP Heist", log_prints=True)
+@metered("serp_heist")
 async def serp_heist_flow(project_id: int):
     """Orchestrates the SERP Heist engine to steal Featured Snippets."""
     print(f"--- Starting Engine 6: SERP Heist (REAL AI) for project_id={project_id} ---")
     
     # Use real global agent
-    ai_agent = gemini_agent
+    ai_agent = get_gemini_agent()
 
     opportunities = find_snippet_opportunities(project_id)
     if not opportunities:
@@ -0,0 +1,66 @@
+"""
+Rank History Compaction Flow
+
+Nightly maintenance for ranking_history, run after the daily harvest:
+1.  Creates upcoming monthly partitions (Postgres only).
+2.  Rolls new raw rows up into daily rollups.
+3.  Refreshes the weekly and monthly rollups those days belong to.
+4.  Applies retention: old raw rows (whole partitions on Postgres) and old
+    daily/weekly rollups are removed once a coarser tier covers them.
+5.  Recomputes keyword_trends (deltas, volatility, page-1 events) from the
+    fresh daily rollups.
+"""
+import asyncio
+import datetime
+from prefect import flow, task
+from sqlalchemy import func, select
+
+from src.models.core import RankingRollup
+from src.tasks.history_tasks import (
+    apply_retention,
+    ensure_month_partitions,
+    rollup_periods,
+    rollup_raw_history,
+)
+from src.tasks.trend_tasks import refresh_keyword_trends
+from src.utils.database import engine
+
+
+@task
+async def roll_up_history() -> datetime.date | None:
+    """Rolls raw rows into daily rollups and returns the first day that was (re)computed."""
+    async with engine.connect() as conn:
+        since = (await conn.execute(
+            select(func.max(RankingRollup.period_start)).where(RankingRollup.period == "day")
+        )).scalar()
+    count = await rollup_raw_history(since)
+    print(f"Daily rollups refreshed: {count} keyword-days (since {since or 'the beginning'}).")
+
+    if count:
+        async with engine.connect() as conn:
+            since = since or (await conn.execute(
+                select(func.min(RankingRollup.period_start)).where(RankingRollup.period == "day")
+            )).scalar()
+        await rollup_periods(since)
+        print(f"Weekly and monthly rollups refreshed from {since}.")
+    return since
+
+
+@flow(name="Rank History Compaction", log_prints=True)
+async def rank_compaction_flow():
+    print("--- Starting Rank History Compaction ---")
+    await ensure_month_partitions()
+    await roll_up_history()
+    removed = await apply_retention()
+    print(
+        f"Retention applied: {removed['raw']} raw rows ({removed['partitions']} partitions dropped), "
+        f"{removed['day']} daily and {removed['week']} weekly rollups, "
+        f"{removed['checkpoints']} harvest checkpoints removed."
+    )
+    trends = await refresh_keyword_trends()
+    print(f"Keyword trends refreshed for {trends} keywords.")
+    print("--- Rank History Compaction Finished ---")
+
+
+if __name__ == "__main__":
+    asyncio.run(rank_compaction_flow())
@@ -2,8 +2,11 @@ from __future__ import annotations
 import datetime
 from sqlalchemy import (
     ForeignKey,
+    Index,
     String,
+    UniqueConstraint,
     func,
+    true,
     Text,
 )
 from sqlalchemy.orm import (
@@ -26,18 +29,24 @@ class User(Base):
 
 class Keyword(Base):
     __tablename__ = "keywords"
+    # The harvest streams keywords in SERP order (see db_tasks.stream_keywords)
+    __table_args__ = (Index("ix_keywords_serp", "text", "location", "device"),)
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     text: Mapped[str] = mapped_column(String(255))
     domain: Mapped[str] = mapped_column(String(255))
     device: Mapped[str] = mapped_column(String(50), default="desktop")
     location: Mapped[str] = mapped_column(String(255))
+    active: Mapped[bool] = mapped_column(default=True, server_default=true(), index=True)  # Existing databases: src/scripts/add_keyword_active.py
     user: Mapped["User"] = relationship(back_populates="keywords")
     ranking_logs: Mapped[List["RankingLog"]] = relationship(back_populates="keyword")
 
 
 class RankingLog(Base):
     __tablename__ = "ranking_history"
+    # On Postgres this table is range-partitioned by month on created_at;
+    # see src/tasks/history_tasks.py::partition_ranking_history.
+    __table_args__ = (Index("ix_ranking_history_keyword_created", "keyword_id", "created_at"),)
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     keyword_id: Mapped[int] = mapped_column(ForeignKey("keywords.id"))
     rank: Mapped[int]
@@ -47,3 +56,136 @@ class RankingLog(Base):
         server_default=func.now()
     )
     keyword: Mapped["Keyword"] = relationship(back_populates="ranking_logs")
+
+
+class KeywordLatestRank(Base):
+    """
+    Projection of the newest ranking_history row per keyword, maintained by the
+    harvest writer so the dashboard can read current ranks in a single query.
+    """
+    __tablename__ = "keyword_latest_rank"
+    keyword_id: Mapped[int] = mapped_column(ForeignKey("keywords.id"), primary_key=True)
+    rank: Mapped[int]
+    url: Mapped[str] = mapped_column(String(1024))
+    analysis: Mapped[str | None] = mapped_column(Text, nullable=True)
+    updated_at: Mapped[datetime.datetime] = mapped_column(
+        server_default=func.now()
+    )
+
+
+class HarvestLease(Base):
+    """
+    One claimable slice of the keyword table for a given harvest date: the SERP
+    keys (text, location, device) from start_serp up to, not including, end_serp,
+    stored as JSON arrays (NULL = unbounded). Slicing by SERP rather than by id
+    keeps every keyword of a result page in one lease.
+    Workers lease a row, heartbeat while processing it and mark it done; leases whose
+    heartbeat stops are reclaimed once lease_expires_at has passed.
+    """
+    __tablename__ = "harvest_leases"
+    __table_args__ = (UniqueConstraint("harvest_date", "seq"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    harvest_date: Mapped[datetime.date] = mapped_column(index=True)
+    seq: Mapped[int]  # Position in the date's plan; leases are claimed in this order
+    start_serp: Mapped[str | None] = mapped_column(Text, nullable=True)
+    end_serp: Mapped[str | None] = mapped_column(Text, nullable=True)
+    status: Mapped[str] = mapped_column(String(20), default="pending", index=True)  # pending, leased, done
+    owner: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    lease_expires_at: Mapped[datetime.datetime | None] = mapped_column(nullable=True)
+    attempts: Mapped[int] = mapped_column(default=0)
+    completed_at: Mapped[datetime.datetime | None] = mapped_column(nullable=True)
+
+
+class HarvestCheckpoint(Base):
+    """
+    Marks a keyword as done for a harvest date. Written in the same transaction as
+    its ranking_history row, so a restarted run skips exactly the finished keywords
+    and a keyword is never recorded twice for the same date.
+    """
+    __tablename__ = "harvest_checkpoints"
+    harvest_date: Mapped[datetime.date] = mapped_column(primary_key=True)
+    keyword_id: Mapped[int] = mapped_column(ForeignKey("keywords.id"), primary_key=True)
+    completed_at: Mapped[datetime.datetime] = mapped_column(
+        server_default=func.now()
+    )
+
+
+class AnalysisMemo(Base):
+    """
+    Last Gemini prescription for a (keyword, rank bucket, url). The nightly harvest
+    reuses it until the keyword changes bucket or URL, or the entry expires.
+    """
+    __tablename__ = "analysis_memo"
+    __table_args__ = (UniqueConstraint("keyword", "rank_bucket", "url"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    keyword: Mapped[str] = mapped_column(String(255))
+    rank_bucket: Mapped[str] = mapped_column(String(20))
+    url: Mapped[str] = mapped_column(String(1024))
+    analysis: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        server_default=func.now()
+    )
+
+
+class RankingRollup(Base):
+    """
+    Aggregated rank history for one keyword over a day, ISO week or calendar month.
+    Maintained by the rank compaction flow; raw ranking_history rows are removed once
+    they are older than the raw retention window.
+    """
+    __tablename__ = "ranking_rollups"
+    __table_args__ = (UniqueConstraint("keyword_id", "period", "period_start"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    keyword_id: Mapped[int] = mapped_column(ForeignKey("keywords.id"), index=True)
+    period: Mapped[str] = mapped_column(String(10))  # day, week, month
+    period_start: Mapped[datetime.date]
+    min_rank: Mapped[int]
+    max_rank: Mapped[int]
+    avg_rank: Mapped[float]
+    samples: Mapped[int]
+    url_changes: Mapped[int] = mapped_column(default=0)
+
+
+class KeywordTrend(Base):
+    """
+    Latest rank analytics for a keyword over the trailing HISTORY_TREND_WINDOW_DAYS,
+    recomputed for all keywords at once by the rank compaction flow.
+    Deltas are in rank positions: negative means the keyword moved up.
+    """
+    __tablename__ = "keyword_trends"
+    keyword_id: Mapped[int] = mapped_column(ForeignKey("keywords.id"), primary_key=True)
+    as_of: Mapped[datetime.date] = mapped_column(index=True)
+    samples: Mapped[int]  # Days with a rank inside the window
+    current_rank: Mapped[float]
+    delta_7d: Mapped[float | None] = mapped_column(nullable=True)
+    delta_30d: Mapped[float | None] = mapped_column(nullable=True)
+    volatility: Mapped[float]  # Standard deviation of the daily rank
+    slope: Mapped[float | None] = mapped_column(nullable=True)  # Least-squares rank change per day
+    on_page_1: Mapped[bool]
+    page_1_event: Mapped[str | None] = mapped_column(String(10), nullable=True)  # entered, left
+    page_1_event_date: Mapped[datetime.date | None] = mapped_column(nullable=True)
+    computed_at: Mapped[datetime.datetime] = mapped_column(
+        server_default=func.now()
+    )
+
+
+class ApiUsage(Base):
+    """
+    Paid API usage per day, project, engine, provider and endpoint, accumulated
+    by src.utils.metering. Cost units are US dollars. project_id 0 is
+    platform-wide work (e.g. the daily harvest); projects live in the SQLModel
+    tables, so there is no foreign key.
+    """
+    __tablename__ = "api_usage"
+    __table_args__ = (UniqueConstraint("day", "project_id", "engine", "provider", "endpoint"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    day: Mapped[datetime.date] = mapped_column(index=True)
+    project_id: Mapped[int] = mapped_column(index=True)
+    engine: Mapped[str] = mapped_column(String(50), default="")
+    provider: Mapped[str] = mapped_column(String(20))  # dataforseo, gemini
+    endpoint: Mapped[str] = mapped_column(String(100))
+    calls: Mapped[int] = mapped_column(default=0)
+    errors: Mapped[int] = mapped_column(default=0)
+    cost_units: Mapped[float] = mapped_column(default=0.0)
+    latency_ms: Mapped[float] = mapped_column(default=0.0)  # Summed over calls
+    rows: Mapped[int] = mapped_column(default=0)  # Result rows returned
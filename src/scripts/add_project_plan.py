@@ -0,0 +1,19 @@
+import asyncio
+import os
+import sys
+
+# Add the project root to the sys.path to allow absolute imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.utils.database import add_missing_columns
+from src.utils.models import Project
+
+async def main():
+    # projects.plan, which the API budgets are read from; existing projects start on 'startup'
+    print("Migrating the projects table...")
+    added = await add_missing_columns(Project.__table__)
+    print(f"Done: added {', '.join(added) if added else 'no columns'}; indexes are in place.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,17 @@
+import asyncio
+import os
+import sys
+
+# Add the project root to the sys.path to allow absolute imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.utils.rank_writer import rebuild_latest_ranks
+
+async def main():
+    print("Rebuilding keyword_latest_rank from ranking_history...")
+    count = await rebuild_latest_ranks()
+    print(f"Done: {count} keywords have a latest rank.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,330 @@
+"""
+Local stand-in for the DataForSEO API, for load-testing the harvest and the
+engines without credentials or spend.
+
+Serves synthetic but realistically shaped responses for the endpoints the
+project uses:
+
+    POST serp/google/organic/live/regular
+    POST serp/google/organic/task_post
+    GET  serp/google/organic/tasks_ready
+    GET  serp/google/organic/task_get/regular/<id>
+    POST dataforseo_labs/google/ranked_keywords/live
+
+with configurable latency (log-normal around a median), HTTP 429 and 5xx
+rates, a concurrency cap above which calls are throttled, and payload sizes.
+SERPs are stable per keyword, location, device and day, so repeated
+harvests see the same ranks.
+
+Run it and point the client at it:
+
+    python -m src.scripts.mock_dataforseo --port 8765 --latency-ms 400 --rate-limit-rate 0.02
+    DATAFORSEO_BASE_URL=http://127.0.0.1:8765/v3/ python run_engine.py
+
+Ranked-keywords filters are accepted but not applied.
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+from aiohttp import web
+
+SERP_PREFIX = "serp/google/organic/"
+RANKED_KEYWORDS_PATH = "dataforseo_labs/google/ranked_keywords/live"
+WORDS = (
+    "best", "cheap", "buy", "review", "guide", "near me", "online", "service", "price", "top",
+    "how to", "vs", "free", "software", "tool", "agency", "course", "shop", "repair", "hire",
+)
+COMPETITION_LEVELS = ("LOW", "MEDIUM", "HIGH")
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 300.0  # Median response time
+    latency_sigma: float = 0.5  # Log-normal spread; 0 for a fixed latency
+    rate_limit_rate: float = 0.0  # Share of calls answered with HTTP 429
+    error_rate: float = 0.0  # Share of calls answered with HTTP 500/502/503
+    max_in_flight: int = 0  # Calls above this many concurrent get 429; 0 for no cap
+    retry_after: float = 1.0  # Retry-After header sent with 429s
+    serp_items: int = 100  # Organic results per SERP
+    ranked_total: int = 5000  # total_count of every ranked-keywords result set
+    padding_bytes: int = 0  # Extra description text per item, to grow payloads
+    task_delay: float = 5.0  # Seconds before a posted task shows in tasks_ready
+    domain_pool: int = 1000  # Synthetic competitor domains (site<n>.com)
+    planted_domains: List[str] = field(default_factory=list)  # Appear in SERPs with plant_rate probability
+    plant_rate: float = 0.7
+    seed: int | None = None
+
+
+def _stable_rng(*parts: Any) -> random.Random:
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def _envelope(tasks: List[Dict[str, Any]], started: float) -> Dict[str, Any]:
+    return {
+        "version": "0.1.20250101",
+        "status_code": 20000,
+        "status_message": "Ok.",
+        "time": f"{time.monotonic() - started:.4f} sec.",
+        "cost": round(sum(task.get("cost", 0.0) for task in tasks), 6),
+        "tasks_count": len(tasks),
+        "tasks_error": sum(1 for task in tasks if task["status_code"] >= 40000),
+        "tasks": tasks,
+    }
+
+
+def _task(path: str, data: Dict[str, Any], result: Any, cost: float, status: Tuple[int, str] = (20000, "Ok.")) -> Dict[str, Any]:
+    return {
+        "id": str(uuid.uuid4()),
+        "status_code": status[0],
+        "status_message": status[1],
+        "time": "0.0000 sec.",
+        "cost": cost if status[0] < 40000 else 0,
+        "result_count": len(result) if result else 0,
+        "path": ["v3", *path.split("/")],
+        "data": data,
+        "result": result,
+    }
+
+
+class MockDataForSEO:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.in_flight = 0
+        self.tasks: Dict[str, Tuple[Dict[str, Any], float]] = {}  # id -> (task_post entry, ready at)
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    # --- Synthetic content ---
+
+    def _padding(self) -> str:
+        return "x" * self.config.padding_bytes
+
+    def serp_result(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        keyword = entry.get("keyword", "")
+        location = entry.get("location_name") or entry.get("location_code") or "United States"
+        device = entry.get("device", "desktop")
+        today = datetime.date.today().isoformat()
+        rng = _stable_rng(keyword, location, device, today)
+
+        count = self.config.serp_items
+        domains = [f"site{n}.com" for n in rng.sample(range(self.config.domain_pool), min(count, self.config.domain_pool))]
+        for domain in self.config.planted_domains:
+            if rng.random() < self.config.plant_rate:
+                domains.insert(rng.randrange(len(domains) + 1), domain)
+        domains = domains[:count]
+
+        slug = keyword.replace(" ", "-")
+        items = [
+            {
+                "type": "organic",
+                "rank_group": rank,
+                "rank_absolute": rank,
+                "position": "left",
+                "xpath": f"/html[1]/body[1]/div[{rank}]",
+                "domain": domain,
+                "title": f"{keyword.title()} - {domain}",
+                "url": f"https://{domain}/{slug}",
+                "breadcrumb": f"https://{domain} › {slug}",
+                "is_image": False,
+                "is_video": False,
+                "is_featured_snippet": rank == 1,
+                "description": f"Everything about {keyword} from {domain}. {self._padding()}",
+            }
+            for rank, domain in enumerate(domains, start=1)
+        ]
+        return {
+            "keyword": keyword,
+            "type": "organic",
+            "se_domain": "google.com",
+            "location_code": entry.get("location_code", 2840),
+            "language_code": entry.get("language_code", "en"),
+            "check_url": f"https://www.google.com/search?q={keyword.replace(' ', '+')}",
+            "datetime": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S +00:00"),
+            "spell": None,
+            "item_types": ["organic"],
+            "se_results_count": rng.randrange(10_000, 50_000_000),
+            "items_count": len(items),
+            "items": items,
+        }
+
+    def ranked_item(self, target: str, position: int) -> Dict[str, Any]:
+        rng = _stable_rng(target, position)
+        words = rng.sample(WORDS, 3)
+        keyword = f"{words[0]} {target.split('.')[0]} {words[1]} {words[2]} {position}"
+        rank = rng.randint(1, 100)
+        return {
+            "se_type": "google",
+            "keyword_data": {
+                "keyword": keyword,
+                "location_code": 2840,
+                "language_code": "en",
+                "keyword_info": {
+                    "search_volume": int(rng.paretovariate(1.2) * 50),
+                    "cpc": round(rng.uniform(0.1, 25.0), 2),
+                    "competition": round(rng.random(), 2),
+                    "competition_level": rng.choice(COMPETITION_LEVELS),
+                },
+            },
+            "ranked_serp_element": {
+                "serp_item": {
+                    "type": "organic",
+                    "rank_group": rank,
+                    "rank_absolute": rank,
+                    "domain": target,
+                    "url": f"https://{target}/{keyword.replace(' ', '-')}",
+                    "description": self._padding(),
+                },
+            },
+        }
+
+    # --- Handlers ---
+
+    async def live_regular(self, request: web.Request) -> Dict[str, Any]:
+        path = SERP_PREFIX + "live/regular"
+        entries = await request.json()
+        tasks = [_task(path, entry, [self.serp_result(entry)], 0.002) for entry in entries[:1]]
+        return _envelope(tasks, request["started"])
+
+    async def task_post(self, request: web.Request) -> Dict[str, Any]:
+        path = SERP_PREFIX + "task_post"
+        entries = await request.json()
+        tasks = []
+        for entry in entries[:100]:
+            task = _task(path, entry, None, 0.0006, (20100, "Task Created."))
+            self.tasks[task["id"]] = (entry, time.monotonic() + self.config.task_delay)
+            tasks.append(task)
+        return _envelope(tasks, request["started"])
+
+    async def tasks_ready(self, request: web.Request) -> Dict[str, Any]:
+        now = time.monotonic()
+        ready = [
+            {
+                "id": task_id,
+                "se": "google",
+                "se_type": "organic",
+                "date_posted": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S +00:00"),
+                "tag": entry.get("tag"),
+                "endpoint_regular": f"/v3/{SERP_PREFIX}task_get/regular/{task_id}",
+            }
+            for task_id, (entry, ready_at) in self.tasks.items()
+            if ready_at <= now
+        ][:1000]
+        return _envelope([_task(SERP_PREFIX + "tasks_ready", {}, ready, 0)], request["started"])
+
+    async def task_get(self, request: web.Request) -> Dict[str, Any]:
+        task_id = request.match_info["task_id"]
+        path = f"{SERP_PREFIX}task_get/regular/{task_id}"
+        queued = self.tasks.get(task_id)
+        if queued is None:
+            return _envelope([_task(path, {}, None, 0, (40400, "Not Found."))], request["started"])
+        entry, ready_at = queued
+        if ready_at > time.monotonic():
+            return _envelope([_task(path, entry, None, 0, (40602, "Task In Queue."))], request["started"])
+        del self.tasks[task_id]
+        task = _task(path, entry, [self.serp_result(entry)], 0)
+        task["id"] = task_id
+        return _envelope([task], request["started"])
+
+    async def ranked_keywords(self, request: web.Request) -> Dict[str, Any]:
+        entry = (await request.json())[0]
+        target = entry.get("target", "")
+        offset = entry.get("offset", 0)
+        limit = min(entry.get("limit", 100), 1000)
+        end = min(offset + limit, self.config.ranked_total)
+        items = [self.ranked_item(target, position) for position in range(offset, end)]
+        result = [{
+            "se_type": "google",
+            "target": target,
+            "location_code": entry.get("location_code", 2840),
+            "language_code": entry.get("language_code", "en"),
+            "total_count": self.config.ranked_total,
+            "items_count": len(items),
+            "items": items,
+        }]
+        return _envelope([_task(RANKED_KEYWORDS_PATH, entry, result, 0.01 + 0.0001 * len(items))], request["started"])
+
+    @web.middleware
+    async def inject_faults(self, request: web.Request, handler):
+        """Latency, throttling and server errors, applied to every endpoint."""
+        request["started"] = time.monotonic()
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            config = self.config
+            delay = config.latency_ms / 1000 * (self.rng.lognormvariate(0, config.latency_sigma) if config.latency_sigma else 1)
+            await asyncio.sleep(delay)
+            if (config.max_in_flight and self.in_flight > config.max_in_flight) or self.rng.random() < config.rate_limit_rate:
+                self.throttled += 1
+                return web.json_response(
+                    {"status_code": 40202, "status_message": "Rate limit per minute exceeded."},
+                    status=429,
+                    headers={"Retry-After": str(config.retry_after)},
+                )
+            if self.rng.random() < config.error_rate:
+                self.errors += 1
+                return web.Response(status=self.rng.choice((500, 502, 503)), text="Internal Server Error")
+            return web.json_response(await handler(request))
+        finally:
+            self.in_flight -= 1
+
+    async def stats(self, request: web.Request) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "queued_tasks": len(self.tasks),
+        }
+
+
+def create_app(config: MockConfig | None = None) -> web.Application:
+    mock = MockDataForSEO(config or MockConfig())
+    app = web.Application(middlewares=[mock.inject_faults])
+    app.router.add_post(f"/v3/{SERP_PREFIX}live/regular", mock.live_regular)
+    app.router.add_post(f"/v3/{SERP_PREFIX}task_post", mock.task_post)
+    app.router.add_get(f"/v3/{SERP_PREFIX}tasks_ready", mock.tasks_ready)
+    app.router.add_get(f"/v3/{SERP_PREFIX}task_get/regular/{{task_id}}", mock.task_get)
+    app.router.add_post(f"/v3/{RANKED_KEYWORDS_PATH}", mock.ranked_keywords)
+    app.router.add_get("/v3/mock/stats", mock.stats)
+    app["mock"] = mock
+    return app
+
+
+def main() -> None:
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(description="Local DataForSEO stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms, help="median response time")
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma, help="log-normal spread (0 = fixed)")
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate, help="share of calls answered with 429")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="share of calls answered with 5xx")
+    parser.add_argument("--max-in-flight", type=int, default=defaults.max_in_flight, help="429 above this many concurrent calls")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument("--serp-items", type=int, default=defaults.serp_items)
+    parser.add_argument("--ranked-total", type=int, default=defaults.ranked_total)
+    parser.add_argument("--padding-bytes", type=int, default=defaults.padding_bytes, help="extra bytes per item")
+    parser.add_argument("--task-delay", type=float, default=defaults.task_delay, help="seconds until a posted task is ready")
+    parser.add_argument("--domain-pool", type=int, default=defaults.domain_pool)
+    parser.add_argument("--domain", dest="planted_domains", action="append", default=[], help="domain to plant in SERPs (repeatable)")
+    parser.add_argument("--plant-rate", type=float, default=defaults.plant_rate)
+    parser.add_argument("--seed", type=int, default=None)
+    args = vars(parser.parse_args())
+    host, port = args.pop("host"), args.pop("port")
+
+    print(f"🧪 Mock DataForSEO on http://{host}:{port}/v3/ - set DATAFORSEO_BASE_URL to use it")
+    web.run_app(create_app(MockConfig(**args)), host=host, port=port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import asyncio
+import os
+import sys
+
+# Add the project root to the sys.path to allow absolute imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.tasks.history_tasks import partition_ranking_history
+
+if __name__ == "__main__":
+    asyncio.run(partition_ranking_history())
@@ -1,22 +1,204 @@
+import asyncio
+import datetime
+from typing import List, Tuple
 from prefect import task
-from src.utils.gemini_client import GeminiAgent
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from src.config.settings import settings
+from src.models.core import AnalysisMemo
+from src.utils.database import engine
+from src.utils.gemini_client import GeminiAgent, UNAVAILABLE_PREFIX, get_gemini_agent
 
-@task
-async def analyze_ranking(keyword: str, rank: int, url: str) -> str:
-    agent = GeminiAgent()
-    
-    prompt = f"You are an SEO Strategist. The keyword '{keyword}' is currently ranking #{rank} for URL '{url}'.\n"
-    
+STRATEGIST_ROLE = "You are an SEO Strategist."
+LENGTH_RULE = "Keep the output under 50 words, actionable and prescriptive."
+
+
+def rank_bucket(rank: int) -> str:
+    """The strategy branch a rank falls into. Prescriptions only differ between buckets."""
     if rank > 100:
-        prompt += "Prescribe a 'Foundation & Indexing' strategy."
+        return "foundation"
     elif 11 <= rank <= 20:
-        prompt += "Prescribe a 'Strike Distance' optimization strategy."
+        return "strike"
     elif 1 <= rank <= 10:
+        return "defense"
+    return "not_found"
+
+
+def describe_ranking(keyword: str, rank: int, url: str) -> str:
+    """The per-keyword part of the prompt: the situation and the strategy to prescribe."""
+    prompt = f"The keyword '{keyword}' is currently ranking #{rank} for URL '{url}'.\n"
+
+    bucket = rank_bucket(rank)
+    if bucket == "foundation":
+        prompt += "Prescribe a 'Foundation & Indexing' strategy."
+    elif bucket == "strike":
+        prompt += "Prescribe a 'Strike Distance' optimization strategy."
+    elif bucket == "defense":
         prompt += "Prescribe a 'Defense & CTR' strategy."
     else: # rank == 0 or other cases
         prompt += "The domain was not found in the top 100. Prescribe a 'Foundation & Indexing' strategy."
+    return prompt
+
+
+def build_prompt(keyword: str, rank: int, url: str) -> str:
+    return f"{STRATEGIST_ROLE} {describe_ranking(keyword, rank, url)}\n{LENGTH_RULE}"
+
+
+async def _load_memo(keyword: str, bucket: str, url: str) -> str | None:
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=settings.ANALYSIS_MEMO_TTL_DAYS)
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            select(AnalysisMemo.analysis).where(
+                AnalysisMemo.keyword == keyword,
+                AnalysisMemo.rank_bucket == bucket,
+                AnalysisMemo.url == url,
+                AnalysisMemo.created_at >= cutoff,
+            )
+        )
+        return result.scalar()
 
-    prompt += "\nKeep the output under 50 words, actionable and prescriptive."
-    
-    analysis = await agent.generate_content(prompt)
+
+async def _store_memo(keyword: str, bucket: str, url: str, analysis: str) -> None:
+    # Placeholders with the UNAVAILABLE_PREFIX are never memoized; callers check before storing
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(AnalysisMemo).values(
+        keyword=keyword, rank_bucket=bucket, url=url, analysis=analysis, created_at=datetime.datetime.utcnow()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["keyword", "rank_bucket", "url"],
+        set_={"analysis": stmt.excluded.analysis, "created_at": stmt.excluded.created_at},
+    )
+    async with engine.begin() as conn:
+        await conn.execute(stmt)
+
+
+@task
+async def analyze_ranking(keyword: str, rank: int, url: str, use_memo: bool = True) -> str:
+    """
+    Returns a short Gemini prescription for a keyword's current rank.
+    With use_memo, the last prescription for the same (keyword, rank bucket, url)
+    is reused until it is older than ANALYSIS_MEMO_TTL_DAYS.
+    """
+    bucket = rank_bucket(rank)
+    if use_memo:
+        memo = await _load_memo(keyword, bucket, url)
+        if memo is not None:
+            return memo
+
+    agent = get_gemini_agent()
+    analysis = await agent.generate_content(build_prompt(keyword, rank, url))
+
+    if use_memo and not analysis.startswith(UNAVAILABLE_PREFIX):
+        await _store_memo(keyword, bucket, url, analysis)
     return analysis
+
+
+class AnalysisBatcher:
+    """
+    Coalesces concurrent analysis requests into multi-item Gemini calls.
+
+    Callers await analyze() one keyword at a time, as with analyze_ranking;
+    requests are packed ANALYSIS_BATCH_SIZE at a time (or whatever arrived
+    within ANALYSIS_BATCH_WAIT_SECONDS) into a single JSON-mode prompt via
+    GeminiAgent.generate_batch, cutting round trips by roughly the batch size.
+    Items the model leaves out or returns malformed are re-run individually.
+    """
+
+    def __init__(
+        self,
+        batch_size: int | None = None,
+        max_wait: float | None = None,
+        concurrency: int | None = None,
+        use_memo: bool = True,
+    ):
+        self.batch_size = batch_size or settings.ANALYSIS_BATCH_SIZE
+        self.max_wait = settings.ANALYSIS_BATCH_WAIT_SECONDS if max_wait is None else max_wait
+        self.use_memo = use_memo
+        self._slots = asyncio.Semaphore(concurrency or settings.HARVEST_AI_CONCURRENCY)
+        self._pending: List[Tuple[Tuple[str, int, str], asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._batches: set = set()
+        self._agent: GeminiAgent | None = None
+
+        self.requests = 0
+        self.requeued = 0
+
+    @property
+    def agent(self) -> GeminiAgent:
+        if self._agent is None:
+            self._agent = get_gemini_agent()
+        return self._agent
+
+    async def analyze(self, keyword: str, rank: int, url: str) -> str:
+        bucket = rank_bucket(rank)
+        if self.use_memo:
+            memo = await _load_memo(keyword, bucket, url)
+            if memo is not None:
+                return memo
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((keyword, rank, url), future))
+        if len(self._pending) >= self.batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._dispatch)
+        analysis = await future
+
+        if self.use_memo and not analysis.startswith(UNAVAILABLE_PREFIX):
+            await _store_memo(keyword, bucket, url, analysis)
+        return analysis
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._dispatch)
+        if batch:
+            run = asyncio.create_task(self._run(batch))
+            self._batches.add(run)
+            run.add_done_callback(self._batches.discard)
+
+    async def _run(self, batch: List[Tuple[Tuple[str, int, str], asyncio.Future]]) -> None:
+        try:
+            async with self._slots:
+                self.requests += 1
+                if len(batch) == 1:
+                    outputs = {"0": await self.agent.generate_content(build_prompt(*batch[0][0]))}
+                else:
+                    outputs = await self.agent.generate_batch(
+                        f"{STRATEGIST_ROLE} Each item describes a keyword ranking. {LENGTH_RULE}",
+                        {str(index): describe_ranking(*item) for index, (item, _) in enumerate(batch)},
+                    )
+
+            if outputs is None:
+                # The request itself failed; retrying item by item would only multiply the errors
+                outputs = {}
+                missing = []
+            else:
+                missing = [index for index in range(len(batch)) if str(index) not in outputs]
+            if missing:
+                self.requeued += len(missing)
+                print(f"WARNING: {len(missing)} of {len(batch)} batched analyses came back unusable; retrying them individually.")
+                retried = await asyncio.gather(*(self._run_single(batch[index][0]) for index in missing))
+                outputs.update({str(index): analysis for index, analysis in zip(missing, retried)})
+
+            for index, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(outputs.get(str(index), "Analysis unavailable due to API error."))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    async def _run_single(self, item: Tuple[str, int, str]) -> str:
+        async with self._slots:
+            self.requests += 1
+            return await self.agent.generate_content(build_prompt(*item))
+
+    async def close(self) -> None:
+        """Sends whatever is still queued and waits for every batch in flight."""
+        while self._pending:
+            self._dispatch()
+        await asyncio.gather(*self._batches, return_exceptions=True)
@@ -1,18 +1,142 @@
+import datetime
+from dataclasses import dataclass
 from prefect import task
-from src.utils.database import async_session
-from src.models.core import Keyword, RankingLog
+from src.config.settings import settings
+from src.utils.database import async_session, engine
+from src.models.core import HarvestCheckpoint, Keyword, RankingLog
+from src.utils.rank_writer import upsert_latest_ranks
+from sqlalchemy import exists, func, tuple_
 from sqlalchemy.future import select
-from typing import List
+from sqlalchemy.engine import Row
+from typing import AsyncIterator, List, Tuple
+
+# Only the columns the harvest needs; rows are plain tuples, not tracked ORM objects
+HARVEST_COLUMNS = (Keyword.id, Keyword.text, Keyword.domain, Keyword.location, Keyword.device)
+# What makes two keywords share one result page (see src/tasks/serp_tasks.py::serp_key)
+SERP_COLUMNS = (Keyword.text, Keyword.location, Keyword.device)
+SerpKey = Tuple[str, str, str]
+
+
+@dataclass(frozen=True)
+class KeywordShard:
+    """
+    Selects the slice of the keyword table handled by one harvest worker, either
+    by modulo on the keyword id (`index` of `count`), by id range [start_id, end_id)
+    or by SERP key range [start_serp, end_serp) (used by harvest leases).
+    """
+    index: int | None = None
+    count: int | None = None
+    start_id: int | None = None
+    end_id: int | None = None
+    start_serp: SerpKey | None = None
+    end_serp: SerpKey | None = None
+
+    @classmethod
+    def parse(cls, spec: str) -> "KeywordShard":
+        """Parses '2/8' (modulo) or '1000-5000' / '1000-' (id range)."""
+        try:
+            if "/" in spec:
+                index, count = (int(part) for part in spec.split("/", 1))
+                if count < 1 or not 0 <= index < count:
+                    raise ValueError
+                return cls(index=index, count=count)
+            if "-" in spec:
+                start, end = spec.split("-", 1)
+                return cls(start_id=int(start) if start else None, end_id=int(end) if end else None)
+        except ValueError:
+            pass
+        raise ValueError(f"Invalid shard spec '{spec}'. Use '<index>/<count>' or '<start_id>-<end_id>'.")
+
+    def apply(self, stmt):
+        if self.count is not None:
+            stmt = stmt.where(Keyword.id % self.count == self.index)
+        if self.start_id is not None:
+            stmt = stmt.where(Keyword.id >= self.start_id)
+        if self.end_id is not None:
+            stmt = stmt.where(Keyword.id < self.end_id)
+        if self.start_serp is not None:
+            stmt = stmt.where(tuple_(*SERP_COLUMNS) >= tuple_(*self.start_serp))
+        if self.end_serp is not None:
+            stmt = stmt.where(tuple_(*SERP_COLUMNS) < tuple_(*self.end_serp))
+        return stmt
+
+    def __str__(self) -> str:
+        if self.count is not None:
+            return f"{self.index}/{self.count}"
+        if self.start_serp is not None or self.end_serp is not None:
+            return f"{self.start_serp or ''}..{self.end_serp or ''}"
+        return f"{self.start_id or ''}-{self.end_id or ''}"
+
 
 @task
 async def get_active_keywords() -> List[Keyword]:
     async with async_session() as session:
-        result = await session.execute(select(Keyword))
+        result = await session.execute(select(Keyword).where(Keyword.active.is_(True)))
         return result.scalars().all()
 
+
+async def stream_keywords(
+    chunk_size: int | None = None,
+    shard: KeywordShard | None = None,
+    pending_on: datetime.date | None = None,
+    group_serps: bool = False,
+) -> AsyncIterator[List[Row]]:
+    """
+    Yields active keywords in id-ordered chunks through a server-side cursor.
+    Memory stays bounded by chunk_size no matter how large the table grows.
+    With pending_on, keywords already checkpointed for that harvest date are skipped.
+
+    With group_serps, keywords are ordered by SERP identity (text, location,
+    device) instead and a chunk never splits one SERP's keywords, so grouping
+    each chunk sees every tracked domain of a SERP at once. A chunk can then
+    run past chunk_size by the size of its last group.
+    """
+    chunk_size = chunk_size or settings.HARVEST_CHUNK_SIZE
+    order = (*SERP_COLUMNS, Keyword.id) if group_serps else (Keyword.id,)
+    stmt = select(*HARVEST_COLUMNS).where(Keyword.active.is_(True)).order_by(*order)
+    if shard:
+        stmt = shard.apply(stmt)
+    if pending_on:
+        stmt = stmt.where(~exists().where(
+            HarvestCheckpoint.harvest_date == pending_on,
+            HarvestCheckpoint.keyword_id == Keyword.id,
+        ))
+
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=chunk_size))
+        carry: List[Row] = []
+        async for rows in result.partitions(chunk_size):
+            if not group_serps:
+                yield rows
+                continue
+            # Hold back the trailing SERP group: the rest of it may be in the next partition
+            rows = carry + list(rows)
+            last = (rows[-1].text, rows[-1].location, rows[-1].device)
+            cut = len(rows)
+            while cut and (rows[cut - 1].text, rows[cut - 1].location, rows[cut - 1].device) == last:
+                cut -= 1
+            carry = rows[cut:]
+            if cut:
+                yield rows[:cut]
+        if carry:
+            yield carry
+
+
+async def count_checkpoints(harvest_date: datetime.date) -> int:
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            select(func.count()).select_from(HarvestCheckpoint).where(HarvestCheckpoint.harvest_date == harvest_date)
+        )
+        return result.scalar()
+
+
 @task
 async def save_rank_history(keyword_id: int, rank: int, url: str, analysis: str | None = None):
     async with async_session() as session:
         async with session.begin():
             ranking_log = RankingLog(keyword_id=keyword_id, rank=rank, url=url, analysis=analysis)
             session.add(ranking_log)
+            await upsert_latest_ranks(
+                await session.connection(),
+                [{"keyword_id": keyword_id, "rank": rank, "url": url, "analysis": analysis}],
+            )
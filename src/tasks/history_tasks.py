@@ -0,0 +1,334 @@
+"""
+Storage tiers for rank history.
+
+ranking_history holds one raw row per keyword per harvest. On Postgres it is
+range-partitioned by month on created_at, so old months can be dropped as a
+whole and recent queries only touch recent partitions.
+
+ranking_rollups holds day, week and month aggregates per keyword (min/avg/max
+rank, sample count and URL changes). The compaction flow keeps every tier
+current for recent periods and then trims each tier to its retention window:
+raw rows after HISTORY_RAW_RETENTION_DAYS, daily rollups after
+HISTORY_DAILY_RETENTION_DAYS, weekly rollups after HISTORY_WEEKLY_RETENTION_DAYS.
+Monthly rollups are kept indefinitely. Long-range charts read the coarsest tier
+that still gives a useful resolution (see load_rank_series).
+"""
+import datetime
+import re
+from typing import Any, Dict, List
+
+from sqlalchemy import Date, and_, case, cast, delete, func, literal, select, text, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from src.config.settings import settings
+from src.models.core import HarvestCheckpoint, RankingLog, RankingRollup
+from src.utils.database import engine
+
+PERIODS = ("day", "week", "month")
+PARTITION_NAME = re.compile(r"^ranking_history_y(\d{4})m(\d{2})$")
+
+
+def _is_postgres() -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def _month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def _add_months(day: datetime.date, months: int) -> datetime.date:
+    month = day.month - 1 + months
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _week_start(day: datetime.date) -> datetime.date:
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def _truncate(column, period: str):
+    """SQL expression mapping a date/timestamp column to the first day of its period."""
+    if _is_postgres():
+        return cast(func.date_trunc(period, column), Date)
+    if period == "day":
+        return func.date(column)
+    if period == "week":
+        return func.date(column, "weekday 0", "-6 days")  # Monday of the ISO week
+    return func.date(column, "start of month")
+
+
+def _upsert_rollups(select_stmt):
+    dialect = postgresql if _is_postgres() else sqlite
+    columns = ["keyword_id", "period", "period_start", "min_rank", "max_rank", "avg_rank", "samples", "url_changes"]
+    stmt = dialect.insert(RankingRollup).from_select(columns, select_stmt)
+    return stmt.on_conflict_do_update(
+        index_elements=["keyword_id", "period", "period_start"],
+        set_={column: stmt.excluded[column] for column in columns[3:]},
+    )
+
+
+# --- Postgres partitioning ---
+
+async def partition_ranking_history() -> bool:
+    """
+    One-off migration turning an existing ranking_history table into a table
+    partitioned by month. Returns False if there is nothing to do.
+    """
+    if not _is_postgres():
+        print("Partitioning is only supported on Postgres; skipping.")
+        return False
+
+    async with engine.begin() as conn:
+        relkind = (await conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'ranking_history'"))).scalar()
+        if relkind == "p":
+            print("ranking_history is already partitioned.")
+            return False
+
+        await conn.execute(text("ALTER TABLE ranking_history RENAME TO ranking_history_unpartitioned"))
+        await conn.execute(text(
+            "CREATE TABLE ranking_history (LIKE ranking_history_unpartitioned INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (created_at)"
+        ))
+        await conn.execute(text("ALTER SEQUENCE ranking_history_id_seq OWNED BY ranking_history.id"))
+        # Unique constraints on a partitioned table must include the partition key
+        await conn.execute(text("ALTER TABLE ranking_history ADD PRIMARY KEY (id, created_at)"))
+        await conn.execute(text(
+            "ALTER TABLE ranking_history ADD FOREIGN KEY (keyword_id) REFERENCES keywords (id)"
+        ))
+        await conn.execute(text("DROP INDEX IF EXISTS ix_ranking_history_keyword_created"))
+        await conn.execute(text(
+            "CREATE INDEX ix_ranking_history_keyword_created ON ranking_history (keyword_id, created_at)"
+        ))
+        await conn.execute(text("CREATE TABLE ranking_history_default PARTITION OF ranking_history DEFAULT"))
+
+        oldest = (await conn.execute(text("SELECT min(created_at) FROM ranking_history_unpartitioned"))).scalar()
+        await _create_month_partitions(conn, oldest.date() if oldest else datetime.date.today())
+
+        await conn.execute(text("INSERT INTO ranking_history SELECT * FROM ranking_history_unpartitioned"))
+        await conn.execute(text("DROP TABLE ranking_history_unpartitioned"))
+    print("ranking_history is now partitioned by month.")
+    return True
+
+
+async def _create_month_partitions(conn, since: datetime.date) -> None:
+    last = _add_months(datetime.date.today(), settings.HISTORY_PARTITION_MONTHS_AHEAD)
+    month = _month_start(since)
+    while month <= last:
+        upper = _add_months(month, 1)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS ranking_history_y{month.year:04d}m{month.month:02d} "
+            f"PARTITION OF ranking_history FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+        ))
+        month = upper
+
+
+async def ensure_month_partitions() -> None:
+    """Creates the current and upcoming monthly partitions (no-op unless partitioned)."""
+    if not _is_postgres():
+        return
+    async with engine.begin() as conn:
+        relkind = (await conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'ranking_history'"))).scalar()
+        if relkind == "p":
+            await _create_month_partitions(conn, datetime.date.today())
+
+
+async def _drop_expired_partitions(conn, cutoff: datetime.date) -> int:
+    partitions = (await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = 'ranking_history'"
+    ))).scalars().all()
+    dropped = 0
+    for name in partitions:
+        match = PARTITION_NAME.match(name)
+        if match and _add_months(datetime.date(int(match[1]), int(match[2]), 1), 1) <= cutoff:
+            await conn.execute(text(f"DROP TABLE {name}"))
+            dropped += 1
+    return dropped
+
+
+# --- Rollups ---
+
+async def rollup_raw_history(since: datetime.date | None = None) -> int:
+    """
+    Recomputes daily rollups from raw rows from `since` onward (defaults to the
+    last day already rolled up, so each run only touches new data).
+    """
+    async with engine.begin() as conn:
+        if since is None:
+            since = (await conn.execute(
+                select(func.max(RankingRollup.period_start)).where(RankingRollup.period == "day")
+            )).scalar()
+        since_ts = datetime.datetime.combine(since, datetime.time()) if since else datetime.datetime.min
+
+        columns = (RankingLog.id, RankingLog.keyword_id, RankingLog.created_at, RankingLog.rank, RankingLog.url)
+        rows = select(*columns).where(RankingLog.created_at >= since_ts)
+        if since:
+            # Each keyword's last sample before `since`, however old, so lag()
+            # sees the URL the first new sample replaced: changes across the
+            # boundary of the previous rollup count even after skipped days.
+            # One index lookup per keyword (keyword_id, created_at).
+            recent = select(RankingLog.keyword_id).where(RankingLog.created_at >= since_ts).distinct().subquery()
+            earlier = aliased(RankingLog)
+            previous = select(
+                recent.c.keyword_id,
+                select(func.max(earlier.created_at))
+                .where(earlier.keyword_id == recent.c.keyword_id, earlier.created_at < since_ts)
+                .scalar_subquery()
+                .label("created_at"),
+            ).subquery()
+            seeds = select(*columns).join(
+                previous,
+                and_(RankingLog.keyword_id == previous.c.keyword_id, RankingLog.created_at == previous.c.created_at),
+            )
+            rows = union_all(seeds, rows)
+        rows = rows.subquery()
+
+        ordered = select(
+            rows.c.keyword_id,
+            rows.c.created_at,
+            rows.c.rank,
+            rows.c.url,
+            func.lag(rows.c.url).over(
+                partition_by=rows.c.keyword_id, order_by=(rows.c.created_at, rows.c.id)
+            ).label("previous_url"),
+        ).subquery()
+
+        samples = select(
+            ordered.c.keyword_id,
+            _truncate(ordered.c.created_at, "day").label("day"),
+            ordered.c.rank,
+            case(
+                (and_(ordered.c.previous_url.is_not(None), ordered.c.previous_url != ordered.c.url), 1), else_=0
+            ).label("changed"),
+        ).where(ordered.c.created_at >= since_ts).subquery()
+
+        daily = select(
+            samples.c.keyword_id,
+            literal("day"),
+            samples.c.day,
+            func.min(samples.c.rank),
+            func.max(samples.c.rank),
+            func.avg(samples.c.rank),
+            func.count(),
+            func.sum(samples.c.changed),
+        ).where(samples.c.day.is_not(None)).group_by(samples.c.keyword_id, samples.c.day)
+        result = await conn.execute(_upsert_rollups(daily))
+    return result.rowcount
+
+
+async def rollup_periods(since: datetime.date) -> None:
+    """Recomputes weekly and monthly rollups for every period touching days >= since."""
+    async with engine.begin() as conn:
+        for period, period_start in (("week", _week_start(since)), ("month", _month_start(since))):
+            bucket = _truncate(RankingRollup.period_start, period).label("bucket")
+            days = select(
+                RankingRollup.keyword_id,
+                bucket,
+                RankingRollup.min_rank,
+                RankingRollup.max_rank,
+                RankingRollup.avg_rank,
+                RankingRollup.samples,
+                RankingRollup.url_changes,
+            ).where(RankingRollup.period == "day", RankingRollup.period_start >= period_start).subquery()
+
+            aggregated = select(
+                days.c.keyword_id,
+                literal(period),
+                days.c.bucket,
+                func.min(days.c.min_rank),
+                func.max(days.c.max_rank),
+                func.sum(days.c.avg_rank * days.c.samples) / func.sum(days.c.samples),
+                func.sum(days.c.samples),
+                func.sum(days.c.url_changes),
+            ).where(days.c.bucket.is_not(None)).group_by(days.c.keyword_id, days.c.bucket)
+            await conn.execute(_upsert_rollups(aggregated))
+
+
+async def apply_retention(today: datetime.date | None = None) -> Dict[str, int]:
+    """
+    Trims raw rows and finer rollup tiers that are older than their retention
+    windows, along with expired harvest checkpoints.
+    """
+    today = today or datetime.date.today()
+    raw_cutoff = today - datetime.timedelta(days=settings.HISTORY_RAW_RETENTION_DAYS)
+    # Only drop rollups for whole periods, so the coarser tier covers everything removed
+    daily_cutoff = _month_start(today - datetime.timedelta(days=settings.HISTORY_DAILY_RETENTION_DAYS))
+    weekly_cutoff = _month_start(today - datetime.timedelta(days=settings.HISTORY_WEEKLY_RETENTION_DAYS))
+
+    removed = {"partitions": 0}
+    async with engine.begin() as conn:
+        if _is_postgres():
+            removed["partitions"] = await _drop_expired_partitions(conn, raw_cutoff)
+        raw = await conn.execute(
+            delete(RankingLog).where(RankingLog.created_at < datetime.datetime.combine(raw_cutoff, datetime.time()))
+        )
+        removed["raw"] = raw.rowcount
+        for period, cutoff in (("day", daily_cutoff), ("week", weekly_cutoff)):
+            result = await conn.execute(
+                delete(RankingRollup).where(RankingRollup.period == period, RankingRollup.period_start < cutoff)
+            )
+            removed[period] = result.rowcount
+        checkpoints = await conn.execute(
+            delete(HarvestCheckpoint).where(
+                HarvestCheckpoint.harvest_date < today - datetime.timedelta(days=settings.HARVEST_CHECKPOINT_RETENTION_DAYS)
+            )
+        )
+        removed["checkpoints"] = checkpoints.rowcount
+    return removed
+
+
+# --- Reading ---
+
+def series_period(start: datetime.date, end: datetime.date) -> str:
+    """Coarsest rollup tier that still gives a readable chart for the range."""
+    span = (end - start).days
+    if span <= 120:
+        return "day"
+    if span <= 730:
+        return "week"
+    return "month"
+
+
+async def load_rank_series(
+    keyword_id: int,
+    start: datetime.date,
+    end: datetime.date | None = None,
+    period: str | None = None,
+    session: AsyncSession | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Rank history for charts, read from ranking_rollups rather than raw rows.
+    API routes pass their request session; other callers get a connection of their own.
+    """
+    end = end or datetime.date.today()
+    period = period or series_period(start, end)
+    if period not in PERIODS:
+        raise ValueError(f"Unknown rollup period '{period}'. Expected one of {PERIODS}.")
+
+    stmt = (
+        select(*RankingRollup.__table__.columns)  # Plain rows on a session too, not ORM objects
+        .where(
+            RankingRollup.keyword_id == keyword_id,
+            RankingRollup.period == period,
+            RankingRollup.period_start >= _truncate_date(start, period),
+            RankingRollup.period_start <= end,
+        )
+        .order_by(RankingRollup.period_start)
+    )
+    if session is not None:
+        rows = await session.execute(stmt)
+    else:
+        async with engine.connect() as conn:
+            rows = await conn.execute(stmt)
+    return [dict(row._mapping) for row in rows]
+
+
+def _truncate_date(day: datetime.date, period: str) -> datetime.date:
+    if period == "week":
+        return _week_start(day)
+    if period == "month":
+        return _month_start(day)
+    return day
@@ -0,0 +1,209 @@
+"""
+Job-claiming layer for running the daily harvest on several workers.
+
+Each harvest date's active keywords are cut into ranges of roughly
+HARVEST_LEASE_SIZE keywords in SERP order (text, location, device), one
+harvest_leases row per range. A range only ever ends on a SERP boundary, so
+every keyword of a result page lands in the same lease and the page is fetched
+once, however far apart the keyword ids of its tracked domains are.
+
+Workers claim a pending (or expired) range, heartbeat it while they process it
+and mark it done. A range
+whose keywords did not all get a checkpoint goes back to pending instead, so
+failed keywords are retried the same day (up to HARVEST_LEASE_MAX_ATTEMPTS passes).
+
+On Postgres the claim uses SELECT ... FOR UPDATE SKIP LOCKED so concurrent
+workers never block on each other. SQLite has no row locks (the clause is not
+rendered); there the claim relies on the conditional UPDATE below, which only
+succeeds for the worker that flips the row first.
+"""
+import datetime
+import json
+import os
+import socket
+
+from sqlalchemy import and_, exists, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.config.settings import settings
+from src.models.core import HarvestCheckpoint, HarvestLease, Keyword
+from src.tasks.db_tasks import SERP_COLUMNS, KeywordShard
+from src.utils.database import engine
+
+CLAIM_ATTEMPTS = 5
+
+
+def default_worker_id() -> str:
+    return settings.HARVEST_WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+def _claimable(harvest_date: datetime.date, now: datetime.datetime):
+    return and_(
+        HarvestLease.harvest_date == harvest_date,
+        or_(
+            HarvestLease.status == "pending",
+            and_(HarvestLease.status == "leased", HarvestLease.lease_expires_at < now),
+        ),
+    )
+
+
+def lease_shard(lease: HarvestLease) -> KeywordShard:
+    """The keywords a lease covers, as a shard for stream_keywords."""
+    return KeywordShard(
+        start_serp=tuple(json.loads(lease.start_serp)) if lease.start_serp else None,
+        end_serp=tuple(json.loads(lease.end_serp)) if lease.end_serp else None,
+    )
+
+
+async def plan_harvest_leases(harvest_date: datetime.date, lease_size: int | None = None) -> int:
+    """
+    Creates the lease rows for a harvest date, once: workers that find a plan
+    already in place reuse it, so this is safe to call from all of them. The
+    first range is open at the bottom and the last at the top, so keywords
+    added after planning still fall into some lease. Returns the number of ranges.
+    """
+    lease_size = lease_size or settings.HARVEST_LEASE_SIZE
+    async with engine.begin() as conn:
+        planned = (
+            await conn.execute(select(func.count()).select_from(HarvestLease).where(HarvestLease.harvest_date == harvest_date))
+        ).scalar()
+        if planned:
+            return planned
+
+        # One row per SERP with its keyword count; cut before the SERP that would overfill a range
+        serps = await conn.stream(
+            select(*SERP_COLUMNS, func.count())
+            .where(Keyword.active.is_(True))
+            .group_by(*SERP_COLUMNS)
+            .order_by(*SERP_COLUMNS)
+        )
+        bounds, filled = [None], 0
+        async for text, location, device, keywords in serps:
+            if filled and filled + keywords > lease_size:
+                bounds.append(json.dumps([text, location, device]))
+                filled = 0
+            filled += keywords
+        if not filled:
+            return 0
+        bounds.append(None)
+
+        ranges = [
+            {"harvest_date": harvest_date, "seq": seq, "start_serp": start, "end_serp": end, "status": "pending", "attempts": 0}
+            for seq, (start, end) in enumerate(zip(bounds, bounds[1:]))
+        ]
+        # Two workers planning at once may both insert; the first plan's rows
+        # win on (harvest_date, seq), and any extra rows only overlap its last,
+        # open-ended range, so every keyword is still covered
+        dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+        await conn.execute(dialect.insert(HarvestLease).on_conflict_do_nothing(), ranges)
+    return len(ranges)
+
+
+async def claim_lease(
+    owner: str,
+    harvest_date: datetime.date,
+    lease_seconds: int | None = None,
+) -> HarvestLease | None:
+    """Claims the next pending or expired range. Returns None when the date is fully claimed."""
+    lease_seconds = lease_seconds or settings.HARVEST_LEASE_SECONDS
+    for _ in range(CLAIM_ATTEMPTS):
+        now = _now()
+        async with engine.begin() as conn:
+            candidate = (
+                await conn.execute(
+                    select(HarvestLease)
+                    .where(_claimable(harvest_date, now))
+                    .order_by(HarvestLease.seq)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                )
+            ).first()
+            if candidate is None:
+                return None
+
+            expires = now + datetime.timedelta(seconds=lease_seconds)
+            result = await conn.execute(
+                update(HarvestLease)
+                .where(HarvestLease.id == candidate.id, _claimable(harvest_date, now))
+                .values(status="leased", owner=owner, lease_expires_at=expires, attempts=HarvestLease.attempts + 1)
+            )
+            if result.rowcount == 1:
+                return HarvestLease(
+                    id=candidate.id,
+                    harvest_date=candidate.harvest_date,
+                    seq=candidate.seq,
+                    start_serp=candidate.start_serp,
+                    end_serp=candidate.end_serp,
+                    status="leased",
+                    owner=owner,
+                    lease_expires_at=expires,
+                    attempts=candidate.attempts + 1,
+                )
+        # Another worker won the race for this row; try the next one
+    return None
+
+
+async def heartbeat_lease(lease_id: int, owner: str, lease_seconds: int | None = None) -> bool:
+    """Extends a held lease. Returns False if the lease expired and was taken over."""
+    lease_seconds = lease_seconds or settings.HARVEST_LEASE_SECONDS
+    async with engine.begin() as conn:
+        result = await conn.execute(
+            update(HarvestLease)
+            .where(HarvestLease.id == lease_id, HarvestLease.owner == owner, HarvestLease.status == "leased")
+            .values(lease_expires_at=_now() + datetime.timedelta(seconds=lease_seconds))
+        )
+    return result.rowcount == 1
+
+
+async def complete_lease(lease_id: int, owner: str) -> str | None:
+    """
+    Finishes a held range. If active keywords in it still lack a checkpoint
+    (failed SERP fetches, rolled-back writes) the range is released back to
+    'pending' for another pass, until it has been attempted
+    HARVEST_LEASE_MAX_ATTEMPTS times. Returns the new status ('done' or
+    'pending'), or None if the lease had already been taken over.
+    """
+    async with engine.begin() as conn:
+        lease = (
+            await conn.execute(
+                select(HarvestLease).where(
+                    HarvestLease.id == lease_id, HarvestLease.owner == owner, HarvestLease.status == "leased"
+                )
+            )
+        ).first()
+        if lease is None:
+            return None
+
+        unfinished = (
+            await conn.execute(
+                lease_shard(lease).apply(
+                    select(func.count()).select_from(Keyword).where(
+                        Keyword.active.is_(True),
+                        ~exists().where(
+                            HarvestCheckpoint.harvest_date == lease.harvest_date,
+                            HarvestCheckpoint.keyword_id == Keyword.id,
+                        ),
+                    )
+                )
+            )
+        ).scalar()
+        if unfinished and lease.attempts < settings.HARVEST_LEASE_MAX_ATTEMPTS:
+            values = {"status": "pending", "owner": None, "lease_expires_at": None}
+        else:
+            values = {"status": "done", "completed_at": _now()}
+            if unfinished:
+                print(
+                    f"WARNING: Lease {lease_id} done after {lease.attempts} attempts with "
+                    f"{unfinished} keywords still unfinished for {lease.harvest_date}."
+                )
+
+        result = await conn.execute(
+            update(HarvestLease)
+            .where(HarvestLease.id == lease_id, HarvestLease.owner == owner, HarvestLease.status == "leased")
+            .values(**values)
+        )
+    return values["status"] if result.rowcount == 1 else None
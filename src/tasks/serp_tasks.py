@@ -1,26 +1,161 @@
+import asyncio
+import time
+from collections import defaultdict
 from prefect import task
-from src.utils.dataforseo_client import dataforseo_client
+from src.utils.dataforseo_client import DataForSEOError, dataforseo_client
+from src.utils.serp_archive import serp_archive
 from src.config.settings import settings
-from typing import Tuple
+from typing import Any, Dict, Iterable, List, Tuple
 
-@task
-async def fetch_rank_live(keyword: str, domain: str, location: str, device: str) -> Tuple[int, str]:
-    payload = [
-        {
-            "keyword": keyword,
-            "location_name": location,
-            "device": device,
-            "language_code": "en",
-        }
-    ]
-    
-    response = await dataforseo_client.post_request("serp/google/organic/live/regular", payload)
-    
+NOT_FOUND = (101, "")
+SERP_BATCH_SIZE = 100  # DataForSEO accepts at most 100 tasks per task_post
+TASK_CREATED = 20100
+TASK_OK = 20000
+
+# A SERP is identified by what was searched, not by who is tracking it:
+# every Keyword row sharing (text, location, device) reads the same result page.
+SerpKey = Tuple[str, str, str]
+DomainRanks = Dict[str, Tuple[int, str]]
+
+
+def serp_key(keyword: Any) -> SerpKey:
+    return (keyword.text, keyword.location, keyword.device)
+
+
+def group_by_serp(keywords: Iterable[Any]) -> Dict[SerpKey, List[Any]]:
+    """Groups Keyword rows by SERP identity, preserving first-seen order."""
+    groups: Dict[SerpKey, List[Any]] = defaultdict(list)
+    for keyword in keywords:
+        groups[serp_key(keyword)].append(keyword)
+    return groups
+
+
+def _serp_task(key: SerpKey) -> Dict[str, Any]:
+    keyword, location, device = key
+    return {
+        "keyword": keyword,
+        "location_name": location,
+        "device": device,
+        "language_code": "en",
+    }
+
+
+def parse_domain_ranks(response: Dict[str, Any] | None) -> DomainRanks:
+    """
+    Builds {domain: (rank, url)} from a SERP task response in a single pass.
+    Only the best (first) organic result per domain is kept.
+    """
+    ranks: DomainRanks = {}
     if response and response.get("tasks") and response["tasks"][0].get("result"):
         result = response["tasks"][0]["result"][0]
         if result and result.get("items"):
             for item in result["items"]:
-                if item.get("type") == "organic" and item.get("domain") == domain:
-                    return item.get("rank_group", 0), item.get("url", "")
-    
-    return 101, ""  # Not found
+                domain = item.get("domain")
+                if item.get("type") == "organic" and domain and domain not in ranks:
+                    ranks[domain] = (item.get("rank_group", 0), item.get("url", ""))
+    return ranks
+
+
+def _check_task(endpoint: str, response: Dict[str, Any]) -> None:
+    """Raises if the SERP task itself failed, so a failure is never read as 'domain not found'."""
+    task_info = (response.get("tasks") or [{}])[0]
+    if task_info.get("status_code") != TASK_OK:
+        raise DataForSEOError(endpoint, task_info.get("status_code"), task_info.get("status_message", "no task result"))
+
+
+@task
+async def fetch_serp_live(keyword: str, location: str, device: str) -> DomainRanks:
+    """Checks one SERP on the live endpoint. Raises DataForSEOError if it cannot be read."""
+    payload = [_serp_task((keyword, location, device))]
+
+    endpoint = "serp/google/organic/live/regular"
+    response = await dataforseo_client.post_request(endpoint, payload)
+    _check_task(endpoint, response)
+    await serp_archive.add((keyword, location, device), response, source="live")
+    return parse_domain_ranks(response)
+
+
+@task
+async def fetch_rank_live(keyword: str, domain: str, location: str, device: str) -> Tuple[int, str]:
+    ranks = await fetch_serp_live(keyword=keyword, location=location, device=device)
+    return ranks.get(domain, NOT_FOUND)
+
+
+async def _post_batch(keys: List[SerpKey]) -> Dict[str, SerpKey]:
+    """Posts one task_post call and returns {task_id: serp_key} for the accepted tasks."""
+    payload = []
+    for index, key in enumerate(keys):
+        entry = _serp_task(key)
+        entry["tag"] = str(index)
+        payload.append(entry)
+
+    # Not retried: a repeated task_post would create (and bill) the tasks twice
+    response = await dataforseo_client.post_request("serp/google/organic/task_post", payload, idempotent=False)
+    posted = {}
+    for task_info in response.get("tasks") or []:
+        tag = (task_info.get("data") or {}).get("tag")
+        if task_info.get("status_code") == TASK_CREATED and tag is not None and tag.isdigit():
+            posted[task_info["id"]] = keys[int(tag)]
+        else:
+            print(f"⚠️ task_post rejected tag={tag}: {task_info.get('status_message')}")
+    return posted
+
+
+async def _ready_task_ids() -> set:
+    try:
+        response = await dataforseo_client.get_request("serp/google/organic/tasks_ready")
+    except DataForSEOError:
+        return set()  # Try again on the next poll
+    ready = set()
+    for task_info in response.get("tasks") or []:
+        for entry in task_info.get("result") or []:
+            ready.add(entry.get("id"))
+    return ready
+
+
+@task
+async def fetch_serps_batch(keys: List[SerpKey]) -> Dict[SerpKey, DomainRanks]:
+    """
+    Resolves up to SERP_BATCH_SIZE SERPs through the standard queue
+    (task_post -> tasks_ready -> task_get). This is slower per SERP than the
+    live endpoint but considerably cheaper and not bound by live-call concurrency.
+
+    SERPs whose task could not be posted, failed, or did not become ready within
+    HARVEST_BATCH_TIMEOUT_SECONDS fall back to the live endpoint. SERPs that
+    still cannot be read are left out of the result rather than reported empty.
+    """
+    if len(keys) > SERP_BATCH_SIZE:
+        raise ValueError(f"fetch_serps_batch accepts at most {SERP_BATCH_SIZE} SERPs, got {len(keys)}")
+
+    pending = await _post_batch(keys)
+    serps: Dict[SerpKey, DomainRanks] = {}
+    deadline = time.monotonic() + settings.HARVEST_BATCH_TIMEOUT_SECONDS
+
+    while pending and time.monotonic() < deadline:
+        await asyncio.sleep(settings.HARVEST_BATCH_POLL_SECONDS)
+        ready = [task_id for task_id in await _ready_task_ids() if task_id in pending]
+        responses = await asyncio.gather(
+            *(dataforseo_client.get_request(f"serp/google/organic/task_get/regular/{task_id}") for task_id in ready),
+            return_exceptions=True,
+        )
+        for task_id, response in zip(ready, responses):
+            key = pending.pop(task_id)
+            if isinstance(response, dict) and response.get("tasks") and response["tasks"][0].get("status_code") == TASK_OK:
+                await serp_archive.add(key, response, source="batch")
+                serps[key] = parse_domain_ranks(response)
+
+    # Anything still unresolved goes through the live endpoint
+    missing = [key for key in keys if key not in serps]
+    if missing:
+        print(f"⚠️ {len(missing)} of {len(keys)} batch tasks unresolved; falling back to live SERP checks.")
+        live_serps = await asyncio.gather(
+            *(fetch_serp_live(keyword=text, location=location, device=device) for text, location, device in missing),
+            return_exceptions=True,
+        )
+        for key, ranks in zip(missing, live_serps):
+            if isinstance(ranks, BaseException):
+                print(f"ERROR: SERP check failed for '{key[0]}': {ranks}")
+            else:
+                serps[key] = ranks
+
+    return serps
@@ -0,0 +1,166 @@
+"""
+Rank volatility and trend analytics.
+
+The daily rollups for the trailing HISTORY_TREND_WINDOW_DAYS are loaded into a
+single keywords x days matrix (NaN where a keyword has no sample that day), and
+every statistic is computed over that matrix with numpy/pandas column
+operations rather than a Python loop per keyword:
+
+- current_rank: last known daily rank
+- delta_7d / delta_30d: current rank minus the rank 7 / 30 days earlier
+- volatility: standard deviation of the daily rank
+- slope: least-squares rank change per day
+- page_1_event: the most recent entry into / exit from the top 10
+
+Results are upserted into keyword_trends, one row per keyword, for the
+dashboard and the engines to read.
+"""
+import datetime
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.config.settings import settings
+from src.models.core import Keyword, KeywordTrend, RankingRollup
+from src.utils.database import engine
+
+NOT_RANKED = 101.0  # Same as the harvest's NOT_FOUND rank
+PAGE_1_MAX_RANK = 10
+WRITE_BATCH_SIZE = 1000
+TREND_COLUMNS = (
+    "keyword_id", "as_of", "samples", "current_rank", "delta_7d", "delta_30d",
+    "volatility", "slope", "on_page_1", "page_1_event", "page_1_event_date",
+)
+
+
+def _user_keywords(user_id: int):
+    return select(Keyword.id).where(Keyword.user_id == user_id)
+
+
+async def load_rank_matrix(
+    as_of: datetime.date,
+    window_days: int | None = None,
+    user_id: int | None = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (keyword_ids, ranks) where ranks[i, d] is keyword_ids[i]'s average
+    rank on day `as_of - window_days + d`, or NaN if it was not checked that day.
+    """
+    window_days = window_days or settings.HISTORY_TREND_WINDOW_DAYS
+    start = as_of - datetime.timedelta(days=window_days)
+    stmt = select(RankingRollup.keyword_id, RankingRollup.period_start, RankingRollup.avg_rank).where(
+        RankingRollup.period == "day",
+        RankingRollup.period_start >= start,
+        RankingRollup.period_start <= as_of,
+    )
+    if user_id is not None:
+        stmt = stmt.where(RankingRollup.keyword_id.in_(_user_keywords(user_id)))
+
+    async with engine.connect() as conn:
+        rows = (await conn.execute(stmt)).all()
+
+    frame = pd.DataFrame(rows, columns=["keyword_id", "day", "rank"])
+    if frame.empty:
+        return np.empty(0, dtype=np.int64), np.empty((0, window_days + 1))
+
+    codes, keyword_ids = pd.factorize(frame["keyword_id"], sort=True)
+    offsets = (pd.to_datetime(frame["day"]) - pd.Timestamp(start)).dt.days.to_numpy()
+    ranks = np.full((len(keyword_ids), window_days + 1), np.nan)
+    # Unranked checks (0 or 101) count as "not in the top 100"
+    values = frame["rank"].to_numpy(dtype=float)
+    ranks[codes, offsets] = np.where((values < 1) | (values > NOT_RANKED), NOT_RANKED, values)
+    return np.asarray(keyword_ids, dtype=np.int64), ranks
+
+
+def compute_trends(keyword_ids: np.ndarray, ranks: np.ndarray, as_of: datetime.date) -> pd.DataFrame:
+    """Vectorized trend statistics for every row of a rank matrix (see load_rank_matrix)."""
+    days = ranks.shape[1]
+    start = as_of - datetime.timedelta(days=days - 1)
+    observed = ~np.isnan(ranks)
+    samples = observed.sum(axis=1)
+
+    # Carry the last known rank forward so deltas work across missed days
+    filled = pd.DataFrame(ranks).ffill(axis=1).to_numpy()
+    current = filled[:, -1]
+    delta_7d = current - filled[:, max(0, days - 8)]
+    delta_30d = current - filled[:, max(0, days - 31)]
+
+    x = np.arange(days, dtype=float)
+    y = np.where(observed, ranks, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        y_mean = y.sum(axis=1) / samples
+        volatility = np.sqrt((np.where(observed, ranks - y_mean[:, None], 0.0) ** 2).sum(axis=1) / samples)
+        x_mean = (observed * x).sum(axis=1) / samples
+        dx = np.where(observed, x - x_mean[:, None], 0.0)
+        dx_squared = (dx ** 2).sum(axis=1)
+        slope = np.where(dx_squared > 0, (dx * (y - y_mean[:, None])).sum(axis=1) / dx_squared, np.nan)
+
+    on_page_1 = filled <= PAGE_1_MAX_RANK  # NaN compares False
+    known = ~np.isnan(filled)
+    changed = (on_page_1[:, 1:] != on_page_1[:, :-1]) & known[:, :-1]
+    has_event = changed.any(axis=1)
+    # Column of the most recent change (the first day in the new state)
+    event_day = days - 1 - np.argmax(changed[:, ::-1], axis=1)
+    entered = on_page_1[np.arange(len(keyword_ids)), event_day]
+
+    trends = pd.DataFrame({
+        "keyword_id": keyword_ids,
+        "as_of": as_of,
+        "samples": samples,
+        "current_rank": current,
+        "delta_7d": delta_7d,
+        "delta_30d": delta_30d,
+        "volatility": volatility,
+        "slope": slope,
+        "on_page_1": on_page_1[:, -1],
+        "page_1_event": np.where(has_event, np.where(entered, "entered", "left"), None),
+        "page_1_event_date": np.where(
+            has_event, np.array([start + datetime.timedelta(days=int(d)) for d in range(days)])[event_day], None
+        ),
+    })
+    return trends[samples > 0]
+
+
+def _records(trends: pd.DataFrame) -> List[Dict[str, Any]]:
+    records = trends.astype(object).where(trends.notna(), None).to_dict("records")
+    for record in records:
+        record["keyword_id"] = int(record["keyword_id"])
+        record["samples"] = int(record["samples"])
+        record["on_page_1"] = bool(record["on_page_1"])
+    return records
+
+
+async def store_trends(trends: pd.DataFrame, as_of: datetime.date, user_id: int | None = None) -> int:
+    """
+    Upserts keyword_trends and removes rows for keywords that dropped out of
+    the window (within the same scope), including when none are left in it.
+    Returns the number of rows written.
+    """
+    records = _records(trends)
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    async with engine.begin() as conn:
+        for offset in range(0, len(records), WRITE_BATCH_SIZE):
+            stmt = dialect.insert(KeywordTrend).values(records[offset:offset + WRITE_BATCH_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["keyword_id"],
+                set_={**{column: stmt.excluded[column] for column in TREND_COLUMNS[1:]}, "computed_at": func.now()},
+            )
+            await conn.execute(stmt)
+
+        stale = delete(KeywordTrend).where(KeywordTrend.as_of < as_of)
+        if user_id is not None:
+            stale = stale.where(KeywordTrend.keyword_id.in_(_user_keywords(user_id)))
+        await conn.execute(stale)
+    return len(records)
+
+
+async def refresh_keyword_trends(user_id: int | None = None, as_of: datetime.date | None = None) -> int:
+    """Recomputes keyword_trends from the daily rollups, for one user or every keyword."""
+    as_of = as_of or datetime.date.today()
+    keyword_ids, ranks = await load_rank_matrix(as_of, user_id=user_id)
+    trends = compute_trends(keyword_ids, ranks, as_of)
+    return await store_trends(trends, as_of, user_id)
+
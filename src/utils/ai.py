@@ -1,27 +1,20 @@
-import google.generativeai as genai
-from src.config.settings import settings
-from google.api_core.exceptions import GoogleAPIError
+from src.utils.gemini_client import get_gemini_agent
 
 class GeminiClient:
+    """
+    Legacy entry point, kept for scripts/ops. Calls go through the shared
+    GeminiAgent, so they share its quota, quota-error retries, budget check
+    and metering; the SDK is only imported when the client is built.
+    """
     def __init__(self):
         try:
-            genai.configure(api_key=settings.GOOGLE_API_KEY.get_secret_value())
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
+            self.agent = get_gemini_agent('gemini-1.5-flash')
         except Exception as e:
-            # Depending on desired error handling, might re-raise or set self.model to None
+            # Depending on desired error handling, might re-raise or set self.agent to None
             print(f"GeminiClient initialization error: {e}")
-            self.model = None
+            self.agent = None
 
     async def generate_content(self, prompt: str) -> str:
-        if not self.model:
+        if not self.agent:
             return "GeminiClient not initialized due to previous error."
-        try:
-            response = await self.model.generate_content_async(prompt)
-            if response.text:
-                return response.text
-            else:
-                return "Gemini returned an empty response."
-        except GoogleAPIError as e:
-            return f"Gemini API Error: {e}"
-        except Exception as e:
-            return f"An unexpected error occurred with Gemini: {e}"
+        return await self.agent.generate_content(prompt)
@@ -1,4 +1,6 @@
+from sqlalchemy import Table, inspect
 from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession # SQLModel's AsyncSession
@@ -17,10 +19,34 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+# Name used by the harvest tasks and scripts
+async_session = AsyncSessionLocal
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
 
+async def add_missing_columns(table: Table) -> list[str]:
+    """
+    Brings an existing table up to its model: create_all never alters a table
+    that already exists, so columns added to a model later are ALTER TABLE'd in
+    here, then any missing indexes are created. New columns need a server
+    default (or to be nullable) so existing rows get a value. Safe to re-run;
+    returns the names of the columns it added.
+    """
+    async with engine.begin() as conn:
+        existing = await conn.run_sync(lambda sync_conn: {c["name"] for c in inspect(sync_conn).get_columns(table.name)})
+        added = []
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            await conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+            added.append(column.name)
+        for index in table.indexes:
+            await conn.run_sync(lambda sync_conn: index.create(sync_conn, checkfirst=True))
+    return added
+
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
\ No newline at end of file
@@ -1,95 +1,410 @@
+import asyncio
 import aiohttp
-import json
-from typing import List, Dict, Any
+import datetime
+import orjson
+import time
+from email.utils import parsedate_to_datetime
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from typing import AsyncIterator, List, Dict, Any
 
 from src.config.settings import settings
+from src.utils.metering import BudgetExceededError, meter
+from src.utils.rate_limiter import AdaptiveLimiter
+from src.utils.response_cache import ResponseCache
 
-async def get_ranked_keywords(
+RANKED_KEYWORDS_ENDPOINT = "dataforseo_labs/google/ranked_keywords/live"
+RANKED_KEYWORDS_PAGE_SIZE = 1000  # Largest page the endpoint returns
+RANKED_PAGE_CACHE_NAMESPACE = RANKED_KEYWORDS_ENDPOINT + "#rows-v2"  # Cached values are projected pages, not raw responses
+
+
+# Body-level status DataForSEO returns when the per-minute request limit is exceeded
+STATUS_RATE_LIMITED = 40202
+
+
+def _metered_endpoint(endpoint: str) -> str:
+    """Endpoint name for usage metering: task ids are dropped so task_get calls aggregate."""
+    parts = endpoint.strip("/").split("/")
+    if "task_get" in parts:
+        parts = parts[:parts.index("task_get") + 2]
+    return "/".join(parts)
+
+
+class DataForSEOError(Exception):
+    """A DataForSEO call that failed for good. Callers must not read it as "no results"."""
+
+    def __init__(self, endpoint: str, status: int | None, message: str):
+        super().__init__(f"{status or 'network'} - {message}" if message else str(status or "network"))
+        self.endpoint = endpoint
+        self.status = status
+
+
+class DataForSEORetryableError(DataForSEOError):
+    """Throttling, provider-side or transport failure that is worth retrying."""
+
+    def __init__(self, endpoint: str, status: int | None, message: str, retry_after: float | None = None):
+        super().__init__(endpoint, status, message)
+        self.retry_after = retry_after
+
+
+def _retry_after(value: str | None) -> float | None:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+def _retry_wait(retry_state) -> float:
+    """Full-jitter exponential backoff, but never shorter than the provider's Retry-After."""
+    backoff = wait_random_exponential(multiplier=0.5, max=settings.DATAFORSEO_RETRY_MAX_WAIT_SECONDS)(retry_state)
+    error = retry_state.outcome.exception()
+    retry_after = getattr(error, "retry_after", None) or 0.0
+    return max(backoff, min(retry_after, settings.DATAFORSEO_RETRY_MAX_WAIT_SECONDS))
+
+
+# Shared by every DataForSEO call in the process
+dataforseo_limiter = AdaptiveLimiter(
+    "dataforseo",
+    rate=settings.DATAFORSEO_RATE_PER_SECOND,
+    max_concurrency=settings.DATAFORSEO_MAX_IN_FLIGHT,
+)
+
+
+class DataForSEOClient:
+    """
+    Minimal async client for the DataForSEO v3 REST API.
+    Endpoints are given relative to /v3/, e.g. "serp/google/organic/task_post".
+
+    Every call goes through the process-wide dataforseo_limiter. Throttling
+    (429, 5xx, rate-limit status codes, timeouts) shrinks the limiter's window
+    and idempotent calls are retried with jittered exponential backoff,
+    honouring Retry-After. A call that still fails raises DataForSEOError:
+    a failed request is never returned as an empty result.
+
+    The client owns one pooled keep-alive aiohttp session (bounded connections,
+    cached DNS, connect/read timeouts), so repeated calls reuse open TLS
+    connections instead of paying a handshake each time. The session is opened
+    lazily on first use or explicitly with start().
+
+    The session is shared by everything in the process, so its owners are the
+    entry points: the API lifespan and each flow that calls DataForSEO enter
+    `async with client:`. Entries are counted and only the last owner to exit
+    closes the session, so a harvest finishing never pulls it out from under
+    the API or another flow. close() shuts it unconditionally.
+    """
+
+    def __init__(
+        self,
+        login: str | None = None,
+        password: str | None = None,
+        base_url: str | None = None,
+        limiter: AdaptiveLimiter | None = None,
+    ):
+        self.base_url = base_url or settings.DATAFORSEO_BASE_URL
+        self.limiter = limiter or dataforseo_limiter
+        self.auth = aiohttp.BasicAuth(
+            login=login or settings.DATAFORSEO_LOGIN,
+            password=password or settings.DATAFORSEO_PASSWORD
+        )
+        self._session: aiohttp.ClientSession | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._owners = 0
+
+    async def start(self) -> aiohttp.ClientSession:
+        """Opens the pooled session (no-op if it is already open on this event loop)."""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._loop is loop:
+            return self._session
+        if self._session is not None and not self._session.closed and self._loop is not None and not self._loop.is_closed():
+            # Opened by an earlier event loop (e.g. a previous asyncio.run); it cannot be used from this one
+            print("WARNING: DataForSEO session was opened on another event loop; opening a new one.")
+        connector = aiohttp.TCPConnector(
+            limit=settings.DATAFORSEO_MAX_CONNECTIONS,
+            ttl_dns_cache=settings.DATAFORSEO_DNS_TTL_SECONDS,
+            keepalive_timeout=settings.DATAFORSEO_KEEPALIVE_SECONDS,
+        )
+        timeout = aiohttp.ClientTimeout(
+            connect=settings.DATAFORSEO_CONNECT_TIMEOUT_SECONDS,
+            sock_read=settings.DATAFORSEO_READ_TIMEOUT_SECONDS,
+        )
+        self._session = aiohttp.ClientSession(auth=self.auth, connector=connector, timeout=timeout)
+        self._loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed and self._loop is asyncio.get_running_loop():
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def __aenter__(self) -> "DataForSEOClient":
+        self._owners += 1
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._owners -= 1
+        if self._owners == 0:
+            await self.close()
+
+    async def _send(self, method: str, endpoint: str, payload: list | None) -> Dict[str, Any]:
+        url = self.base_url + endpoint.lstrip("/")
+        await self.limiter.acquire()
+        throttled, retry_after = False, None
+        started, data = time.monotonic(), None
+        try:
+            session = await self.start()
+            async with session.request(method, url, json=payload) as response:
+                if response.status == 429 or response.status >= 500:
+                    throttled, retry_after = True, _retry_after(response.headers.get("Retry-After"))
+                    raise DataForSEORetryableError(endpoint, response.status, response.reason or "", retry_after)
+                if response.status >= 400:
+                    raise DataForSEOError(endpoint, response.status, response.reason or "")
+                data = await response.json(loads=orjson.loads, content_type=None)
+            status = (data or {}).get("status_code")
+            if status == STATUS_RATE_LIMITED or (status and status >= 50000):
+                throttled = True
+                raise DataForSEORetryableError(endpoint, status, data.get("status_message", ""))
+            return data
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            throttled = True
+            raise DataForSEORetryableError(endpoint, None, str(e) or type(e).__name__) from e
+        finally:
+            await self.limiter.release(throttled, retry_after)
+            tasks = (data or {}).get("tasks") or []
+            meter.record(
+                "dataforseo",
+                _metered_endpoint(endpoint),
+                cost=(data or {}).get("cost") or 0.0,
+                latency=time.monotonic() - started,
+                rows=sum(task.get("result_count") or 0 for task in tasks),
+                ok=bool(data) and not throttled and (data.get("status_code") or 0) < 40000,
+            )
+
+    async def _request(
+        self, method: str, endpoint: str, payload: list | None = None, idempotent: bool = True
+    ) -> Dict[str, Any]:
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(settings.DATAFORSEO_RETRY_ATTEMPTS if idempotent else 1),
+            wait=_retry_wait,
+            retry=retry_if_exception_type(DataForSEORetryableError),
+            reraise=True,
+        )
+        try:
+            await meter.check_budget()
+            async for attempt in retrying:
+                with attempt:
+                    return await self._send(method, endpoint, payload)
+        except BudgetExceededError as e:
+            print(f"🛑 DataForSEO call to {endpoint} skipped: {e}")
+            raise DataForSEOError(endpoint, None, str(e)) from e
+        except DataForSEOError as e:
+            print(f"❌ DataForSEO API Error on {endpoint}: {e}")
+            raise
+
+    async def post_request(self, endpoint: str, payload: list, idempotent: bool = True) -> Dict[str, Any]:
+        """
+        POSTs to an endpoint. Live endpoints are reads and are retried; pass
+        idempotent=False for calls with side effects such as task_post.
+        """
+        return await self._request("POST", endpoint, payload, idempotent)
+
+    async def get_request(self, endpoint: str) -> Dict[str, Any]:
+        return await self._request("GET", endpoint)
+
+
+# Shared instance used by the Prefect tasks and the API app
+dataforseo_client = DataForSEOClient()
+
+
+# Ranked keywords for a competitor barely move within a day; every engine and
+# script shares these pages instead of paying for the same rows again.
+ranked_keywords_cache = ResponseCache()
+
+
+# The 'competition_level' is a string, not a number; this is a simple mapping
+# onto a 0-100 difficulty scale that may need to be more sophisticated.
+# A missing or unknown level stays None (unknown), never "easy".
+COMPETITION_DIFFICULTY = {"HIGH": 80, "MEDIUM": 50, "LOW": 20}
+
+
+class RankedKeyword:
+    """
+    One ranked keyword for a competitor domain, holding only the fields the
+    engines use. Slotted, so a page of 1,000 records costs a fraction of the
+    equivalent dicts.
+    """
+    __slots__ = ("keyword", "search_volume", "cpc", "rank", "difficulty")
+
+    def __init__(self, keyword: str | None, search_volume: int | None, cpc: float | None, rank: int | None, difficulty: int | None):
+        self.keyword = keyword
+        self.search_volume = search_volume
+        self.cpc = cpc
+        self.rank = rank
+        self.difficulty = difficulty
+
+    @classmethod
+    def from_item(cls, item: Dict[str, Any]) -> "RankedKeyword":
+        keyword_data = item.get("keyword_data") or {}
+        keyword_info = keyword_data.get("keyword_info") or {}
+        serp_item = (item.get("ranked_serp_element") or {}).get("serp_item") or {}
+        return cls(
+            keyword_data.get("keyword"),
+            keyword_info.get("search_volume"),
+            keyword_info.get("cpc"),
+            serp_item.get("rank_group"),
+            COMPETITION_DIFFICULTY.get(keyword_info.get("competition_level")),
+        )
+
+    def to_row(self) -> tuple:
+        return (self.keyword, self.search_volume, self.cpc, self.rank, self.difficulty)
+
+    @classmethod
+    def from_row(cls, row) -> "RankedKeyword":
+        return cls(*row)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, RankedKeyword) and self.to_row() == other.to_row()
+
+    def __repr__(self) -> str:
+        return (
+            f"RankedKeyword(keyword={self.keyword!r}, search_volume={self.search_volume}, "
+            f"cpc={self.cpc}, rank={self.rank}, difficulty={self.difficulty})"
+        )
+
+
+def _ranked_items(data: Dict[str, Any] | None) -> List[Dict[str, Any]] | None:
+    """Items of a ranked_keywords page, or None (logged) if the response carries none."""
+    # Check for logical errors within the API response structure
+    if data and data.get("tasks") and data["tasks"][0].get("status_code") and data["tasks"][0]["status_code"] >= 40000:
+        print(f"❌ API Logical Error: {data['tasks'][0]['status_message']}")
+        return None
+
+    # Safe parsing of the response
+    if not (data and data.get("tasks") and data["tasks"][0].get("result")):
+        print("⚠️ API returned success, but no result array was found.")
+        return None
+
+    result = data["tasks"][0]["result"]
+    if not result or not result[0].get("items"):
+        print("⚠️ API returned success, but no items were found in the result.")
+        return None
+    return result[0]["items"]
+
+
+def parse_ranked_page(data: Dict[str, Any]) -> Dict[str, Any] | None:
+    """
+    Projects a ranked_keywords response (decoded with orjson by the client) down
+    to {"total_count": int | None, "rows": [RankedKeyword rows]}. The full
+    payload is dropped as soon as the rows are extracted.
+    """
+    if settings.DATAFORSEO_DEBUG_PAYLOADS:
+        print(f"🐛 RAW API RESPONSE: {data}")
+    items = _ranked_items(data)
+    if items is None:
+        return None
+    return {
+        "total_count": data["tasks"][0]["result"][0].get("total_count"),
+        "rows": [RankedKeyword.from_item(item).to_row() for item in items],
+    }
+
+
+async def _post_ranked_keywords(payload: list) -> Dict[str, Any] | None:
+    return parse_ranked_page(await dataforseo_client.post_request(RANKED_KEYWORDS_ENDPOINT, payload))
+
+
+async def _fetch_ranked_page(payload: list) -> Dict[str, Any] | None:
+    """
+    A projected page (see parse_ranked_page), from the cache when possible.
+    None if the API answered without items; raises DataForSEOError if the call failed.
+    """
+    # Only successfully parsed pages are cached, never errors. Keyed by API host
+    # too, so pages from a local mock server never answer real requests.
+    return await ranked_keywords_cache.get_or_fetch(
+        RANKED_PAGE_CACHE_NAMESPACE, [dataforseo_client.base_url, payload], lambda: _post_ranked_keywords(payload)
+    )
+
+
+async def iter_ranked_keywords(
     target_domain: str,
     location_code: int = 2840,
     language_code: str = "en",
-    filters: list = None
-) -> List[Dict[str, Any]]:
+    filters: list = None,
+    page_size: int = RANKED_KEYWORDS_PAGE_SIZE,
+    max_rows: int | None = None,
+) -> AsyncIterator[RankedKeyword]:
     """
-    Fetches ranked keywords from DataForSEO Labs API.
-    Endpoint: /v3/dataforseo_labs/google/ranked_keywords/live
+    Streams ranked keywords for a domain page by page (limit/offset), yielding
+    RankedKeyword records as each page arrives. The next page is requested while the
+    caller works through the current one, so at most two pages are held in
+    memory. Stops after max_rows records (DATAFORSEO_RANKED_KEYWORDS_MAX_ROWS
+    by default) or at the end of the result set. A page that fails after
+    retries raises DataForSEOError rather than silently truncating the stream.
     """
-    api_url = "https://api.dataforseo.com/v3/dataforseo_labs/google/ranked_keywords/live"
-    
-    auth = aiohttp.BasicAuth(
-        login=settings.DATAFORSEO_LOGIN,
-        password=settings.DATAFORSEO_PASSWORD
-    )
+    max_rows = max_rows or settings.DATAFORSEO_RANKED_KEYWORDS_MAX_ROWS
+    page_size = min(page_size, RANKED_KEYWORDS_PAGE_SIZE)
 
-    payload_entry = {
-        "target": target_domain,
-        "location_code": location_code,
-        "language_code": language_code,
-        "limit": 1000,
-        "ignore_synonyms": True
-    }
-    if filters:
-        payload_entry["filters"] = filters
-    payload = [payload_entry]
+    def _page(offset: int) -> asyncio.Task | None:
+        limit = min(page_size, max_rows - offset)
+        if limit <= 0:
+            return None
+        payload_entry = {
+            "target": target_domain,
+            "location_code": location_code,
+            "language_code": language_code,
+            "limit": limit,
+            "offset": offset,
+            "ignore_synonyms": True
+        }
+        if filters:
+            payload_entry["filters"] = filters
+        return asyncio.create_task(_fetch_ranked_page([payload_entry]))
 
     print(f"📡 Requesting ranked keywords for '{target_domain}' from DataForSEO Labs... {'with filters' if filters else ''}")
-
+    offset = 0
+    pending = _page(offset)
     try:
-        async with aiohttp.ClientSession(auth=auth) as session:
-            async with session.post(api_url, json=payload) as response:
-                response.raise_for_status() # Raises ClientResponseError for 4xx/5xx
-                
-                data = await response.json()
-                print(f"🐛 RAW API RESPONSE: {data}")
-                
-                # Check for logical errors within the API response structure
-                if data and data.get("tasks") and data["tasks"][0].get("status_code") and data["tasks"][0]["status_code"] >= 40000:
-                    print(f"❌ API Logical Error: {data['tasks'][0]['status_message']}")
-                    return []
-                
-                # Safe parsing of the response
-                if not (data and data.get("tasks") and data["tasks"][0].get("result")):
-                    print("⚠️ API returned success, but no result array was found.")
-                    return []
-                
-                result = data["tasks"][0]["result"]
-                if not result or not result[0].get("items"):
-                    print("⚠️ API returned success, but no items were found in the result.")
-                    return []
-
-                items = result[0]["items"]
-                parsed_keywords = []
-                for item in items:
-                    keyword_data = item.get("keyword_data", {})
-                    keyword_info = keyword_data.get("keyword_info", {})
-                    ranked_serp_element = item.get("ranked_serp_element", {})
-                    serp_item = ranked_serp_element.get("serp_item", {})
-
-                    # The 'competition_level' seems to be a string, not a number.
-                    # Mapping to a 0-100 scale will require more info on the possible values.
-                    # For now, we'll just store it as is, or default to a numeric value.
-                    competition = keyword_info.get('competition_level')
-                    diff_value = 0
-                    if isinstance(competition, str):
-                        # Simple mapping for now, this may need to be more sophisticated
-                        if competition == "HIGH": diff_value = 80
-                        elif competition == "MEDIUM": diff_value = 50
-                        elif competition == "LOW": diff_value = 20
-                    
-                    parsed_keywords.append({
-                        'kw': keyword_data.get('keyword'),
-                        'vol': keyword_info.get('search_volume'),
-                        'cpc': keyword_info.get('cpc'),
-                        'rank': serp_item.get('rank_group'),
-                        'diff': diff_value
-                    })
-                
-                print(f"✅ Successfully parsed {len(parsed_keywords)} keywords.")
-                return parsed_keywords
-
-    except aiohttp.ClientResponseError as e:
-        print(f"❌ API Error: {e.status} - {e.message}")
-        return []
-    except Exception as e:
-        print(f"❌ Unexpected Error: {str(e)}")
-        return []
+        while pending is not None:
+            page = await pending
+            if not page or not page["rows"]:
+                return
+            rows, total = page["rows"], page["total_count"]
+            requested = min(page_size, max_rows - offset)
+            offset += len(rows)
+            more = len(rows) >= requested and (total is None or offset < total)
+            pending = _page(offset) if more else None
+            for row in rows:
+                yield RankedKeyword.from_row(row)
+    finally:
+        if pending is not None:
+            if not pending.done():
+                pending.cancel()
+            elif not pending.cancelled():
+                pending.exception()  # A prefetched page nobody will read; don't warn about its error
+
+
+async def get_ranked_keywords(
+    target_domain: str,
+    location_code: int = 2840,
+    language_code: str = "en",
+    filters: list = None
+) -> List[RankedKeyword]:
+    """
+    Fetches ranked keywords from DataForSEO Labs API.
+    Endpoint: /v3/dataforseo_labs/google/ranked_keywords/live
+    Successful responses are cached for DATAFORSEO_CACHE_TTL_SECONDS.
+    Returns at most one page (1000 rows); use iter_ranked_keywords for more.
+    Raises DataForSEOError if the call fails after retries.
+    """
+    parsed_keywords = [
+        keyword async for keyword in iter_ranked_keywords(
+            target_domain, location_code, language_code, filters, max_rows=RANKED_KEYWORDS_PAGE_SIZE
+        )
+    ]
+    print(f"✅ Successfully parsed {len(parsed_keywords)} keywords.")
+    return parsed_keywords
@@ -9,7 +9,7 @@ import asyncio
 import os
 from dotenv import load_dotenv
 
-from src.utils.dataforseo_client import get_domain_overview
+from src.utils.dataforseo_client import dataforseo_client, get_domain_overview
 
 async def diagnose():
     """
@@ -33,7 +33,8 @@ async def diagnose():
     print(f"🔍 Testing DataForSEO Connection for: {clean_domain}...")
     print(f" (Original TARGET_DOMAIN: {target_domain})")
 
-    data = await get_domain_overview(clean_domain)
+    async with dataforseo_client:
+        data = await get_domain_overview(clean_domain)
 
     print("\n--- Raw API Output ---")
     print(data)
@@ -1,10 +1,101 @@
-import google.generativeai as genai
+"""
+Gemini access for the engines, the harvest and the API.
+
+Agents are built on first use through get_gemini_agent() and cached per model
+name. google.generativeai (about a second of import time) is only imported
+then, so importing an engine module, or running the API app without AI
+credentials, never configures the SDK.
+"""
+import json
+import time
+from typing import AsyncIterator, Callable, Dict, Type, TypeVar
+from pydantic import BaseModel, ValidationError
 from src.config.settings import settings
-from google.api_core.exceptions import GoogleAPIError
+from src.utils.metering import BudgetExceededError, current_scope, meter
+from src.utils.rate_limiter import QuotaScheduler
+from src.utils.response_cache import ResponseCache
+
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+SchemaT = TypeVar("SchemaT", bound=BaseModel)
+
+# Every failure placeholder returned by generate_content starts with this
+UNAVAILABLE_PREFIX = "Analysis unavailable"
+
+JSON_MODE = {"response_mime_type": "application/json"}
+
+# Identical prompts recur across engine runs (same keyword lists, same redirect
+# pairs); every agent shares these responses. Failures are never cached.
+prompt_cache = ResponseCache(
+    path=settings.GEMINI_CACHE_PATH,
+    ttl_seconds=settings.GEMINI_CACHE_TTL_SECONDS,
+    max_bytes=settings.GEMINI_CACHE_MAX_MB * 1024 * 1024,
+    enabled=settings.GEMINI_CACHE_ENABLED,
+    memory_entries=settings.GEMINI_CACHE_MEMORY_ENTRIES,
+)
+
+
+# One RPM/TPM budget for every agent in the process (engines, harvest, API).
+# Calls inside a metering scope (flows) queue as 'batch'; API requests as 'interactive'.
+gemini_quota = QuotaScheduler(
+    "gemini",
+    requests_per_minute=settings.GEMINI_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.GEMINI_TOKENS_PER_MINUTE,
+)
+
+
+def _estimate_tokens(prompt: str) -> int:
+    return len(prompt) // 4 + settings.GEMINI_OUTPUT_TOKENS_ESTIMATE
+
+
+def json_prompt(prompt: str, schema: Type[BaseModel]) -> str:
+    """A prompt asking for a JSON object that matches a pydantic schema (pair it with JSON_MODE)."""
+    schema_json = json.dumps(schema.model_json_schema(), separators=(",", ":"))
+    return f"{prompt}\n\nRespond only with a JSON object matching this JSON Schema:\n{schema_json}"
+
+
+def schema_check(schema: Type[BaseModel]) -> Callable[[str], bool]:
+    """A `cacheable` predicate that accepts only text validating against a pydantic schema."""
+    def _validates(text: str) -> bool:
+        try:
+            schema.model_validate_json(text)
+            return True
+        except ValidationError:
+            return False
+
+    return _validates
+
+
+def _stopped(response) -> bool:
+    """False if the model reports ending for any reason but STOP (e.g. MAX_TOKENS, SAFETY)."""
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return True  # Nothing to go on
+    reason = getattr(candidates[0], "finish_reason", None)
+    return reason is None or getattr(reason, "name", reason) in ("STOP", "FINISH_REASON_UNSPECIFIED", 1, 0)  # Enum or raw int
+
+
+def _cache_excluded(engine_name: str | None) -> bool:
+    excluded = {name.strip() for name in settings.GEMINI_CACHE_EXCLUDED_ENGINES.split(",") if name.strip()}
+    return engine_name in excluded
+
+
+def _usage_cost(response) -> float:
+    """USD cost of a response, from its token usage."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return 0.0
+    return (
+        (usage.prompt_token_count or 0) * settings.GEMINI_INPUT_COST_PER_1M_TOKENS
+        + (usage.candidates_token_count or 0) * settings.GEMINI_OUTPUT_COST_PER_1M_TOKENS
+    ) / 1_000_000
 
 class GeminiAgent:
-    def __init__(self, model_name: str = "gemini-2.5-flash"):
+    def __init__(self, model_name: str = DEFAULT_MODEL, use_cache: bool = True, priority: str | None = None):
         self.model_name = model_name
+        self.use_cache = use_cache
+        self.priority = priority  # 'interactive' or 'batch'; None picks by context
         self.model = None
 
         api_key = settings.GOOGLE_API_KEY.get_secret_value() if settings.GOOGLE_API_KEY else None
@@ -12,6 +103,8 @@ class GeminiAgent:
             raise ValueError("GOOGLE_API_KEY is not set in environment variables.")
         
         try:
+            import google.generativeai as genai
+
             genai.configure(api_key=api_key)
             self.model = genai.GenerativeModel(self.model_name)
         except Exception as e:
@@ -19,21 +112,245 @@ class GeminiAgent:
             self.model = None # Ensure model is None if configuration fails
 
     async def generate_content(self, prompt: str) -> str:
+        return await self._generate(prompt)
+
+    async def _generate(
+        self,
+        prompt: str,
+        generation_config: dict | None = None,
+        cacheable: Callable[[str], bool] | None = None,
+    ) -> str:
+        """
+        Model call behind prompt_cache, keyed by (model, prompt, generation config).
+        Skipped for agents built with use_cache=False and for engines listed in
+        GEMINI_CACHE_EXCLUDED_ENGINES. Failures, and responses rejected by
+        `cacheable`, are not stored.
+        """
+        if not self.use_cache or _cache_excluded(current_scope().engine):
+            return await self._call_model(prompt, generation_config)
+        return await prompt_cache.get_or_fetch(
+            self.model_name,
+            {"prompt": prompt, "generation_config": generation_config},
+            lambda: self._call_model(prompt, generation_config),
+            cacheable=lambda text: not text.startswith(UNAVAILABLE_PREFIX) and (cacheable is None or cacheable(text)),
+        )
+
+    async def _call_model(self, prompt: str, generation_config: dict | None = None) -> str:
         if not self.model:
             return "Analysis unavailable due to API error."
+        from google.api_core.exceptions import GoogleAPIError, ResourceExhausted  # Loaded with the SDK
+
         try:
-            response = await self.model.generate_content_async(prompt)
-            # Check for empty response or other issues
-            if not response or not response.text:
-                print("Gemini Error: Empty response or text from API.")
-                return "Analysis unavailable due to empty API response."
-            return response.text
-        except GoogleAPIError as e:
-            print(f"Gemini Error: Google API error during content generation: {str(e)}")
-            return "Analysis unavailable due to API error."
-        except Exception as e:
-            print(f"Gemini Error: An unexpected error occurred during content generation: {str(e)}")
-            return "Analysis unavailable due to API error."
+            await meter.check_budget()
+        except BudgetExceededError as e:
+            print(f"Gemini Error: Skipping analysis: {e}")
+            return "Analysis unavailable due to API budget limit."
+        priority = self.priority or ("batch" if current_scope().engine else "interactive")
+        estimate = _estimate_tokens(prompt)
+        for attempt in range(settings.GEMINI_QUOTA_RETRIES + 1):
+            await gemini_quota.acquire(estimate, priority)
+            started, response = time.monotonic(), None
+            try:
+                response = await self.model.generate_content_async(prompt, generation_config=generation_config)
+                # Check for empty response or other issues
+                if not response or not response.text:
+                    print("Gemini Error: Empty response or text from API.")
+                    return "Analysis unavailable due to empty API response."
+                return response.text
+            except ResourceExhausted as e:
+                if attempt < settings.GEMINI_QUOTA_RETRIES:
+                    # Quota errors are queued, not returned: hold every caller and try again
+                    wait = min(settings.GEMINI_QUOTA_MAX_WAIT_SECONDS, 2.0 ** (attempt + 1))
+                    print(f"Gemini quota exhausted; retrying in {wait:.0f}s (attempt {attempt + 1}).")
+                    gemini_quota.pause(wait)
+                    continue
+                print(f"Gemini Error: Quota still exhausted after {attempt + 1} attempts: {str(e)}")
+                return "Analysis unavailable due to API error."
+            except GoogleAPIError as e:
+                print(f"Gemini Error: Google API error during content generation: {str(e)}")
+                return "Analysis unavailable due to API error."
+            except Exception as e:
+                print(f"Gemini Error: An unexpected error occurred during content generation: {str(e)}")
+                return "Analysis unavailable due to API error."
+            finally:
+                usage = getattr(response, "usage_metadata", None)
+                gemini_quota.settle(estimate, getattr(usage, "total_token_count", None) if usage else None)
+                meter.record(
+                    "gemini",
+                    self.model_name,
+                    cost=_usage_cost(response),
+                    latency=time.monotonic() - started,
+                    rows=1 if response is not None else 0,
+                    ok=response is not None,
+                )
+
+    async def generate_content_stream(
+        self,
+        prompt: str,
+        generation_config: dict | None = None,
+        cacheable: Callable[[str], bool] | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Like generate_content, but yields the text as the model produces it.
+        A cached response is yielded in one piece. If the call fails before
+        any text arrives, the 'Analysis unavailable' placeholder is yielded
+        instead; a stream cut off part-way simply ends. The text is cached
+        only if the stream ran to a normal stop and passes `cacheable` (pass
+        schema_check(...) for JSON), so a truncated stream never reaches the
+        cache that generate_content and generate_json read from.
+        Streams queue on the Gemini quota as 'interactive' unless the agent
+        says otherwise, since someone is waiting on them.
+        """
+        use_cache = self.use_cache and not _cache_excluded(current_scope().engine)
+        cache_payload = {"prompt": prompt, "generation_config": generation_config}
+        if use_cache:
+            cached = await prompt_cache.get(self.model_name, cache_payload)
+            if cached is not None:
+                yield cached
+                return
+
+        if not self.model:
+            yield "Analysis unavailable due to API error."
+            return
+        from google.api_core.exceptions import GoogleAPIError, ResourceExhausted  # Loaded with the SDK
+
+        try:
+            await meter.check_budget()
+        except BudgetExceededError as e:
+            print(f"Gemini Error: Skipping generation: {e}")
+            yield "Analysis unavailable due to API budget limit."
+            return
+        estimate = _estimate_tokens(prompt)
+        chunks = []
+        for attempt in range(settings.GEMINI_QUOTA_RETRIES + 1):
+            await gemini_quota.acquire(estimate, self.priority or "interactive")
+            started, response, complete = time.monotonic(), None, False
+            try:
+                response = await self.model.generate_content_async(
+                    prompt, generation_config=generation_config, stream=True
+                )
+                async for chunk in response:
+                    try:
+                        text = chunk.text
+                    except ValueError:  # A chunk without text parts (e.g. only safety ratings)
+                        continue
+                    if text:
+                        chunks.append(text)
+                        yield text
+                complete = True
+                break
+            except ResourceExhausted as e:
+                if not chunks and attempt < settings.GEMINI_QUOTA_RETRIES:
+                    wait = min(settings.GEMINI_QUOTA_MAX_WAIT_SECONDS, 2.0 ** (attempt + 1))
+                    print(f"Gemini quota exhausted; retrying in {wait:.0f}s (attempt {attempt + 1}).")
+                    gemini_quota.pause(wait)
+                    continue
+                print(f"Gemini Error: Quota exhausted during streaming: {str(e)}")
+                break
+            except GoogleAPIError as e:
+                print(f"Gemini Error: Google API error during streaming: {str(e)}")
+                break
+            except Exception as e:
+                print(f"Gemini Error: An unexpected error occurred during streaming: {str(e)}")
+                break
+            finally:
+                usage = getattr(response, "usage_metadata", None)
+                gemini_quota.settle(estimate, getattr(usage, "total_token_count", None) if usage else None)
+                meter.record(
+                    "gemini",
+                    self.model_name,
+                    cost=_usage_cost(response),
+                    latency=time.monotonic() - started,
+                    rows=1 if complete else 0,
+                    ok=complete,
+                )
+
+        if not chunks:
+            yield "Analysis unavailable due to API error." if not complete else "Analysis unavailable due to empty API response."
+        elif complete and _stopped(response) and use_cache and (cacheable is None or cacheable("".join(chunks))):
+            await prompt_cache.set(self.model_name, cache_payload, "".join(chunks))
+
+    async def generate_json(self, prompt: str, schema: Type[SchemaT], retries: int | None = None) -> SchemaT | None:
+        """
+        Generates a response in JSON mode and validates it against a pydantic
+        schema. A response that does not parse or validate is retried with the
+        validation error fed back to the model, up to `retries` times
+        (GEMINI_JSON_RETRIES by default); API failures are not retried here.
+        Returns None if no valid object came back.
+        """
+        retries = settings.GEMINI_JSON_RETRIES if retries is None else retries
+        request = json_prompt(prompt, schema)
+        for attempt in range(retries + 1):
+            text = await self._generate(request, JSON_MODE, cacheable=schema_check(schema))
+            if text.startswith(UNAVAILABLE_PREFIX):
+                return None
+            try:
+                return schema.model_validate_json(text)
+            except ValidationError as e:
+                errors = "; ".join(f"{'.'.join(map(str, error['loc'])) or 'response'}: {error['msg']}" for error in e.errors()[:5])
+                print(f"Gemini Error: {schema.__name__} response failed validation (attempt {attempt + 1}): {errors}")
+                request = (
+                    f"{json_prompt(prompt, schema)}\n\n"
+                    f"Your previous response was rejected ({errors}). Previous response:\n{text[:2000]}"
+                )
+        return None
+
+    async def generate_batch(self, instructions: str, items: Dict[str, str]) -> Dict[str, str] | None:
+        """
+        Runs several small generations in one request. `items` maps an id to
+        that item's input; the model answers in JSON mode with one
+        {"id", "output"} object per item. Returns the outputs that came back
+        well-formed, keyed by id - callers re-run any missing ids on their own.
+        Returns None if the request itself failed.
+        """
+        listing = "\n".join(json.dumps({"id": item_id, "input": text}) for item_id, text in items.items())
+        prompt = (
+            f"{instructions}\n\n"
+            "Handle each of the following items independently. Respond with a JSON array containing "
+            'exactly one object per item, {"id": <item id>, "output": <your answer as a string>}.\n\n'
+            f"Items:\n{listing}"
+        )
+
+        def _complete(text: str) -> bool:
+            # A partial answer is still returned, but only a complete one is cached:
+            # a cached partial would make every later run re-fetch the same gaps
+            outputs = _parse_batch(text, items)
+            return outputs is not None and len(outputs) == len(items)
+
+        text = await self._generate(prompt, JSON_MODE, cacheable=_complete)
+        if text.startswith(UNAVAILABLE_PREFIX):
+            return None
+        outputs = _parse_batch(text, items)
+        if outputs is None:
+            print(f"Gemini Error: Batch response is not valid JSON ({len(items)} items will be retried).")
+            return {}
+        return outputs
+
+
+def _parse_batch(text: str, items: Dict[str, str]) -> Dict[str, str] | None:
+    """The well-formed outputs of a generate_batch response, keyed by id; None if it is not JSON."""
+    try:
+        entries = json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(entries, dict):
+        entries = entries.get("items") or []
+
+    outputs = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        item_id, output = str(entry.get("id")), entry.get("output")
+        if item_id in items and isinstance(output, str) and output.strip():
+            outputs[item_id] = output.strip()
+    return outputs
+
+_agents: Dict[str, GeminiAgent] = {}
+
 
-# Initialize a global GeminiAgent instance with the default model
-gemini_agent = GeminiAgent()
\ No newline at end of file
+def get_gemini_agent(model_name: str = DEFAULT_MODEL) -> GeminiAgent:
+    """The shared agent for a model, built (and the SDK configured) on first use."""
+    agent = _agents.get(model_name)
+    if agent is None:
+        agent = _agents[model_name] = GeminiAgent(model_name)
+    return agent
\ No newline at end of file
@@ -0,0 +1,283 @@
+"""
+Usage metering and per-project budgets for paid APIs (DataForSEO, Gemini).
+
+Every outbound call is recorded with its cost units, latency and row count and
+tagged with the current project, engine and endpoint. Project and engine come
+from the surrounding metering_scope (a context variable), so callers do not
+have to thread them through every function:
+
+    with metering_scope(engine="revenue_shield", project_id=project_id):
+        ...
+
+or, for a whole flow, the @metered("revenue_shield") decorator.
+
+Cost units are US dollars: DataForSEO reports the cost of each call, and
+Gemini calls are priced from their token usage (GEMINI_*_COST_PER_1M_TOKENS).
+
+Records are aggregated in memory and periodically added to api_usage (one
+row per day, project, engine, provider and endpoint), which also holds the
+running totals. Calls made inside a project scope are refused with
+BudgetExceededError once the project's spend for the day reaches the
+daily_api_budget of its plan (payment_routes.PLANS), so a runaway engine
+degrades instead of burning the account. A project id that does not exist
+(or whose plan has no budget) is refused outright rather than given a default.
+"""
+import asyncio
+import contextvars
+import datetime
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config.settings import settings
+from src.models.core import ApiUsage
+from src.utils.database import engine
+
+NO_PROJECT = 0  # api_usage.project_id for platform-wide work such as the daily harvest
+
+
+@dataclass(frozen=True)
+class MeterScope:
+    project_id: int | None = None
+    engine: str | None = None
+
+
+_scope: contextvars.ContextVar[MeterScope] = contextvars.ContextVar("metering_scope", default=MeterScope())
+
+
+class BudgetExceededError(Exception):
+    """The project has used up its daily API budget (budget None: it has no budget at all)."""
+
+    def __init__(self, project_id: int, spent: float, budget: float | None):
+        if budget is None:
+            super().__init__(f"Project {project_id} does not exist or its plan has no daily API budget")
+        else:
+            super().__init__(f"Project {project_id} has spent {spent:.4f} of its {budget:.2f} daily API budget")
+        self.project_id = project_id
+        self.spent = spent
+        self.budget = budget
+
+
+@contextmanager
+def metering_scope(project_id: int | None = None, engine: str | None = None) -> Iterator[MeterScope]:
+    """Tags every API call made inside the block (including tasks it starts) with a project and engine."""
+    current = _scope.get()
+    scope = MeterScope(
+        project_id=project_id if project_id is not None else current.project_id,
+        engine=engine or current.engine,
+    )
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def metered(engine_name: str):
+    """Runs an async flow function inside metering_scope, taking project_id from its arguments."""
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            with metering_scope(project_id=arguments.get("project_id"), engine=engine_name):
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    await meter.flush()
+        return wrapper
+    return decorate
+
+
+def current_scope() -> MeterScope:
+    return _scope.get()
+
+
+def plan_daily_budget(plan: str | None) -> float | None:
+    """Daily budget of a plan; a project without a plan is on startup. Unknown plans have none."""
+    # Imported lazily: the plan table lives with the payment routes
+    from src.api.payment_routes import PLANS
+
+    return PLANS.get(plan or "startup", {}).get("daily_api_budget")
+
+
+UsageKey = Tuple[datetime.date, int, str, str, str]  # day, project_id, engine, provider, endpoint
+
+
+class Meter:
+    def __init__(self):
+        self._pending: Dict[UsageKey, Dict[str, float]] = {}
+        self._totals: Dict[UsageKey, Dict[str, float]] = {}
+        self._spend: Dict[Tuple[int, datetime.date], Tuple[float, float]] = {}  # -> (persisted cost, fetched at)
+        self._budgets: Dict[int, Tuple[float | None, float]] = {}  # -> (budget, fetched at)
+        self._last_flush = time.monotonic()
+        self._flushing: asyncio.Task | None = None
+
+    def record(
+        self,
+        provider: str,
+        endpoint: str,
+        cost: float = 0.0,
+        latency: float = 0.0,
+        rows: int = 0,
+        ok: bool = True,
+    ) -> None:
+        """Adds one call to the running totals of the current scope."""
+        if not settings.METERING_ENABLED:
+            return
+        scope = _scope.get()
+        key = (datetime.date.today(), scope.project_id or NO_PROJECT, scope.engine or "", provider, endpoint)
+        for bucket in (self._pending, self._totals):
+            usage = bucket.setdefault(key, {"calls": 0, "errors": 0, "cost_units": 0.0, "latency_ms": 0.0, "rows": 0})
+            usage["calls"] += 1
+            usage["errors"] += 0 if ok else 1
+            usage["cost_units"] += cost or 0.0
+            usage["latency_ms"] += latency * 1000
+            usage["rows"] += rows or 0
+
+        if time.monotonic() - self._last_flush >= settings.METERING_FLUSH_SECONDS and not self._flushing:
+            try:
+                self._flushing = asyncio.get_running_loop().create_task(self.flush())
+                self._flushing.add_done_callback(lambda _: setattr(self, "_flushing", None))
+            except RuntimeError:
+                pass  # No running loop; the next explicit flush picks it up
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """Running totals for this process, keyed 'day/project/engine/provider/endpoint'."""
+        return {"/".join(str(part) for part in key): dict(usage) for key, usage in self._totals.items()}
+
+    async def flush(self) -> None:
+        """Adds the pending aggregates to api_usage."""
+        pending, self._pending = self._pending, {}
+        self._last_flush = time.monotonic()
+        if not pending:
+            return
+        rows = [
+            {"day": day, "project_id": project_id, "engine": engine_name, "provider": provider, "endpoint": endpoint, **usage}
+            for (day, project_id, engine_name, provider, endpoint), usage in pending.items()
+        ]
+        dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(ApiUsage).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["day", "project_id", "engine", "provider", "endpoint"],
+            set_={
+                column: getattr(ApiUsage, column) + stmt.excluded[column]
+                for column in ("calls", "errors", "cost_units", "latency_ms", "rows")
+            },
+        )
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(stmt)
+        except Exception as e:
+            print(f"WARNING: Failed to persist API usage ({len(rows)} aggregates): {e}")
+            # Keep them for the next flush rather than losing the spend
+            for key, usage in pending.items():
+                merged = self._pending.setdefault(key, dict.fromkeys(usage, 0))
+                for column, value in usage.items():
+                    merged[column] += value
+            return
+        for project_id, day in {(key[1], key[0]) for key in pending}:
+            self._spend.pop((project_id, day), None)
+
+    async def _persisted_spend(self, project_id: int, day: datetime.date) -> float:
+        cached = self._spend.get((project_id, day))
+        if cached and time.monotonic() - cached[1] < settings.METERING_BUDGET_REFRESH_SECONDS:
+            return cached[0]
+        async with engine.connect() as conn:
+            spent = (await conn.execute(
+                select(ApiUsage.cost_units).where(ApiUsage.day == day, ApiUsage.project_id == project_id)
+            )).scalars().all()
+        total = float(sum(spent))
+        self._spend[(project_id, day)] = (total, time.monotonic())
+        return total
+
+    async def _project_budget(self, project_id: int, session: AsyncSession | None = None) -> float | None:
+        cached = self._budgets.get(project_id)
+        if cached and time.monotonic() - cached[1] < settings.METERING_BUDGET_REFRESH_SECONDS:
+            return cached[0]
+        from src.utils.models import Project
+
+        stmt = select(Project.plan).where(Project.id == project_id)
+        if session is not None:
+            project = (await session.execute(stmt)).first()
+        else:
+            async with engine.connect() as conn:
+                project = (await conn.execute(stmt)).first()
+        # A missing project gets no budget (refused); only a NULL plan falls back to the default
+        budget = plan_daily_budget(project.plan) if project is not None else None
+        self._budgets[project_id] = (budget, time.monotonic())
+        return budget
+
+    async def spent_today(self, project_id: int) -> float:
+        """Today's spend for a project: everything persisted plus this process's unflushed calls."""
+        day = datetime.date.today()
+        unflushed = sum(usage["cost_units"] for key, usage in self._pending.items() if key[0] == day and key[1] == project_id)
+        return await self._persisted_spend(project_id, day) + unflushed
+
+    async def check_budget(self) -> None:
+        """Raises BudgetExceededError if the current scope's project is out of budget today."""
+        project_id = _scope.get().project_id
+        if not settings.METERING_ENABLED or project_id is None:
+            return
+        try:
+            budget = await self._project_budget(project_id)
+            if budget is None:
+                raise BudgetExceededError(project_id, 0.0, None)
+            spent = await self.spent_today(project_id)
+        except BudgetExceededError:
+            raise
+        except Exception as e:
+            if _is_schema_error(e):
+                # A missing migration (e.g. projects.plan) would switch the guard off for good; fail closed
+                print(f"ERROR: Cannot check the API budget of project {project_id}; is the schema migrated? {e}")
+                raise
+            # A briefly unreadable ledger must not take the engines down with it
+            print(f"WARNING: Could not check the API budget of project {project_id}: {e}")
+            return
+        if spent >= budget:
+            raise BudgetExceededError(project_id, spent, budget)
+
+
+meter = Meter()
+
+
+def _is_schema_error(error: Exception) -> bool:
+    """Missing tables or columns: 'no such ...' on SQLite, undefined table/column on Postgres."""
+    if isinstance(error, ProgrammingError):
+        return True
+    return isinstance(error, OperationalError) and "no such" in str(error)
+
+
+async def load_usage(
+    project_id: int, day: datetime.date | None = None, session: AsyncSession | None = None
+) -> Dict[str, Any]:
+    """
+    Persisted usage of a project for one day, broken down by engine, provider and endpoint.
+    API routes pass their request session; other callers get a connection of their own.
+    """
+    day = day or datetime.date.today()
+    stmt = (
+        select(*ApiUsage.__table__.columns).where(ApiUsage.day == day, ApiUsage.project_id == project_id)
+        .order_by(ApiUsage.engine, ApiUsage.provider, ApiUsage.endpoint)
+    )
+    if session is not None:
+        rows = (await session.execute(stmt)).all()
+    else:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(stmt)).all()
+    return {
+        "project_id": project_id,
+        "day": day,
+        "spent": sum(row.cost_units for row in rows),
+        "budget": await meter._project_budget(project_id, session),
+        "breakdown": [dict(row._mapping) for row in rows],
+    }
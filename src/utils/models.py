@@ -15,6 +15,7 @@ class Project(SQLModel, table=True):
     name: str = Field(index=True, unique=True, nullable=False)
     subscription_id: Optional[str] = Field(default=None, index=True)
     mode: str = Field(default="global")  # 'local' or 'global'
+    plan: str = Field(default="startup", sa_column_kwargs={"server_default": "startup"})  # Key into payment_routes.PLANS; existing databases: src/scripts/add_project_plan.py
     active: bool = Field(default=True, nullable=False)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -0,0 +1,240 @@
+"""
+Buffered bulk writer for ranking_history.
+
+Harvest workers hand rank results to a RankHistoryWriter instead of opening a
+session per row. Rows are buffered and written in bulk by a small number of
+flusher tasks: COPY on Postgres/asyncpg, a multi-row INSERT everywhere else.
+
+A batch is flushed once it reaches HARVEST_WRITE_BATCH_SIZE rows or has waited
+HARVEST_WRITE_FLUSH_SECONDS. The buffer is bounded by HARVEST_WRITE_MAX_PENDING,
+so when the database falls behind `add()` blocks and the harvest slows down to
+match instead of growing memory without limit.
+
+Each flush also upserts keyword_latest_rank in the same transaction, so the
+projection never points at a row that was not written.
+
+When the writer is given a harvest_date, every flush first inserts
+harvest_checkpoints rows (ON CONFLICT DO NOTHING) and only writes rank rows for
+keywords whose checkpoint was new. Writes are therefore idempotent per
+(keyword, date), and the checkpoints tell a restarted run what is already done.
+"""
+import asyncio
+import datetime
+import time
+from typing import Any, Dict, List, Set, Tuple
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.config.settings import settings
+from src.models.core import HarvestCheckpoint, KeywordLatestRank, RankingLog
+from src.utils.database import engine
+
+COPY_COLUMNS = ("keyword_id", "rank", "url", "analysis")
+
+_CLOSE = object()
+
+
+async def upsert_latest_ranks(conn, rows: List[Dict[str, Any]]) -> None:
+    """Points keyword_latest_rank at the given rows (the last one wins per keyword)."""
+    latest = {row["keyword_id"]: row for row in rows}
+    if not latest:
+        return
+    dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(KeywordLatestRank).values(
+        [{column: row[column] for column in COPY_COLUMNS} for row in latest.values()]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["keyword_id"],
+        set_={
+            "rank": stmt.excluded.rank,
+            "url": stmt.excluded.url,
+            "analysis": stmt.excluded.analysis,
+            "updated_at": func.now(),
+        },
+    )
+    await conn.execute(stmt)
+
+
+async def rebuild_latest_ranks() -> int:
+    """Rebuilds keyword_latest_rank from ranking_history. Used once to backfill the projection."""
+    newest = select(
+        RankingLog.keyword_id,
+        RankingLog.rank,
+        RankingLog.url,
+        RankingLog.analysis,
+        RankingLog.created_at,
+        func.row_number().over(
+            partition_by=RankingLog.keyword_id,
+            order_by=(RankingLog.created_at.desc(), RankingLog.id.desc()),
+        ).label("position"),
+    ).subquery()
+    latest = select(
+        newest.c.keyword_id, newest.c.rank, newest.c.url, newest.c.analysis, newest.c.created_at
+    ).where(newest.c.position == 1)
+
+    async with engine.begin() as conn:
+        await conn.execute(delete(KeywordLatestRank))
+        result = await conn.execute(
+            insert(KeywordLatestRank).from_select(
+                ["keyword_id", "rank", "url", "analysis", "updated_at"], latest
+            )
+        )
+    return result.rowcount
+
+
+class RankHistoryWriter:
+    def __init__(
+        self,
+        batch_size: int | None = None,
+        flush_interval: float | None = None,
+        max_pending: int | None = None,
+        writers: int = 1,
+        harvest_date: datetime.date | None = None,
+    ):
+        self.harvest_date = harvest_date
+        self.batch_size = batch_size or settings.HARVEST_WRITE_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.HARVEST_WRITE_FLUSH_SECONDS
+        self.writers = max(1, writers)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending or settings.HARVEST_WRITE_MAX_PENDING)
+        self._flushers: List[asyncio.Task] = []
+
+        # Every row gets a sequence number; _settled_upto is the low watermark
+        # below which all rows have been written (or failed).
+        self._next_seq = 0
+        self._settled_upto = 0
+        self._settled_ahead: Set[int] = set()
+        self._settled = asyncio.Condition()
+
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.rows_skipped = 0  # Already checkpointed for harvest_date
+        self.flushes = 0
+        self.flush_seconds = 0.0
+
+    async def __aenter__(self) -> "RankHistoryWriter":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        if not self._flushers:
+            self._flushers = [asyncio.create_task(self._run()) for _ in range(self.writers)]
+
+    async def add(self, keyword_id: int, rank: int, url: str, analysis: str | None = None) -> int:
+        """
+        Queues one rank result and returns its sequence number.
+        Waits if the buffer is full (backpressure).
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+        await self._queue.put((seq, {"keyword_id": keyword_id, "rank": rank, "url": url, "analysis": analysis}))
+        return seq
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the most recently added row (-1 if none)."""
+        return self._next_seq - 1
+
+    async def wait_settled(self, seq: int) -> None:
+        """Waits until every row up to and including `seq` has been flushed."""
+        async with self._settled:
+            await self._settled.wait_for(lambda: self._settled_upto > seq)
+
+    async def _settle(self, seqs: List[int]) -> None:
+        async with self._settled:
+            self._settled_ahead.update(seqs)
+            while self._settled_upto in self._settled_ahead:
+                self._settled_ahead.remove(self._settled_upto)
+                self._settled_upto += 1
+            self._settled.notify_all()
+
+    async def close(self) -> None:
+        """Flushes everything still buffered and stops the flusher tasks."""
+        for _ in self._flushers:
+            await self._queue.put(_CLOSE)
+        await asyncio.gather(*self._flushers)
+        self._flushers = []
+
+    async def _run(self) -> None:
+        closing = False
+        while not closing:
+            first = await self._queue.get()
+            if first is _CLOSE:
+                return
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is _CLOSE:
+                    closing = True
+                    break
+                batch.append(row)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[int, Dict[str, Any]]]) -> None:
+        t0 = time.monotonic()
+        rows = [row for _, row in batch]
+        try:
+            written = await self._write(rows)
+            self.rows_written += written
+            self.rows_skipped += len(rows) - written
+        except Exception as e:
+            print(f"ERROR: Failed to write {len(rows)} ranking_history rows: {e}")
+            self.rows_failed += len(rows)
+        finally:
+            self.flushes += 1
+            self.flush_seconds += time.monotonic() - t0
+            await self._settle([seq for seq, _ in batch])
+
+    async def _checkpoint(self, conn, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Claims (keyword, harvest_date) checkpoints and returns only the rows that won one."""
+        if self.harvest_date is None:
+            return rows
+        by_keyword = {}
+        for row in rows:
+            by_keyword.setdefault(row["keyword_id"], row)
+        dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+        stmt = (
+            dialect.insert(HarvestCheckpoint)
+            .values([{"harvest_date": self.harvest_date, "keyword_id": keyword_id} for keyword_id in by_keyword])
+            .on_conflict_do_nothing()
+            .returning(HarvestCheckpoint.keyword_id)
+        )
+        fresh = set((await conn.execute(stmt)).scalars())
+        return [row for keyword_id, row in by_keyword.items() if keyword_id in fresh]
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> int:
+        if engine.dialect.name == "postgresql" and engine.dialect.driver == "asyncpg":
+            async with engine.begin() as conn:
+                # Statements run before COPY so the transaction is already open
+                # when COPY is issued on the same driver connection.
+                rows = await self._checkpoint(conn, rows)
+                if not rows:
+                    return 0
+                await upsert_latest_ranks(conn, rows)
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.copy_records_to_table(
+                    RankingLog.__tablename__,
+                    records=[tuple(row[column] for column in COPY_COLUMNS) for row in rows],
+                    columns=COPY_COLUMNS,
+                )
+        else:
+            # executemany on a Core insert is sent as batched multi-row INSERT statements
+            async with engine.begin() as conn:
+                rows = await self._checkpoint(conn, rows)
+                if not rows:
+                    return 0
+                await conn.execute(insert(RankingLog), rows)
+                await upsert_latest_ranks(conn, rows)
+        return len(rows)
@@ -0,0 +1,214 @@
+"""
+Adaptive client-side rate limiting for external APIs.
+
+AdaptiveLimiter combines two controls that every caller in the process shares:
+
+- a token bucket capping the request rate (rate per second, with a burst),
+  set to the provider's published limit;
+- an AIMD concurrency window: each successful call widens the window by about
+  one slot per window's worth of successes (additive increase), and each
+  throttled call (429, 5xx, timeout) halves it (multiplicative decrease).
+
+A throttled call also pauses every caller until the provider's Retry-After has
+passed, so one 429 slows the whole process down instead of triggering a burst
+of retries. Throughput settles just under whatever the provider tolerates.
+
+QuotaScheduler is the counterpart for per-minute quotas such as Gemini's:
+requests-per-minute and tokens-per-minute budgets, with waiting callers
+served strictly by priority class and then in arrival order.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        max_concurrency: int,
+        burst: float | None = None,
+        min_concurrency: int = 1,
+        backoff_factor: float = 0.5,
+        default_pause: float = 1.0,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.backoff_factor = backoff_factor
+        self.default_pause = default_pause
+
+        self.window = float(max_concurrency)
+        self.in_flight = 0
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._condition: asyncio.Condition | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+        self.successes = 0
+        self.throttled = 0
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A new event loop (e.g. another asyncio.run); calls from the old one are gone
+            self._condition = asyncio.Condition()
+            self._loop = loop
+            self.in_flight = 0
+        return self._condition
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    async def acquire(self) -> None:
+        """Waits for a token, a free slot in the window and the end of any pause."""
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self.in_flight >= int(self.window):
+                        wait = None  # Until a call finishes
+                    elif self._tokens < 1:
+                        wait = (1 - self._tokens) / self.rate
+                    else:
+                        self._tokens -= 1
+                        self.in_flight += 1
+                        return
+                try:
+                    await asyncio.wait_for(condition.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, throttled: bool = False, retry_after: float | None = None) -> None:
+        """Ends a call started with acquire() and adapts the window to its outcome."""
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            if throttled:
+                self.throttled += 1
+                self.window = max(float(self.min_concurrency), self.window * self.backoff_factor)
+                pause = retry_after if retry_after is not None else self.default_pause
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            else:
+                self.successes += 1
+                self.window = min(float(self.max_concurrency), self.window + 1 / self.window)
+            condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "window": round(self.window, 2),
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "throttled": self.throttled,
+        }
+
+
+class QuotaScheduler:
+    """
+    Shared RPM/TPM budget. acquire(tokens, priority) queues until both buckets
+    can cover the call; the highest-priority waiter is always served first, so
+    an interactive request never sits behind a nightly batch. Calls queue
+    instead of failing, and settle() corrects the token estimate afterwards.
+    """
+
+    PRIORITIES = {"interactive": 0, "batch": 1}
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int):
+        self.name = name
+        self.request_capacity = float(requests_per_minute)
+        self.token_capacity = float(tokens_per_minute)
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: list = []  # heap of (priority, seq, tokens, future)
+        self._seq = itertools.count()
+        self._wakeup: asyncio.TimerHandle | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+        self.granted = 0
+        self.waited_seconds = 0.0
+        self.pauses = 0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._requests = min(self.request_capacity, self._requests + elapsed * self.request_capacity / 60)
+        self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_capacity / 60)
+        self._refilled_at = now
+
+    def _check_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A new event loop (e.g. another asyncio.run); waiters from the old one are gone
+            self._waiters, self._wakeup, self._loop = [], None, loop
+        return loop
+
+    def _pump(self) -> None:
+        """Grants queued calls in priority order while the budgets allow."""
+        self._wakeup = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters:
+            priority, seq, tokens, future = self._waiters[0]
+            if future.done():  # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            # A call larger than the whole minute's budget goes through once the bucket is full
+            needed = min(tokens, self.token_capacity)
+            if now < self._paused_until:
+                wait = self._paused_until - now
+            elif self._requests < 1:
+                wait = (1 - self._requests) * 60 / self.request_capacity
+            elif self._tokens < needed:
+                wait = (needed - self._tokens) * 60 / self.token_capacity
+            else:
+                heapq.heappop(self._waiters)
+                self._requests -= 1
+                self._tokens -= tokens
+                self.granted += 1
+                future.set_result(None)
+                continue
+            self._wakeup = self._loop.call_later(wait, self._pump)
+            return
+
+    async def acquire(self, tokens: int, priority: str = "batch") -> None:
+        """Waits until the budgets cover one call of about `tokens` tokens."""
+        loop = self._check_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (self.PRIORITIES.get(priority, 1), next(self._seq), tokens, future))
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._pump()
+        if not future.done():
+            started = time.monotonic()
+            try:
+                await future
+            finally:
+                self.waited_seconds += time.monotonic() - started
+
+    def settle(self, estimated: int, actual: int | None) -> None:
+        """Books the difference between a call's estimated and actual token usage."""
+        if actual is not None:
+            self._tokens = min(self.token_capacity, self._tokens + estimated - actual)
+
+    def pause(self, seconds: float) -> None:
+        """Holds every waiting call after a quota error from the provider."""
+        self.pauses += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        return {
+            "granted": self.granted,
+            "waiting": sum(1 for *_, future in self._waiters if not future.done()),
+            "waited_seconds": round(self.waited_seconds, 2),
+            "pauses": self.pauses,
+        }
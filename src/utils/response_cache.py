@@ -0,0 +1,210 @@
+"""
+Disk-backed TTL cache for expensive, idempotent API responses.
+
+Entries live in a small SQLite file (DATAFORSEO_CACHE_PATH) so every process on
+the host - API app, Prefect workers and ad-hoc scripts - shares them. Keys are
+a hash of the full request (endpoint + payload); values are zlib-compressed
+JSON. Entries expire after the TTL, and once the file holds more than the size
+cap the least recently used entries are evicted.
+
+An optional in-process LRU tier (memory_entries) sits in front of the file:
+hot entries are answered without touching SQLite at all.
+
+get_or_fetch also collapses concurrent misses for the same key within a process
+into a single upstream call.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+import orjson
+
+from src.config.settings import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+)
+"""
+
+
+def cache_key(endpoint: str, payload: Any) -> str:
+    canonical = json.dumps([endpoint, payload], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path: str | None = None,
+        ttl_seconds: int | None = None,
+        max_bytes: int | None = None,
+        enabled: bool | None = None,
+        memory_entries: int = 0,
+    ):
+        self.path = path or settings.DATAFORSEO_CACHE_PATH
+        self.ttl_seconds = ttl_seconds or settings.DATAFORSEO_CACHE_TTL_SECONDS
+        self.max_bytes = max_bytes or settings.DATAFORSEO_CACHE_MAX_MB * 1024 * 1024
+        self.enabled = settings.DATAFORSEO_CACHE_ENABLED if enabled is None else enabled
+        self._ready = False
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.memory_entries = memory_entries
+        self._memory: OrderedDict[str, Tuple[float, Any]] = OrderedDict()  # key -> (expires_at, value)
+
+        self.memory_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "memory_hits": self.memory_hits,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+    def _remember(self, key: str, value: Any, expires_at: float) -> None:
+        if not self.memory_entries:
+            return
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _recall(self, key: str) -> Any | None:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return entry[1]
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")  # Readers in other processes do not block writers
+            conn.execute(SCHEMA)
+            self._ready = True
+        return conn
+
+    def _get(self, key: str) -> Tuple[Any, float] | None:
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return orjson.loads(zlib.decompress(row[0])), row[1]
+
+    def _set(self, key: str, endpoint: str, value: Any) -> int:
+        blob = zlib.compress(orjson.dumps(value))
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, value, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, blob, len(blob), now + self.ttl_seconds, now),
+            )
+            return self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> int:
+        """Drops expired entries, then least recently used ones until the cache fits in max_bytes."""
+        evicted = conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        return evicted
+
+    async def get(self, endpoint: str, payload: Any) -> Any | None:
+        if not self.enabled:
+            return None
+        key = cache_key(endpoint, payload)
+        value = self._recall(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        try:
+            found = await asyncio.to_thread(self._get, key)
+        except Exception as e:
+            print(f"WARNING: Response cache read failed: {e}")
+            found = None
+        if found is None:
+            self.misses += 1
+            return None
+        value, expires_at = found
+        self._remember(key, value, expires_at)
+        self.hits += 1
+        return value
+
+    async def set(self, endpoint: str, payload: Any, value: Any) -> None:
+        if not self.enabled:
+            return
+        key = cache_key(endpoint, payload)
+        self._remember(key, value, time.time() + self.ttl_seconds)
+        try:
+            self.evictions += await asyncio.to_thread(self._set, key, endpoint, value)
+            self.stores += 1
+        except Exception as e:
+            print(f"WARNING: Response cache write failed: {e}")
+
+    async def get_or_fetch(
+        self,
+        endpoint: str,
+        payload: Any,
+        fetch: Callable[[], Awaitable[Any]],
+        cacheable: Callable[[Any], bool] = lambda value: value is not None,
+    ) -> Any:
+        """
+        Returns the cached response for (endpoint, payload), or calls fetch() and
+        caches its result if cacheable(result). Concurrent callers for the same
+        request share one fetch.
+        """
+        key = cache_key(endpoint, payload)
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await self.get(endpoint, payload)
+            if value is None:
+                value = await fetch()
+                if cacheable(value):
+                    await self.set(endpoint, payload, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._in_flight[key]
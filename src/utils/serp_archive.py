@@ -0,0 +1,273 @@
+"""
+Append-only archive of raw SERP responses.
+
+Every SERP fetched from DataForSEO is kept as one row in a Parquet dataset
+(zstd-compressed) under SERP_ARCHIVE_DIR, partitioned hive-style by fetch date
+and location:
+
+    <SERP_ARCHIVE_DIR>/date=2026-10-18/location=United States/part-<uuid>-0.parquet
+
+Rows are buffered in memory and written as a new file once SERP_ARCHIVE_FLUSH_ROWS
+have accumulated, once their payloads reach SERP_ARCHIVE_FLUSH_MB, once the
+oldest has waited SERP_ARCHIVE_FLUSH_SECONDS, or when the archive is flushed at
+the end of a run. That bounds both the memory per worker and what a crash can
+lose. Existing files are never rewritten, so concurrent workers can archive
+into the same partitions safely.
+
+Besides the full result payload (JSON), each row carries the organic results
+as parallel list columns (domains, ranks, urls). Rank questions can therefore
+be answered from the archive without decoding any JSON, e.g.:
+
+    for key, ranks in replay_domain_ranks(datetime.date(2026, 10, 1)):
+        ...
+
+pyarrow is imported lazily so importing this module stays cheap.
+"""
+import asyncio
+import datetime
+import json
+import os
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from src.config.settings import settings
+
+SerpKey = Tuple[str, str, str]  # Mirrors src.tasks.serp_tasks.SerpKey
+DomainRanks = Dict[str, Tuple[int, str]]
+
+# Rows per record batch when iterating; with the JSON payloads a batch is a few MB
+READ_BATCH_ROWS = 512
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("date", pa.string()),
+        ("location", pa.string()),
+        ("keyword", pa.string()),
+        ("device", pa.string()),
+        ("source", pa.string()),
+        ("fetched_at", pa.timestamp("ms")),
+        ("items_count", pa.int32()),
+        ("domains", pa.list_(pa.string())),
+        ("ranks", pa.list_(pa.int32())),
+        ("urls", pa.list_(pa.string())),
+        ("payload", pa.string()),
+    ])
+
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    return ds.partitioning(pa.schema([("date", pa.string()), ("location", pa.string())]), flavor="hive")
+
+
+def _serp_result(response: Dict[str, Any] | None) -> Dict[str, Any] | None:
+    if response and response.get("tasks") and response["tasks"][0].get("result"):
+        return response["tasks"][0]["result"][0]
+    return None
+
+
+def serp_record(key: SerpKey, response: Dict[str, Any] | None, source: str = "live") -> Dict[str, Any] | None:
+    """Flattens one SERP task response into an archive row. Returns None if there is no result."""
+    result = _serp_result(response)
+    if not result:
+        return None
+    keyword, location, device = key
+    fetched_at = datetime.datetime.utcnow()
+    domains, ranks, urls = [], [], []
+    for item in result.get("items") or []:
+        if item.get("type") == "organic":
+            domains.append(item.get("domain") or "")
+            ranks.append(item.get("rank_group", 0))
+            urls.append(item.get("url") or "")
+    return {
+        "date": fetched_at.date().isoformat(),
+        "location": location,
+        "keyword": keyword,
+        "device": device,
+        "source": source,
+        "fetched_at": fetched_at,
+        "items_count": len(result.get("items") or []),
+        "domains": domains,
+        "ranks": ranks,
+        "urls": urls,
+        "payload": json.dumps(result, separators=(",", ":")),
+    }
+
+
+class SerpArchive:
+    def __init__(
+        self,
+        root: str | None = None,
+        flush_rows: int | None = None,
+        enabled: bool | None = None,
+        flush_bytes: int | None = None,
+        flush_interval: float | None = None,
+    ):
+        self.root = root or settings.SERP_ARCHIVE_DIR
+        self.flush_rows = flush_rows or settings.SERP_ARCHIVE_FLUSH_ROWS
+        self.flush_bytes = flush_bytes or int(settings.SERP_ARCHIVE_FLUSH_MB * 1024 * 1024)
+        self.flush_interval = flush_interval or settings.SERP_ARCHIVE_FLUSH_SECONDS
+        self.enabled = settings.SERP_ARCHIVE_ENABLED if enabled is None else enabled
+        self._buffer: List[Dict[str, Any]] = []
+        self._buffered_bytes = 0
+        self._timer: asyncio.Task | None = None
+
+        self.rows_archived = 0
+        self.files_written = 0
+
+    async def add(self, key: SerpKey, response: Dict[str, Any] | None, source: str = "live") -> None:
+        """Buffers one SERP response; writes a file once the buffer is full or old enough."""
+        if not self.enabled:
+            return
+        record = serp_record(key, response, source)
+        if record is None:
+            return
+        self._buffer.append(record)
+        self._buffered_bytes += len(record["payload"])
+        if len(self._buffer) >= self.flush_rows or self._buffered_bytes >= self.flush_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Writes everything buffered so far as new Parquet files."""
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        records, self._buffer, self._buffered_bytes = self._buffer, [], 0
+        if not records:
+            return
+        try:
+            await asyncio.to_thread(self._write, records)
+        except Exception as e:
+            print(f"ERROR: Failed to archive {len(records)} SERPs: {e}")
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        table = pa.Table.from_pylist(records, schema=_schema())
+        os.makedirs(self.root, exist_ok=True)
+        ds.write_dataset(
+            table,
+            self.root,
+            format="parquet",
+            partitioning=_partitioning(),
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",  # Unique file names: adds files, never replaces
+            file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+        )
+        self.rows_archived += len(records)
+        self.files_written += len({(record["date"], record["location"]) for record in records})
+
+
+serp_archive = SerpArchive()
+
+
+# --- Reading ---
+
+def _dataset(
+    start: datetime.date,
+    end: datetime.date | None,
+    location: str | None,
+    keywords: Iterable[str] | None,
+    root: str | None,
+):
+    """The archive dataset and the filter selecting a date/location range, or None if nothing is archived."""
+    import pyarrow.dataset as ds
+
+    root = root or settings.SERP_ARCHIVE_DIR
+    end = end or start
+    if not os.path.isdir(root):
+        return None
+
+    dataset = ds.dataset(root, format="parquet", schema=_schema(), partitioning=_partitioning())
+    condition = (ds.field("date") >= start.isoformat()) & (ds.field("date") <= end.isoformat())
+    if location is not None:
+        condition &= ds.field("location") == location
+    if keywords is not None:
+        condition &= ds.field("keyword").isin(list(keywords))
+    return dataset, condition
+
+
+def _iter_rows(
+    start: datetime.date,
+    end: datetime.date | None,
+    location: str | None,
+    keywords: Iterable[str] | None,
+    columns: List[str] | None,
+    root: str | None,
+) -> Iterator[Dict[str, Any]]:
+    """Streams matching rows batch by batch, so memory stays flat however long the range."""
+    selected = _dataset(start, end, location, keywords, root)
+    if selected is None:
+        return
+    dataset, condition = selected
+    batches = dataset.to_batches(
+        columns=columns, filter=condition, batch_size=READ_BATCH_ROWS, batch_readahead=1, fragment_readahead=1
+    )
+    for batch in batches:
+        yield from batch.to_pylist()
+
+
+def read_serps(
+    start: datetime.date,
+    end: datetime.date | None = None,
+    location: str | None = None,
+    keywords: Iterable[str] | None = None,
+    columns: List[str] | None = None,
+    root: str | None = None,
+):
+    """
+    Loads archived SERPs fetched between start and end (inclusive) as a pyarrow
+    Table. Partition pruning skips every file outside the date/location range.
+    The whole range is held in memory; use iter_serps or replay_domain_ranks
+    to stream long ranges.
+    """
+    selected = _dataset(start, end, location, keywords, root)
+    if selected is None:
+        return _schema().empty_table() if columns is None else _schema().empty_table().select(columns)
+    dataset, condition = selected
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def iter_serps(
+    start: datetime.date,
+    end: datetime.date | None = None,
+    location: str | None = None,
+    keywords: Iterable[str] | None = None,
+    root: str | None = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yields archived SERPs as dicts with the decoded result under 'payload'."""
+    for row in _iter_rows(start, end, location, keywords, None, root):
+        row["payload"] = json.loads(row["payload"])
+        yield row
+
+
+def replay_domain_ranks(
+    start: datetime.date,
+    end: datetime.date | None = None,
+    location: str | None = None,
+    keywords: Iterable[str] | None = None,
+    root: str | None = None,
+) -> Iterator[Tuple[SerpKey, DomainRanks]]:
+    """
+    Replays archived SERPs as (serp_key, {domain: (rank, url)}), the same shape
+    parse_domain_ranks produces for a live response. Reads only the list columns.
+    """
+    columns = ["keyword", "location", "device", "domains", "ranks", "urls"]
+    for row in _iter_rows(start, end, location, keywords, columns, root):
+        ranks: DomainRanks = {}
+        for domain, rank, url in zip(row["domains"], row["ranks"], row["urls"]):
+            if domain and domain not in ranks:
+                ranks[domain] = (rank, url)
+        yield (row["keyword"], row["location"], row["device"]), ranks
@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+# Point the app at a throwaway SQLite file before anything imports src.config.settings
+_db_dir = tempfile.mkdtemp(prefix="keiracom-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_db_dir}/test.db"
+os.environ.setdefault("METERING_ENABLED", "false")
+
+import pytest_asyncio
+
+from src.models.base import Base
+import src.models.core  # noqa: F401  (registers the tables on Base.metadata)
+from src.utils.database import engine
+
+
+@pytest_asyncio.fixture
+async def db():
+    """A fresh schema per test; the engine is disposed so no connection outlives the test's loop."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy import inspect, select, text
+
+from src.models.core import Keyword
+from src.utils.database import add_missing_columns, engine
+
+
+@pytest.mark.asyncio
+async def test_missing_columns_and_indexes_are_added_to_an_existing_table():
+    async with engine.begin() as conn:  # keywords as deployed before `active` existed
+        await conn.execute(text(
+            "CREATE TABLE keywords (id INTEGER PRIMARY KEY, user_id INTEGER, text VARCHAR(255), "
+            "domain VARCHAR(255), device VARCHAR(50), location VARCHAR(255))"
+        ))
+        await conn.execute(text("INSERT INTO keywords VALUES (1, 1, 'kw', 'a.com', 'desktop', 'Sydney')"))
+    try:
+        assert await add_missing_columns(Keyword.__table__) == ["active"]
+        assert await add_missing_columns(Keyword.__table__) == []  # Safe to re-run
+
+        async with engine.connect() as conn:
+            assert (await conn.execute(select(Keyword.id, Keyword.active))).all() == [(1, True)]
+            indexes = await conn.run_sync(lambda c: {i["name"] for i in inspect(c).get_indexes("keywords")})
+        assert {"ix_keywords_active", "ix_keywords_serp"} <= indexes
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text("DROP TABLE keywords"))
+        await engine.dispose()
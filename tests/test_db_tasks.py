@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy import insert
+
+from src.models.core import Keyword
+from src.tasks.db_tasks import KeywordShard, stream_keywords
+
+
+@pytest.mark.asyncio
+async def test_serp_grouped_chunks_never_split_a_serp(db):
+    # Six domains track "dentist" and the ids interleave with other keywords
+    rows = [
+        {"id": i, "user_id": 1, "text": "dentist" if i % 2 else f"kw{i}", "domain": f"d{i}.com",
+         "location": "Sydney", "device": "desktop"}
+        for i in range(1, 13)
+    ]
+    async with db.begin() as conn:
+        await conn.execute(insert(Keyword), rows)
+
+    chunks = [chunk async for chunk in stream_keywords(chunk_size=4, group_serps=True)]
+
+    assert sorted(row.id for chunk in chunks for row in chunk) == list(range(1, 13))
+    holding = [chunk for chunk in chunks if any(row.text == "dentist" for row in chunk)]
+    assert len(holding) == 1 and sum(row.text == "dentist" for row in holding[0]) == 6
+
+    ranged = [row.id async for chunk in stream_keywords(chunk_size=4, shard=KeywordShard.parse("1-5"), group_serps=True)
+              for row in chunk]
+    assert sorted(ranged) == [1, 2, 3, 4]
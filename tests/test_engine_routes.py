@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy import insert
+
+from src.api import engine_routes
+from src.utils import gemini_client
+from src.utils.database import AsyncSessionLocal
+from src.utils.models import Project
+
+NOW = datetime.datetime.now(datetime.timezone.utc)
+
+
+@pytest_asyncio.fixture
+async def session(db):
+    async with db.begin() as conn:
+        await conn.run_sync(Project.__table__.create)
+        await conn.execute(insert(Project.__table__), [
+            {"id": 1, "user_id": "u1", "name": "mine", "mode": "global", "plan": "startup", "active": True, "created_at": NOW},
+            {"id": 2, "user_id": "u2", "name": "theirs", "mode": "global", "plan": "enterprise", "active": True, "created_at": NOW},
+        ])
+    async with AsyncSessionLocal() as session:
+        yield session
+    async with db.begin() as conn:
+        await conn.run_sync(Project.__table__.drop)
+
+
+@pytest.fixture
+def no_key(monkeypatch):
+    def fail(model_name=gemini_client.DEFAULT_MODEL):
+        raise ValueError("GOOGLE_API_KEY is not set in environment variables.")
+
+    monkeypatch.setattr(gemini_client, "get_gemini_agent", fail)
+
+
+@pytest.mark.asyncio
+async def test_stream_reports_an_agent_failure_as_an_error_event(session, no_key):
+    response = await engine_routes.stream_engine_asset(
+        "authority_architect", target="Link Building", project_id=None, session=session, user={"sub": "u1"}
+    )
+
+    events = [event async for event in response.body_iterator]
+    assert events == [engine_routes._sse("error", "Analysis unavailable due to API error.")]
+
+
+@pytest.mark.asyncio
+async def test_stream_cannot_bill_another_users_project(session, no_key):
+    with pytest.raises(HTTPException) as error:
+        await engine_routes.stream_engine_asset(
+            "authority_architect", target="Link Building", project_id=2, session=session, user={"sub": "u1"}
+        )
+    assert error.value.status_code == 404
+
+    assert await engine_routes._user_project_id(session, {"sub": "u1"}, None) == 1
+    assert await engine_routes._user_project_id(session, {"sub": "u2"}, 2) == 2
@@ -0,0 +1,128 @@
+import json
+
+import pytest
+from pydantic import BaseModel, SecretStr
+
+from src.utils import gemini_client
+from src.utils.gemini_client import JSON_MODE, GeminiAgent, schema_check
+from src.utils.response_cache import ResponseCache
+
+
+class Brief(BaseModel):
+    title: str
+    sections: list[str]
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class FakeModel:
+    """Answers each call with the next scripted response and keeps the prompts it saw."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        self.prompts.append(prompt)
+        return FakeResponse(self.responses.pop(0))
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.setattr(gemini_client.settings, "GOOGLE_API_KEY", SecretStr("test-key"))
+    monkeypatch.setattr(
+        gemini_client,
+        "prompt_cache",
+        ResponseCache(path=str(tmp_path / "gemini.sqlite"), ttl_seconds=60, max_bytes=10_000_000, enabled=True),
+    )
+    return GeminiAgent("test-model")
+
+
+VALID = json.dumps({"title": "Guide", "sections": ["a", "b"]})
+
+
+@pytest.mark.asyncio
+async def test_schema_mismatch_is_retried_with_the_validation_error(agent):
+    agent.model = FakeModel(json.dumps({"title": "Guide"}), VALID)
+
+    brief = await agent.generate_json("Write a brief", Brief, retries=2)
+
+    assert brief == Brief(title="Guide", sections=["a", "b"])
+    assert len(agent.model.prompts) == 2
+    assert "Your previous response was rejected (sections: Field required)" in agent.model.prompts[1]
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_the_retries(agent):
+    agent.model = FakeModel("not json", "[]", "{}")
+
+    assert await agent.generate_json("Write a brief", Brief, retries=2) is None
+    assert len(agent.model.prompts) == 3
+
+
+@pytest.mark.asyncio
+async def test_only_valid_responses_are_cached(agent):
+    agent.model = FakeModel(json.dumps({"title": 1}), VALID)
+    assert await agent.generate_json("Write a brief", Brief, retries=1) is not None
+
+    # The first prompt was answered badly and must not be replayed; the retry prompt's answer is
+    agent.model = FakeModel(VALID)
+    assert await agent.generate_json("Write a brief", Brief, retries=0) is not None
+    assert len(agent.model.prompts) == 1
+
+
+@pytest.mark.asyncio
+async def test_api_failures_are_not_retried(agent):
+    agent.model = None  # SDK not configured: every call returns the placeholder
+
+    assert await agent.generate_json("Write a brief", Brief, retries=2) is None
+
+
+class FakeStream:
+    """A streamed response: yields its chunks, then reports how the model finished."""
+
+    def __init__(self, chunks, finish_reason="STOP"):
+        self.chunks = chunks
+        self.usage_metadata = None
+        self.candidates = [type("Candidate", (), {"finish_reason": finish_reason})()]
+
+    async def __aiter__(self):
+        for text in self.chunks:
+            yield type("Chunk", (), {"text": text})()
+
+
+class FakeStreamingModel:
+    def __init__(self, *streams):
+        self.streams = list(streams)
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        return self.streams.pop(0)
+
+
+async def _collect(agent, **kwargs):
+    return "".join([text async for text in agent.generate_content_stream("Write a brief", JSON_MODE, **kwargs)])
+
+
+@pytest.mark.asyncio
+async def test_streams_are_cached_only_when_they_stop_normally_and_validate(agent):
+    half = VALID[: len(VALID) // 2]
+    agent.model = FakeStreamingModel(
+        FakeStream([half], finish_reason="MAX_TOKENS"),
+        FakeStream([half, "}"]),
+        FakeStream([VALID[:10], VALID[10:]]),
+    )
+    check = schema_check(Brief)
+
+    assert await _collect(agent, cacheable=check) == half  # Truncated by the model
+    assert await _collect(agent, cacheable=check) == half + "}"  # Stopped, but not a Brief
+    assert await _collect(agent, cacheable=check) == VALID
+    assert agent.model.calls == 3
+
+    assert await _collect(agent, cacheable=check) == VALID  # From the cache
+    assert agent.model.calls == 3
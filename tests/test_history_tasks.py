@@ -0,0 +1,55 @@
+import datetime
+
+import pytest
+from sqlalchemy import insert, select
+
+from src.models.core import RankingLog, RankingRollup
+from src.tasks.history_tasks import rollup_raw_history
+
+
+@pytest.mark.asyncio
+async def test_incremental_rollup_counts_url_change_across_its_boundary(db):
+    day1, day2 = datetime.datetime(2025, 1, 14, 6), datetime.datetime(2025, 1, 15, 6)
+    async with db.begin() as conn:
+        await conn.execute(insert(RankingLog), [
+            {"keyword_id": 1, "rank": 4, "url": "https://a.com/old", "created_at": day1},
+            {"keyword_id": 1, "rank": 3, "url": "https://a.com/new", "created_at": day2},
+        ])
+
+    await rollup_raw_history(datetime.date(2025, 1, 14))
+    await rollup_raw_history()  # Incremental: starts from the last rolled-up day
+
+    async with db.connect() as conn:
+        rollups = (await conn.execute(
+            select(RankingRollup.period_start, RankingRollup.samples, RankingRollup.url_changes)
+            .where(RankingRollup.period == "day").order_by(RankingRollup.period_start)
+        )).all()
+    assert [tuple(row) for row in rollups] == [
+        (datetime.date(2025, 1, 14), 1, 0),
+        (datetime.date(2025, 1, 15), 1, 1),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_url_change_counts_when_the_previous_sample_is_days_older(db):
+    # Harvests on the 16th and 17th failed: the previous sample is three days back
+    async with db.begin() as conn:
+        await conn.execute(insert(RankingLog), [
+            {"keyword_id": 1, "rank": 5, "url": "https://a.com/first", "created_at": datetime.datetime(2025, 1, 10, 6)},
+            {"keyword_id": 1, "rank": 4, "url": "https://a.com/old", "created_at": datetime.datetime(2025, 1, 15, 6)},
+            {"keyword_id": 1, "rank": 3, "url": "https://a.com/new", "created_at": datetime.datetime(2025, 1, 18, 6)},
+            {"keyword_id": 2, "rank": 9, "url": "https://b.com/", "created_at": datetime.datetime(2025, 1, 18, 6)},
+        ])
+
+    await rollup_raw_history(datetime.date(2025, 1, 18))
+
+    async with db.connect() as conn:
+        rollups = (await conn.execute(
+            select(RankingRollup.keyword_id, RankingRollup.period_start, RankingRollup.samples, RankingRollup.url_changes)
+            .where(RankingRollup.period == "day").order_by(RankingRollup.keyword_id)
+        )).all()
+    # Only the 18th is rolled up; the older samples just seed lag()
+    assert [tuple(row) for row in rollups] == [
+        (1, datetime.date(2025, 1, 18), 1, 1),
+        (2, datetime.date(2025, 1, 18), 1, 0),
+    ]
@@ -0,0 +1,99 @@
+import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from src.models.core import HarvestCheckpoint, Keyword
+from src.tasks import lease_tasks
+from src.tasks.db_tasks import stream_keywords
+from src.tasks.lease_tasks import claim_lease, complete_lease, heartbeat_lease, lease_shard, plan_harvest_leases
+
+HARVEST_DATE = datetime.date(2025, 1, 15)
+
+
+async def _add_keywords(db, ids, text=lambda i: f"kw{i:03d}"):
+    async with db.begin() as conn:
+        await conn.execute(insert(Keyword), [
+            {"id": i, "user_id": 1, "text": text(i), "domain": f"d{i}.com", "location": "Sydney", "device": "desktop"}
+            for i in ids
+        ])
+
+
+async def _lease_keywords(lease):
+    return [row.id async for chunk in stream_keywords(shard=lease_shard(lease)) for row in chunk]
+
+
+@pytest.mark.asyncio
+async def test_each_range_is_claimed_once(db):
+    await _add_keywords(db, range(1, 26))
+    assert await plan_harvest_leases(HARVEST_DATE, lease_size=10) == 3
+    assert await plan_harvest_leases(HARVEST_DATE, lease_size=10) == 3  # Idempotent across workers
+
+    first = await claim_lease("worker-a", HARVEST_DATE)
+    second = await claim_lease("worker-b", HARVEST_DATE)
+    third = await claim_lease("worker-a", HARVEST_DATE)
+    assert [first.seq, second.seq, third.seq] == [0, 1, 2]
+    assert await claim_lease("worker-c", HARVEST_DATE) is None
+    assert [await _lease_keywords(lease) for lease in (first, second, third)] == [
+        list(range(1, 11)), list(range(11, 21)), list(range(21, 26))
+    ]
+
+
+@pytest.mark.asyncio
+async def test_keywords_of_one_serp_share_a_lease_whatever_their_ids(db):
+    # 30 keywords over 6 SERPs, with each SERP's keywords spread across the id space
+    await _add_keywords(db, range(1, 31), text=lambda i: f"serp{i % 6}")
+    assert await plan_harvest_leases(HARVEST_DATE, lease_size=10) == 3
+
+    covered = []
+    while (lease := await claim_lease("worker-a", HARVEST_DATE)) is not None:
+        covered.append(await _lease_keywords(lease))
+    assert sorted(i for ids in covered for i in ids) == list(range(1, 31))
+    serps_per_lease = [{i % 6 for i in ids} for ids in covered]
+    assert sum(len(serps) for serps in serps_per_lease) == 6  # No SERP is in two leases
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_reclaimed_and_old_owner_loses_it(db, monkeypatch):
+    await _add_keywords(db, range(1, 5))
+    await plan_harvest_leases(HARVEST_DATE, lease_size=10)
+    lease = await claim_lease("worker-a", HARVEST_DATE, lease_seconds=60)
+    assert await heartbeat_lease(lease.id, "worker-a", lease_seconds=60)
+    assert await claim_lease("worker-b", HARVEST_DATE) is None  # Still held
+
+    later = datetime.datetime.utcnow() + datetime.timedelta(seconds=120)
+    monkeypatch.setattr(lease_tasks, "_now", lambda: later)
+    taken = await claim_lease("worker-b", HARVEST_DATE, lease_seconds=60)
+    assert (taken.id, taken.owner, taken.attempts) == (lease.id, "worker-b", 2)
+
+    assert not await heartbeat_lease(lease.id, "worker-a")
+    assert not await complete_lease(lease.id, "worker-a")
+    assert await heartbeat_lease(lease.id, "worker-b")
+
+
+@pytest.mark.asyncio
+async def test_range_with_unfinished_keywords_is_released_until_attempts_run_out(db, monkeypatch):
+    monkeypatch.setattr(lease_tasks.settings, "HARVEST_LEASE_MAX_ATTEMPTS", 2)
+    await _add_keywords(db, range(1, 4))
+    async with db.begin() as conn:  # Keyword 3 never gets a checkpoint
+        await conn.execute(insert(HarvestCheckpoint), [
+            {"harvest_date": HARVEST_DATE, "keyword_id": i} for i in (1, 2)
+        ])
+    await plan_harvest_leases(HARVEST_DATE, lease_size=10)
+
+    lease = await claim_lease("worker-a", HARVEST_DATE)
+    assert await complete_lease(lease.id, "worker-a") == "pending"
+    retry = await claim_lease("worker-b", HARVEST_DATE)
+    assert (retry.id, retry.attempts) == (lease.id, 2)
+    assert await complete_lease(retry.id, "worker-b") == "done"
+    assert await claim_lease("worker-a", HARVEST_DATE) is None
+
+
+@pytest.mark.asyncio
+async def test_fully_checkpointed_range_is_done(db):
+    await _add_keywords(db, range(1, 3))
+    async with db.begin() as conn:
+        await conn.execute(insert(HarvestCheckpoint), [{"harvest_date": HARVEST_DATE, "keyword_id": i} for i in (1, 2)])
+    await plan_harvest_leases(HARVEST_DATE, lease_size=10)
+    lease = await claim_lease("worker-a", HARVEST_DATE)
+    assert await complete_lease(lease.id, "worker-a") == "done"
@@ -0,0 +1,74 @@
+import datetime
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import insert, text
+from sqlalchemy.exc import OperationalError
+
+from src.utils.database import add_missing_columns
+from src.utils.metering import BudgetExceededError, Meter, metering_scope
+from src.utils.models import Project
+
+NOW = datetime.datetime.now(datetime.timezone.utc)  # Project.created_at must be timezone-aware
+
+
+@pytest_asyncio.fixture
+async def projects(db):
+    async with db.begin() as conn:
+        await conn.run_sync(Project.__table__.create)
+        await conn.execute(insert(Project.__table__), [
+            {"id": 1, "user_id": "u1", "name": "startup-site", "mode": "global", "plan": "startup", "active": True, "created_at": NOW},
+            {"id": 2, "user_id": "u1", "name": "big-site", "mode": "global", "plan": "enterprise", "active": True, "created_at": NOW},
+        ])
+    yield
+    async with db.begin() as conn:
+        await conn.run_sync(Project.__table__.drop)
+
+
+@pytest.fixture
+def meter(monkeypatch):
+    from src.utils import metering
+
+    monkeypatch.setattr(metering.settings, "METERING_ENABLED", True)
+    return Meter()
+
+
+@pytest.mark.asyncio
+async def test_budget_follows_the_plan_and_is_enforced(projects, meter):
+    assert await meter._project_budget(2) == 60.0
+    with metering_scope(project_id=1):
+        await meter.check_budget()
+        meter.record("gemini", "gemini-2.5-flash", cost=5.0)
+        with pytest.raises(BudgetExceededError) as error:
+            await meter.check_budget()
+    assert error.value.budget == 5.0
+
+
+@pytest.mark.asyncio
+async def test_unknown_project_is_refused_instead_of_getting_a_default_budget(projects, meter):
+    with metering_scope(project_id=999):
+        with pytest.raises(BudgetExceededError) as error:
+            await meter.check_budget()
+    assert error.value.budget is None
+    assert "does not exist" in str(error.value)
+
+
+@pytest.mark.asyncio
+async def test_unmigrated_projects_table_fails_closed_until_migrated(db, meter):
+    async with db.begin() as conn:  # projects as deployed before `plan` existed
+        await conn.execute(text(
+            "CREATE TABLE projects (id INTEGER PRIMARY KEY, user_id VARCHAR NOT NULL, name VARCHAR NOT NULL, "
+            "subscription_id VARCHAR, mode VARCHAR NOT NULL, active BOOLEAN NOT NULL, created_at DATETIME NOT NULL)"
+        ))
+        await conn.execute(text("INSERT INTO projects VALUES (1, 'u1', 'site', NULL, 'global', 1, '2025-01-01')"))
+    try:
+        with metering_scope(project_id=1):
+            with pytest.raises(OperationalError):
+                await meter.check_budget()
+
+            assert await add_missing_columns(Project.__table__) == ["plan"]
+            await meter.check_budget()
+        assert await meter._project_budget(1) == 5.0  # Existing projects start on 'startup'
+    finally:
+        async with db.begin() as conn:
+            await conn.execute(text("DROP TABLE projects"))
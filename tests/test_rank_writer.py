@@ -0,0 +1,80 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from src.models.core import HarvestCheckpoint, KeywordLatestRank, RankingLog
+from src.utils.rank_writer import RankHistoryWriter
+
+HARVEST_DATE = datetime.date(2025, 1, 15)
+
+
+async def _count(db, table) -> int:
+    async with db.connect() as conn:
+        return (await conn.execute(select(func.count()).select_from(table))).scalar()
+
+
+@pytest.mark.asyncio
+async def test_rows_are_written_in_batches(db):
+    writer = RankHistoryWriter(batch_size=10, flush_interval=5)
+    async with writer:
+        for keyword_id in range(25):
+            await writer.add(keyword_id=keyword_id, rank=keyword_id + 1, url=f"https://a.com/{keyword_id}")
+
+    assert writer.rows_written == 25
+    assert writer.flushes == 3  # 10 + 10 + the partial batch flushed on close
+    assert await _count(db, RankingLog) == 25
+    assert await _count(db, KeywordLatestRank) == 25
+
+
+@pytest.mark.asyncio
+async def test_partial_batch_is_flushed_after_the_interval(db):
+    writer = RankHistoryWriter(batch_size=100, flush_interval=0.05)
+    async with writer:
+        seq = await writer.add(keyword_id=1, rank=3, url="https://a.com/")
+        await asyncio.wait_for(writer.wait_settled(seq), 2)
+        assert writer.rows_written == 1
+        assert await _count(db, RankingLog) == 1
+
+
+@pytest.mark.asyncio
+async def test_wait_settled_waits_for_every_earlier_row(db):
+    writer = RankHistoryWriter(batch_size=5, flush_interval=0.05, writers=3)
+    async with writer:
+        for keyword_id in range(12):
+            await writer.add(keyword_id=keyword_id, rank=1, url="https://a.com/")
+        await asyncio.wait_for(writer.wait_settled(writer.last_seq), 2)
+        assert writer.rows_written == 12
+
+
+@pytest.mark.asyncio
+async def test_checkpointed_keywords_are_written_once_per_date(db):
+    async with RankHistoryWriter(batch_size=10, flush_interval=0.05, harvest_date=HARVEST_DATE) as writer:
+        await writer.add(keyword_id=1, rank=4, url="https://a.com/")
+        await writer.add(keyword_id=2, rank=9, url="https://a.com/")
+    async with RankHistoryWriter(batch_size=10, flush_interval=0.05, harvest_date=HARVEST_DATE) as rerun:
+        await rerun.add(keyword_id=1, rank=5, url="https://a.com/")
+        await rerun.add(keyword_id=3, rank=2, url="https://a.com/")
+
+    assert (rerun.rows_written, rerun.rows_skipped) == (1, 1)
+    assert await _count(db, RankingLog) == 3
+    assert await _count(db, HarvestCheckpoint) == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_rolls_back_rows_and_checkpoints(db, monkeypatch):
+    import src.utils.rank_writer as rank_writer
+
+    async def broken_upsert(conn, rows):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(rank_writer, "upsert_latest_ranks", broken_upsert)
+    writer = RankHistoryWriter(batch_size=10, flush_interval=0.05, harvest_date=HARVEST_DATE)
+    async with writer:
+        seq = await writer.add(keyword_id=1, rank=4, url="https://a.com/")
+        await asyncio.wait_for(writer.wait_settled(seq), 2)  # Failed rows still settle
+
+    assert (writer.rows_written, writer.rows_failed) == (0, 1)
+    assert await _count(db, RankingLog) == 0
+    assert await _count(db, HarvestCheckpoint) == 0  # So the keyword is harvested again
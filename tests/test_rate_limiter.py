@@ -0,0 +1,70 @@
+import asyncio
+import datetime
+import time
+from email.utils import format_datetime
+
+import pytest
+
+from src.utils.dataforseo_client import _retry_after
+from src.utils.rate_limiter import AdaptiveLimiter
+
+
+@pytest.mark.asyncio
+async def test_window_halves_on_throttle_and_grows_additively():
+    limiter = AdaptiveLimiter("test", rate=1000, max_concurrency=8, default_pause=0)
+    for expected in (4, 2, 1, 1):  # Never below min_concurrency
+        await limiter.acquire()
+        await limiter.release(throttled=True, retry_after=0)
+        assert limiter.window == expected
+
+    for _ in range(3):
+        await limiter.acquire()
+        await limiter.release()
+    assert limiter.window == pytest.approx(2.9, abs=0.01)  # 1 -> 2 -> 2.5 -> 2.9: about +1 per window of successes
+
+    limiter.window = 7.9
+    await limiter.acquire()
+    await limiter.release()
+    assert limiter.window == 8  # Capped at max_concurrency
+
+
+@pytest.mark.asyncio
+async def test_window_caps_calls_in_flight():
+    limiter = AdaptiveLimiter("test", rate=1000, max_concurrency=2)
+    await limiter.acquire()
+    await limiter.acquire()
+    third = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.05)
+    assert not third.done()
+
+    await limiter.release()
+    await asyncio.wait_for(third, 1)
+    assert limiter.in_flight == 2
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_every_caller():
+    limiter = AdaptiveLimiter("test", rate=1000, max_concurrency=4)
+    await limiter.acquire()
+    await limiter.release(throttled=True, retry_after=0.3)
+
+    started = time.monotonic()
+    await asyncio.gather(limiter.acquire(), limiter.acquire())
+    assert time.monotonic() - started >= 0.28
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_caps_the_rate():
+    limiter = AdaptiveLimiter("test", rate=20, max_concurrency=100, burst=1)
+    started = time.monotonic()
+    for _ in range(5):
+        await limiter.acquire()
+    assert time.monotonic() - started >= 0.18  # 4 refills at 20/s
+
+
+def test_retry_after_header_parsing():
+    assert _retry_after("3") == 3.0
+    assert _retry_after(None) is None and _retry_after("soon") is None
+    in_ten = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=10)
+    assert 8 <= _retry_after(format_datetime(in_ten, usegmt=True)) <= 10
+    assert _retry_after("-5") == 0.0
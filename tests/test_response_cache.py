@@ -0,0 +1,92 @@
+import asyncio
+import random
+
+import pytest
+
+from src.utils import response_cache
+from src.utils.response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(path=str(tmp_path / "cache.sqlite"), ttl_seconds=60, max_bytes=10_000_000, enabled=True)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.asyncio
+async def test_entries_expire_after_the_ttl(cache, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    await cache.set("serp", {"q": 1}, {"rows": [1, 2]})
+    assert await cache.get("serp", {"q": 1}) == {"rows": [1, 2]}
+
+    clock.now += 61
+    assert await cache.get("serp", {"q": 1}) is None
+    assert cache.hits == 1 and cache.misses == 1
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entries_are_evicted_over_the_size_cap(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite"), ttl_seconds=60, max_bytes=2500, enabled=True)
+    blob = {"payload": random.Random(7).randbytes(1000).hex()}  # ~1KB even compressed
+    for name in ("a", "b"):
+        clock.now += 1
+        await cache.set("serp", name, blob)
+    clock.now += 1
+    assert await cache.get("serp", "a") is not None  # "a" is now more recent than "b"
+    clock.now += 1
+    await cache.set("serp", "c", blob)
+
+    assert cache.evictions == 1
+    assert await cache.get("serp", "b") is None
+    assert await cache.get("serp", "a") is not None and await cache.get("serp", "c") is not None
+
+
+@pytest.mark.asyncio
+async def test_memory_tier_is_a_bounded_lru(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite"), ttl_seconds=60, enabled=True, memory_entries=2)
+    for name in ("a", "b", "c"):
+        await cache.set("serp", name, {"name": name})
+    assert list(cache._memory) == [response_cache.cache_key("serp", name) for name in ("b", "c")]
+
+    assert await cache.get("serp", "c") == {"name": "c"}
+    assert await cache.get("serp", "a") == {"name": "a"}  # Falls through to disk
+    assert (cache.memory_hits, cache.hits) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_fetch(cache):
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"rows": calls}
+
+    results = await asyncio.gather(*(cache.get_or_fetch("serp", {"q": 1}, fetch) for _ in range(5)))
+    assert calls == 1 and results == [{"rows": 1}] * 5
+    assert await cache.get_or_fetch("serp", {"q": 1}, fetch) == {"rows": 1}
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_fetch_reaches_every_waiter_and_is_not_cached(cache):
+    async def fetch():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream down")
+
+    results = await asyncio.gather(
+        *(cache.get_or_fetch("serp", {"q": 2}, fetch) for _ in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert await cache.get("serp", {"q": 2}) is None
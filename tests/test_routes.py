@@ -0,0 +1,50 @@
+import datetime
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import insert
+
+from src.api.routes import router
+from src.models.core import RankingRollup
+from src.utils.database import AsyncSessionLocal, get_db
+from src.utils.models import Project
+
+
+@pytest.mark.asyncio
+async def test_history_and_usage_read_through_the_injected_session(db):
+    today = datetime.date.today()
+    async with db.begin() as conn:
+        await conn.execute(insert(RankingRollup), [{
+            "keyword_id": 1, "period": "day", "period_start": today, "min_rank": 3,
+            "max_rank": 5, "avg_rank": 4.0, "samples": 2, "url_changes": 0,
+        }])
+        await conn.run_sync(Project.__table__.create)
+        await conn.execute(insert(Project.__table__), [{
+            "id": 7, "user_id": "u1", "name": "site", "mode": "global", "plan": "startup", "active": True,
+            "created_at": datetime.datetime.now(datetime.timezone.utc),
+        }])
+
+    sessions = []
+
+    async def override_db():
+        async with AsyncSessionLocal() as session:
+            sessions.append(session)
+            yield session
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_db] = override_db
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            history = await client.get("/keywords/1/history", params={"days": 30})
+            usage = await client.get("/usage/7")
+    finally:
+        async with db.begin() as conn:
+            await conn.run_sync(Project.__table__.drop)
+
+    assert history.status_code == 200
+    assert [point["avg_rank"] for point in history.json()["points"]] == [4.0]
+    assert usage.status_code == 200
+    assert (usage.json()["spent"], usage.json()["budget"]) == (0, 5.0)
+    assert len(sessions) == 2
@@ -0,0 +1,39 @@
+import datetime
+
+import pytest
+
+from src.utils import serp_archive
+from src.utils.serp_archive import SerpArchive, iter_serps, read_serps, replay_domain_ranks
+
+
+def _response(keyword):
+    items = [{"type": "organic", "domain": f"d{i}.com", "rank_group": i + 1, "url": f"https://d{i}.com/{keyword}"} for i in range(3)]
+    return {"tasks": [{"status_code": 20000, "result": [{"items": items}]}]}
+
+
+@pytest.mark.asyncio
+async def test_iterators_stream_the_archive_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(serp_archive, "READ_BATCH_ROWS", 4)
+    archive = SerpArchive(root=str(tmp_path), flush_rows=10, enabled=True)
+    for i in range(25):
+        await archive.add((f"kw{i:02d}", "Sydney" if i % 2 else "Perth", "desktop"), _response(f"kw{i:02d}"))
+    await archive.flush()
+    today = datetime.datetime.utcnow().date()
+
+    rows = iter_serps(today, root=str(tmp_path))
+    first = next(rows)  # Yields before the rest of the range is read
+    assert len(first["payload"]["items"]) == 3
+    assert 1 + sum(1 for _ in rows) == 25
+
+    replayed = dict(replay_domain_ranks(today, location="Sydney", root=str(tmp_path)))
+    assert len(replayed) == 12
+    assert replayed[("kw03", "Sydney", "desktop")]["d1.com"] == (2, "https://d1.com/kw03")
+    assert read_serps(today, location="Sydney", root=str(tmp_path)).num_rows == 12
+
+
+def test_missing_archive_reads_as_empty(tmp_path):
+    missing = str(tmp_path / "none")
+    today = datetime.date.today()
+    assert list(iter_serps(today, root=missing)) == []
+    assert list(replay_domain_ranks(today, root=missing)) == []
+    assert read_serps(today, root=missing).num_rows == 0
@@ -0,0 +1,61 @@
+import datetime
+
+import numpy as np
+import pytest
+from sqlalchemy import insert, select
+
+from src.models.core import KeywordTrend
+from src.tasks.trend_tasks import compute_trends, store_trends
+
+AS_OF = datetime.date(2025, 1, 31)
+NAN = np.nan
+
+
+def _trends(*rows):
+    ranks = np.array(rows, dtype=float)
+    return compute_trends(np.arange(1, len(rows) + 1), ranks, AS_OF).set_index("keyword_id")
+
+
+def test_deltas_carry_the_last_known_rank_across_gaps():
+    # 31 days: rank 20 on day 0, a gap, 15 a week before as_of, missing on as_of itself
+    row = [20.0] + [NAN] * 22 + [15.0] + [NAN] * 6 + [NAN]
+    trend = _trends(row).loc[1]
+    assert trend.samples == 2
+    assert trend.current_rank == 15.0  # Carried forward to as_of
+    assert trend.delta_7d == 0.0
+    assert trend.delta_30d == -5.0
+
+
+def test_page_1_entry_and_exit_dates():
+    entered = [30.0] * 28 + [8.0, 7.0, 6.0]
+    left = [5.0] * 25 + [12.0, NAN, NAN, 14.0, 15.0, 16.0]
+    trends = _trends(entered, left)
+
+    assert trends.loc[1].page_1_event == "entered"
+    assert trends.loc[1].page_1_event_date == datetime.date(2025, 1, 29)
+    assert bool(trends.loc[1].on_page_1)
+    assert trends.loc[2].page_1_event == "left"
+    assert trends.loc[2].page_1_event_date == datetime.date(2025, 1, 26)
+    assert not bool(trends.loc[2].on_page_1)
+
+
+def test_keywords_without_samples_are_dropped_and_flat_ranks_have_no_event():
+    trends = _trends([NAN] * 31, [4.0] * 31)
+    assert list(trends.index) == [2]
+    flat = trends.loc[2]
+    assert flat.page_1_event is None and flat.volatility == 0.0 and flat.slope == 0.0
+
+
+@pytest.mark.asyncio
+async def test_stale_trends_are_removed_even_when_no_keyword_is_left_in_the_window(db):
+    async with db.begin() as conn:
+        await conn.execute(insert(KeywordTrend), [{
+            "keyword_id": 1, "as_of": AS_OF - datetime.timedelta(days=1), "samples": 3,
+            "current_rank": 4.0, "volatility": 0.5, "on_page_1": True,
+        }])
+
+    empty = compute_trends(np.arange(0), np.empty((0, 31)), AS_OF)
+    assert await store_trends(empty, AS_OF) == 0
+
+    async with db.connect() as conn:
+        assert (await conn.execute(select(KeywordTrend.keyword_id))).all() == []